@@ -0,0 +1,81 @@
+
+
+"""Account Snapshot.
+
+This module loads the IAM users and groups of an account in one paginated
+get_account_authorization_details call, so the account scan and the key
+actions can read user tags, group memberships and inline policy names from
+memory instead of calling IAM per user.
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet
+
+from config import log
+
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """The parts of an IAM user the key rotation needs."""
+
+    user_name: str
+    arn: str
+    tags: Dict[str, str] = field(default_factory=dict)
+    groups: FrozenSet[str] = frozenset()
+    inline_policy_names: FrozenSet[str] = frozenset()
+
+
+@dataclass
+class AccountSnapshot:
+    """Users and group memberships of an account at load time."""
+
+    # user name -> user, in the order returned by IAM
+    users: Dict[str, UserSnapshot] = field(default_factory=dict)
+
+    # group name -> names of the member users
+    group_members: Dict[str, FrozenSet[str]] = field(default_factory=dict)
+
+    def get_user(self, user_name):
+        """
+        :return The user, or None if it did not exist at load time.
+        """
+        return self.users.get(user_name)
+
+
+def load_account_snapshot(iam_client):
+    """
+    Loads all users and groups of the account. Policy documents are not
+    kept, only the inline policy names.
+
+    :return The AccountSnapshot.
+    """
+    users = {}
+    group_names = set()
+
+    paginator = iam_client.get_paginator('get_account_authorization_details')
+    for page in paginator.paginate(Filter=['User', 'Group']):
+        for user in page.get('UserDetailList', []):
+            users[user['UserName']] = UserSnapshot(
+                user_name=user['UserName'],
+                arn=user['Arn'],
+                tags={tag['Key']: tag['Value']
+                      for tag in user.get('Tags', [])},
+                groups=frozenset(user.get('GroupList', [])),
+                inline_policy_names=frozenset(
+                    policy['PolicyName']
+                    for policy in user.get('UserPolicyList', [])))
+        for group in page.get('GroupDetailList', []):
+            group_names.add(group['GroupName'])
+
+    members = {group_name: set() for group_name in group_names}
+    for user in users.values():
+        for group_name in user.groups:
+            members.setdefault(group_name, set()).add(user.user_name)
+
+    log.info(
+        f'Loaded account snapshot with {len(users)} users and'
+        f' {len(members)} groups.')
+    return AccountSnapshot(
+        users=users,
+        group_members={group_name: frozenset(user_names)
+                       for group_name, user_names in members.items()})
@@ -28,9 +28,76 @@ class Config:
     # script
     iamExemptionGroup = os.getenv('IAMExemptionGroup')
 
+    # How the key inventory of an account is built. 'api' lists the users
+    # and keys of the account, 'credential_report' reads the IAM credential
+    # report and only looks up key IDs for users with pending actions
+    scanMode = os.getenv('ScanMode', 'api').lower()
+
+    # Number of worker threads evaluating the users of an account
+    # concurrently. 1 evaluates users serially.
+    userScanWorkers = int(os.getenv('UserScanWorkers', 4))
+
+    # Number of users whose actions are executed concurrently. The actions
+    # of one user always run in order.
+    actionWorkers = int(os.getenv('ActionWorkers', 4))
+
+    # Flag- Load users, group memberships and tags of an account with one
+    # paginated GetAccountAuthorizationDetails call instead of per user calls
+    accountSnapshot = str(os.getenv('AccountSnapshot')).lower() == 'true'
+
+    # Store keeping the key dates and next evaluation date of each user,
+    # so users and accounts that are not due are skipped.
+    # 'none', 'sqlite' or 'dynamodb'. The SQLite file is local to a
+    # container, it is meant for local runs
+    keyStateStore = os.getenv('KeyStateStore', 'none').lower()
+
+    # File of the SQLite key state store
+    keyStatePath = os.getenv('KeyStatePath', '/tmp/key_state.sqlite')
+
+    # Table of the DynamoDB key state store
+    keyStateTable = os.getenv('KeyStateTable')
+
+    # Days after which an account and its users are scanned again even
+    # if nothing is due, to pick up keys created or deleted since
+    keyStateMaxAge = int(os.getenv('KeyStateMaxAgeDays', 7))
+
+    # Store keeping the progress of account scans that are suspended
+    # before the function times out and continued by a new invocation.
+    # 'none', 'file' or 's3'
+    scanCheckpointStore = os.getenv('ScanCheckpointStore', 'none').lower()
+
+    # Directory of the file checkpoint store, shared by all containers of
+    # the function, e.g. an EFS mount. /tmp is local to a container
+    scanCheckpointPath = os.getenv('ScanCheckpointPath')
+
+    # Bucket and key prefix of the S3 checkpoint store
+    scanCheckpointBucket = os.getenv('ScanCheckpointBucket')
+    scanCheckpointPrefix = os.getenv('ScanCheckpointPrefix',
+                                     'scan-checkpoints/')
+
+    # A scan or the execution of its actions is suspended when fewer
+    # seconds than this are left in the invocation, enough to finish the
+    # users in flight, notify the executed actions and store the checkpoint
+    scanTimeBuffer = int(os.getenv('ScanTimeBufferSeconds', 60))
+
     # The tag key used to indicate the owner of an IAM user resource
     resourceOwnerTag = os.getenv('ResourceOwnerTag')
 
+    # Flag- Collect resource owner actions of all accounts of a run and
+    # send one digest per owner instead of one email per owner and account
+    ownerDigest = str(os.getenv('OwnerDigest')).lower() == 'true'
+
+    # Store keeping the owner digest entries until they are sent. The
+    # SQLite store is local to a container, only the DynamoDB store spans
+    # the invocations of an inventory run
+    digestStore = os.getenv('DigestStore', 'sqlite').lower()
+
+    # File of the SQLite digest store
+    digestStorePath = os.getenv('DigestStorePath', '/tmp/owner_digest.sqlite')
+
+    # Table of the DynamoDB digest store
+    digestTable = os.getenv('DigestTable')
+
     # The Arn of the Lambda Function used for Notification
     notifierLambdaArn = os.getenv('NotifierArn')
 
@@ -40,6 +107,10 @@ class Config:
     # The IAM Role Session Name
     roleSessionName = os.getenv('RoleSessionName')
 
+    # The cached central account session is refreshed when its credentials
+    # expire within this many seconds. Must exceed the function timeout.
+    sessionRefreshMargin = int(os.getenv('SessionRefreshMarginSeconds', 900))
+
     # The Secret Manager
     storeSecretsInCentralAccount = str(os.getenv('StoreSecretsInCentralAccount')).lower() == 'true'
 
@@ -0,0 +1,142 @@
+
+
+"""Credential Report Handler.
+
+This module provides the functionality to build the key inventory of an
+account from the IAM credential report instead of per-user API calls.
+"""
+
+import csv
+import dataclasses
+import datetime
+import io
+import time
+
+from config import log
+from user_pipeline import list_user_access_keys
+
+# Column prefixes for the two access key slots in the credential report
+KEY_SLOTS = ('access_key_1', 'access_key_2')
+
+# Row used by IAM to report on the account root user
+ROOT_ACCOUNT_USER = '<root_account>'
+
+
+def get_credential_report(iam_client, max_wait_seconds=60, poll_interval=2):
+    """
+    Generates the credential report (IAM reuses a report younger than
+    four hours) and waits for it to be ready.
+
+    :return The raw CSV content of the credential report.
+    """
+    waited = 0
+    while True:
+        state = iam_client.generate_credential_report()['State']
+        if state == 'COMPLETE':
+            break
+        if waited >= max_wait_seconds:
+            raise TimeoutError(
+                f'Credential report was not ready after {waited} seconds.')
+        log.info(f'--Credential report state is [{state}], waiting.')
+        time.sleep(poll_interval)
+        waited += poll_interval
+
+    return iam_client.get_credential_report()['Content']
+
+
+def _parse_report_date(value):
+    if not value or value in ('N/A', 'not_supported', 'no_information'):
+        return None
+    return datetime.datetime.fromisoformat(value)
+
+
+def parse_credential_report(report_content):
+    """
+    Streams the credential report CSV one row at a time.
+
+    Each key record carries the same fields as an entry of
+    list_access_keys()['AccessKeyMetadata'] plus a prefetched LastUsedDate,
+    so get_actions_for_keys does not need to look it up. The report does
+    not contain key IDs; AccessKeyId holds the slot name until the key is
+    resolved with resolve_access_key_ids.
+
+    :return A generator of (user name, list of key records) tuples.
+    """
+    if isinstance(report_content, bytes):
+        report_content = report_content.decode('utf-8')
+
+    for row in csv.DictReader(io.StringIO(report_content)):
+        user_name = row['user']
+        if user_name == ROOT_ACCOUNT_USER:
+            continue
+
+        access_key_metadata = []
+        for slot in KEY_SLOTS:
+            create_date = _parse_report_date(row.get(f'{slot}_last_rotated'))
+            if create_date is None:
+                continue
+            active = row.get(f'{slot}_active', '').lower() == 'true'
+            access_key_metadata.append({
+                'UserName': user_name,
+                'AccessKeyId': slot,
+                'KeySlot': slot,
+                'Status': 'Active' if active else 'Inactive',
+                'CreateDate': create_date,
+                'LastUsedDate': _parse_report_date(
+                    row.get(f'{slot}_last_used_date'))
+            })
+
+        yield user_name, access_key_metadata
+
+
+def report_matches_keys(access_key_metadata, access_keys):
+    """
+    Compares the key records of a credential report row with the keys the
+    user has now. The report can be up to four hours old, keys may have
+    been created, deleted or changed their status since.
+
+    :param access_key_metadata: Key records of parse_credential_report
+    :param access_keys: AccessKeyMetadata of list_access_keys
+    :return True if the user has the same keys, with the same status.
+    """
+    def key_states(keys):
+        return sorted((key['CreateDate'].replace(microsecond=0),
+                       key['Status']) for key in keys)
+
+    return key_states(access_key_metadata) == key_states(access_keys)
+
+
+def resolve_access_key_ids(iam_client, user_name, user_actions,
+                           access_keys=None):
+    """
+    Replaces the slot placeholders of credential report key records with
+    the real key IDs. Keys are matched on their creation date, which the
+    report exposes as the last rotated date.
+
+    :param access_keys: AccessKeyMetadata of the user, listed if None
+    :return The actions whose key could be resolved.
+    """
+    if access_keys is None:
+        access_keys = list_user_access_keys(iam_client, user_name)
+    key_ids_by_create_date = {
+        key['CreateDate'].replace(microsecond=0): key['AccessKeyId']
+        for key in access_keys
+    }
+
+    resolved_actions = []
+    for action in user_actions:
+        key = action.key
+        if key.key_slot:
+            access_key_id = key_ids_by_create_date.get(
+                key.create_date.replace(microsecond=0))
+            if access_key_id is None:
+                log.warning(
+                    f'--User [{user_name}] key in slot [{key.key_slot}] '
+                    f'no longer exists. Skipping {action.action.value}.')
+                continue
+            action = dataclasses.replace(
+                action, key=dataclasses.replace(
+                    key, access_key_id=access_key_id, key_slot=None))
+        resolved_actions.append(action)
+
+    return resolved_actions
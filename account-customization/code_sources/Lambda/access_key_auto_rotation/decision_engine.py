@@ -0,0 +1,571 @@
+
+
+"""Key Decision Engine.
+
+This module maps the state of the access keys of a single user to the
+actions that should be taken on them. It performs no I/O: key records must
+already carry their LastUsedDate, and the current time is passed in.
+
+The rules are looked up in a decision table keyed on
+(key count, active key count, expired active keys, expired inactive keys).
+"""
+
+import datetime
+
+from collections import namedtuple
+from dataclasses import dataclass
+from enum import Enum
+from typing import Optional
+
+
+class ActionReasons(Enum):
+    UNUSED_EXPIRED_KEY = 'Expired key has never been used.'
+    EXPIRED_ACTIVE_KEY = 'Active key has expired.'
+    FORCED_ROTATION = 'Forced active key rotation.'
+    EXPIRED_ACTIVE_KEY_CONFLICT_LRU = 'Expired active key with conflict, ' \
+                                      'least recently used.'
+    EXPIRED_INACTIVE_KEY_CONFLICT = 'Expired key with conflict, already ' \
+                                    'inactive.'
+    FORCED_ROTATION_CONFLICT_LRU = 'Forced active key rotation with conflict, ' \
+                                   'least recently used.'
+    FORCED_INACTIVE_KEY_CONFLICT = 'Forced rotation with conflict, already ' \
+                                   'inactive.'
+    INSTALL_GRACE_PERIOD_END = 'Installation grace period has ended.'
+    RECOVER_GRACE_PERIOD_END = 'Recovery grace period has ended.'
+    KEY_PENDING_ROTATION = 'Key will be rotated soon.'
+    KEY_PENDING_DEACTIVATION = 'Key will be deactivated soon, ' \
+                               'please install new key.'
+    KEY_PENDING_DELETION = 'Key will be permanently deleted soon, ' \
+                           'please validate new key.'
+    KEY_PENDING_EXPIRATION_CONFLICT = 'Key will expire soon, cannot be ' \
+                                      'rotated due to presence of other key.'
+    KEY_PENDING_DELETION_CONFLICT = 'Key will be permanently deleted soon, ' \
+                                    'due to conflict.'
+    UNUSED_KEY_PENDING_DELETION = 'Key will be permanently deleted soon, ' \
+                                  'key is about to expire and has never' \
+                                  ' been used.'
+
+
+class ActionType(Enum):
+    ROTATE = 'ROTATE'
+    DEACTIVATE = 'DEACTIVATE'
+    DELETE = 'DELETE'
+    ROTATE_AND_DELETE = 'ROTATE_AND_DELETE'
+    WARN = 'WARN'
+
+
+@dataclass(frozen=True, slots=True)
+class KeyRecord:
+    """The parts of an access key an action needs."""
+
+    user_name: str
+    access_key_id: str
+    create_date: datetime.datetime
+    # credential report slot of a key whose access key id is not known yet
+    key_slot: Optional[str] = None
+
+    @classmethod
+    def from_metadata(cls, key):
+        return cls(key['UserName'], key['AccessKeyId'], key['CreateDate'],
+                   key.get('KeySlot'))
+
+
+@dataclass(frozen=True, slots=True)
+class Action:
+    """An action to take on, or a warning about, an access key."""
+
+    action: ActionType
+    key: KeyRecord
+    reason: ActionReasons
+    action_date: Optional[datetime.datetime] = None
+    # the resource owner of the key's user
+    resource_email: Optional[str] = None
+
+
+def group_actions(action_queue, key_function):
+    """
+    Groups actions in one pass. Actions without a key (None) are left out.
+
+    :return Dict of key -> list of actions, in queue order.
+    """
+    groups = {}
+    for action in action_queue:
+        group_key = key_function(action)
+        if group_key is not None:
+            groups.setdefault(group_key, []).append(action)
+    return groups
+
+
+def serialize_action(action):
+    """
+    Serializes an action as a compact list for a scan checkpoint.
+
+    :return [action type, user name, access key id, reason name,
+        action date or None, resource email or None]
+    """
+    return [action.action.value, action.key.user_name,
+            action.key.access_key_id, action.reason.name,
+            action.action_date.isoformat() if action.action_date else None,
+            action.resource_email]
+
+
+def deserialize_action(values):
+    """
+    Restores an action of serialize_action. The key creation date is not
+    serialized.
+
+    :return The Action.
+    """
+    action_type, user_name, access_key_id, reason, action_date, \
+        resource_email = values
+    return Action(
+        ActionType(action_type),
+        KeyRecord(user_name, access_key_id, None),
+        ActionReasons[reason],
+        datetime.datetime.fromisoformat(action_date) if action_date else None,
+        resource_email)
+
+
+@dataclass(frozen=True)
+class Thresholds:
+    """Periods driving the key rotation rules."""
+
+    rotation_period: datetime.timedelta
+    warn_period: datetime.timedelta
+    installation_grace_period: datetime.timedelta
+    recovery_grace_period: datetime.timedelta
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            rotation_period=datetime.timedelta(days=config.rotationPeriod),
+            warn_period=datetime.timedelta(
+                days=config.pending_action_warn_period),
+            installation_grace_period=datetime.timedelta(
+                days=config.installation_grace_period),
+            recovery_grace_period=datetime.timedelta(
+                days=config.recovery_grace_period))
+
+
+# Derived dates of a key record, computed once per evaluation
+KeyState = namedtuple(
+    'KeyState', ['key', 'active', 'create_date', 'last_used_date',
+                 'expire_date'])
+
+# Values shared by all rules during one evaluation
+RuleContext = namedtuple(
+    'RuleContext', ['now', 'warn_by', 'thresholds', 'force_rotate'])
+
+
+def _action(action, state, reason, action_date=None):
+    return Action(action, state.key, reason, action_date)
+
+
+def _split_active_inactive(states):
+    if states[0].active:
+        return states[0], states[1]
+    return states[1], states[0]
+
+
+def _split_expired_unexpired(states, now):
+    if states[0].expire_date <= now:
+        return states[0], states[1]
+    return states[1], states[0]
+
+
+def _pick_key_to_delete(states):
+    """
+    Picks the least recently used key, or the one that has never been
+    used, or the oldest one if neither has been used.
+
+    :return The key to delete and the key to rotate.
+    """
+    first, second = states
+    if first.last_used_date and second.last_used_date:
+        if second.last_used_date < first.last_used_date:
+            return second, first
+        return first, second
+    if first.last_used_date:
+        return second, first
+    if second.last_used_date:
+        return first, second
+    if first.create_date <= second.create_date:
+        return first, second
+    return second, first
+
+
+def _no_action(states, ctx):
+    return []
+
+
+def _single_active_expired(states, ctx):
+    # key is expired and needs to be rotated
+    return [_action(ActionType.ROTATE, states[0], ActionReasons.EXPIRED_ACTIVE_KEY)]
+
+
+def _single_active_valid(states, ctx):
+    key = states[0]
+    # force rotate key
+    if ctx.force_rotate:
+        return [_action(ActionType.ROTATE, key, ActionReasons.FORCED_ROTATION)]
+    # warn if key is about to expire
+    if key.expire_date <= ctx.warn_by:
+        return [_action(ActionType.WARN, key, ActionReasons.KEY_PENDING_ROTATION,
+                        key.expire_date)]
+    return []
+
+
+def _single_inactive(states, ctx):
+    key = states[0]
+    # all we can do here is calculate grace period based on creation
+    delete_date = key.create_date + \
+        ctx.thresholds.installation_grace_period + \
+        ctx.thresholds.recovery_grace_period
+
+    # recovery period has ended
+    if delete_date <= ctx.now:
+        return [_action(ActionType.DELETE, key,
+                        ActionReasons.RECOVER_GRACE_PERIOD_END)]
+    # warn of pending deletion
+    if delete_date <= ctx.warn_by:
+        return [_action(ActionType.WARN, key, ActionReasons.KEY_PENDING_DELETION,
+                        delete_date)]
+    return []
+
+
+def _inactive_pair_expired(states, ctx):
+    # both keys are inactive and expired, just delete them
+    return [_action(ActionType.DELETE, key, ActionReasons.RECOVER_GRACE_PERIOD_END)
+            for key in states]
+
+
+def _inactive_pair_one_expired(states, ctx):
+    # maybe someone deactivated the new key accidentally?
+    # respect the recovery grace period on the inactive key
+    if states[1].create_date < states[0].create_date:
+        expired_key, unexpired_key = states[1], states[0]
+    else:
+        expired_key, unexpired_key = states[0], states[1]
+    # use the creation date of the unexpired key
+    # to guess when the expired key was deactivated
+    expired_key_delete_date = unexpired_key.create_date + \
+        ctx.thresholds.installation_grace_period + \
+        ctx.thresholds.recovery_grace_period
+    unexpired_key_rotation_date = unexpired_key.expire_date
+
+    # delete the expired key if grace period is over
+    if expired_key_delete_date <= ctx.now:
+        actions = [_action(ActionType.DELETE, expired_key,
+                           ActionReasons.RECOVER_GRACE_PERIOD_END)]
+        # warn if other key is about to be rotated
+        if unexpired_key_rotation_date <= ctx.warn_by:
+            actions.append(_action(ActionType.WARN, unexpired_key,
+                                   ActionReasons.KEY_PENDING_ROTATION,
+                                   unexpired_key_rotation_date))
+        return actions
+    # also warn if unexpired key is about to expire and be rotated
+    # expired will be deleted due to conflict
+    if unexpired_key_rotation_date <= ctx.warn_by:
+        return [
+            _action(ActionType.WARN, expired_key,
+                    ActionReasons.KEY_PENDING_DELETION_CONFLICT,
+                    unexpired_key_rotation_date),
+            _action(ActionType.WARN, unexpired_key,
+                    ActionReasons.KEY_PENDING_ROTATION,
+                    unexpired_key_rotation_date)
+        ]
+    # warn if the grace period is about to end
+    if expired_key_delete_date <= ctx.warn_by:
+        return [_action(ActionType.WARN, expired_key,
+                        ActionReasons.KEY_PENDING_DELETION,
+                        expired_key_delete_date)]
+    return []
+
+
+def _active_expired_with_inactive(states, ctx):
+    # the edge case where the active key is expired
+    # we should only encounter this on first deploy
+    # we have to delete the inactive one
+    # so we can rotate the active one
+    active_key, inactive_key = _split_active_inactive(states)
+    return [
+        _action(ActionType.DELETE, inactive_key,
+                ActionReasons.EXPIRED_INACTIVE_KEY_CONFLICT),
+        _action(ActionType.ROTATE, active_key, ActionReasons.EXPIRED_ACTIVE_KEY)
+    ]
+
+
+def _active_valid_with_inactive(states, ctx):
+    # we have a key in the recycle bin, waiting to be deleted
+    active_key, inactive_key = _split_active_inactive(states)
+
+    # force rotate the active key, must delete inactive key
+    if ctx.force_rotate:
+        return [
+            _action(ActionType.DELETE, inactive_key,
+                    ActionReasons.FORCED_INACTIVE_KEY_CONFLICT),
+            _action(ActionType.ROTATE, active_key, ActionReasons.FORCED_ROTATION)
+        ]
+
+    # check if the recovery grace period on the inactive key has passed
+    # the trick here is that we use the creation date of the active key
+    # to guess when the inactive key was deactivated
+    rotation_date = active_key.create_date
+    if inactive_key.last_used_date is not None:
+        # if the key has a more recent last used date use that instead
+        rotation_date = max(rotation_date, inactive_key.last_used_date)
+    inactive_key_delete_date = rotation_date + \
+        ctx.thresholds.installation_grace_period + \
+        ctx.thresholds.recovery_grace_period
+    active_key_rotate_date = active_key.expire_date
+
+    # delete inactive key if grace period is over
+    if inactive_key_delete_date <= ctx.now:
+        actions = [_action(ActionType.DELETE, inactive_key,
+                           ActionReasons.RECOVER_GRACE_PERIOD_END)]
+        # warn if active key is about to be rotated
+        if active_key_rotate_date <= ctx.warn_by:
+            actions.append(_action(ActionType.WARN, active_key,
+                                   ActionReasons.KEY_PENDING_ROTATION,
+                                   active_key_rotate_date))
+        return actions
+    # also warn if active key is about to expire
+    # inactive key will be deleted due to conflict
+    if active_key_rotate_date <= ctx.warn_by:
+        return [
+            _action(ActionType.WARN, inactive_key,
+                    ActionReasons.KEY_PENDING_DELETION_CONFLICT,
+                    active_key_rotate_date),
+            _action(ActionType.WARN, active_key, ActionReasons.KEY_PENDING_ROTATION,
+                    active_key_rotate_date)
+        ]
+    # warn if inactive key is about to expire
+    if inactive_key_delete_date <= ctx.warn_by:
+        return [_action(ActionType.WARN, inactive_key,
+                        ActionReasons.KEY_PENDING_DELETION,
+                        inactive_key_delete_date)]
+    return []
+
+
+def _active_pair_rotate_lru(states, delete_reason, rotate_reason):
+    key_to_delete, key_to_rotate = _pick_key_to_delete(states)
+    return [
+        _action(ActionType.DELETE, key_to_delete, delete_reason),
+        _action(ActionType.ROTATE, key_to_rotate, rotate_reason)
+    ]
+
+
+def _active_pair_expired(states, ctx):
+    # This is the catch 22, we have to pick one key to deactivate
+    # both are expired and both have been used
+    # we have no way to track the grace period if both keys are expired
+    # we have to delete one and rotate the other
+    return _active_pair_rotate_lru(
+        states, ActionReasons.EXPIRED_ACTIVE_KEY_CONFLICT_LRU,
+        ActionReasons.EXPIRED_ACTIVE_KEY)
+
+
+def _active_pair_forced(states, ctx):
+    # force rotate, so we need to delete LRU key same as above
+    return _active_pair_rotate_lru(
+        states, ActionReasons.FORCED_ROTATION_CONFLICT_LRU,
+        ActionReasons.FORCED_ROTATION)
+
+
+def _active_pair_one_expired(states, ctx):
+    if ctx.force_rotate:
+        return _active_pair_forced(states, ctx)
+
+    expired_key, unexpired_key = _split_expired_unexpired(states, ctx.now)
+    # we assume the creation date of the other key
+    # is the date the key was rotated
+    expired_key_deactivation_date = unexpired_key.create_date + \
+        ctx.thresholds.installation_grace_period
+    unexpired_key_rotation_date = unexpired_key.expire_date
+
+    # deactivate the expired key if the grace period is ended
+    if expired_key_deactivation_date <= ctx.now:
+        actions = [_action(ActionType.DEACTIVATE, expired_key,
+                           ActionReasons.INSTALL_GRACE_PERIOD_END)]
+        # warn if the unexpired key is about to expire
+        if unexpired_key_rotation_date <= ctx.warn_by:
+            actions.append(_action(ActionType.WARN, unexpired_key,
+                                   ActionReasons.KEY_PENDING_ROTATION,
+                                   unexpired_key_rotation_date))
+        return actions
+    # warn if the unexpired key is about to be rotated
+    # the expired key will be deleted due to conflict
+    if unexpired_key_rotation_date <= ctx.warn_by:
+        return [
+            _action(ActionType.WARN, expired_key,
+                    ActionReasons.KEY_PENDING_DELETION_CONFLICT,
+                    unexpired_key_rotation_date),
+            _action(ActionType.WARN, unexpired_key,
+                    ActionReasons.KEY_PENDING_ROTATION,
+                    unexpired_key_rotation_date)
+        ]
+    # warn if the expired key is about to be deactivated
+    if expired_key_deactivation_date <= ctx.warn_by:
+        return [_action(ActionType.WARN, expired_key,
+                        ActionReasons.KEY_PENDING_DEACTIVATION,
+                        expired_key_deactivation_date)]
+    return []
+
+
+def _active_pair_valid(states, ctx):
+    if ctx.force_rotate:
+        return _active_pair_forced(states, ctx)
+
+    # it's harder than it seems to warn of pending actions
+    if states[1].expire_date < states[0].expire_date:
+        older_key, newer_key = states[1], states[0]
+    else:
+        older_key, newer_key = states[0], states[1]
+    newer_key_rotation_date = newer_key.expire_date
+
+    # warn if newer key is about to expire
+    # older will be deleted due to conflict
+    if newer_key_rotation_date <= ctx.warn_by:
+        return [
+            _action(ActionType.WARN, older_key,
+                    ActionReasons.KEY_PENDING_DELETION_CONFLICT,
+                    newer_key_rotation_date),
+            _action(ActionType.WARN, newer_key, ActionReasons.KEY_PENDING_ROTATION,
+                    newer_key_rotation_date)
+        ]
+    # warn if first key will expire
+    # it can't be rotated due to conflict
+    if older_key.expire_date <= ctx.warn_by:
+        return [_action(ActionType.WARN, older_key,
+                        ActionReasons.KEY_PENDING_EXPIRATION_CONFLICT,
+                        older_key.expire_date)]
+    return []
+
+
+# (key count, active keys, expired active keys, expired inactive keys)
+DECISION_TABLE = {
+    (0, 0, 0, 0): _no_action,
+    # [Active, Null]
+    (1, 1, 1, 0): _single_active_expired,
+    (1, 1, 0, 0): _single_active_valid,
+    # [Inactive, Null]
+    (1, 0, 0, 1): _single_inactive,
+    (1, 0, 0, 0): _single_inactive,
+    # [Inactive, Inactive]
+    (2, 0, 0, 2): _inactive_pair_expired,
+    (2, 0, 0, 1): _inactive_pair_one_expired,
+    # nothing to do, both keys have not expired
+    # pending expirations don't need warnings,
+    # nothing will change until end of grace period
+    (2, 0, 0, 0): _no_action,
+    # [Active, Inactive]
+    (2, 1, 1, 1): _active_expired_with_inactive,
+    (2, 1, 1, 0): _active_expired_with_inactive,
+    (2, 1, 0, 1): _active_valid_with_inactive,
+    (2, 1, 0, 0): _active_valid_with_inactive,
+    # [Active, Active]
+    (2, 2, 2, 0): _active_pair_expired,
+    (2, 2, 1, 0): _active_pair_one_expired,
+    (2, 2, 0, 0): _active_pair_valid,
+}
+
+
+def evaluate_keys(access_key_metadata, now, thresholds, force_rotate=False):
+    """
+    Evaluates the access keys of a single user. The key records are not
+    modified; every action holds a KeyRecord of the key it applies to.
+
+    :param access_key_metadata: Key records with UserName, AccessKeyId,
+        Status, CreateDate and LastUsedDate (None if never used)
+    :param now: Timezone aware evaluation time
+    :param thresholds: Thresholds to evaluate the keys against
+    :param force_rotate: Whether the active key must be rotated
+    :return The list of Actions for the keys.
+    """
+    action_queue = []
+    states = []
+    warn_by = now + thresholds.warn_period
+    rotation_period = thresholds.rotation_period
+    num_active = 0
+    num_expired_active = 0
+    num_expired_inactive = 0
+
+    for key in access_key_metadata:
+        last_used_date = key['LastUsedDate']
+        expire_date = key['CreateDate'] + rotation_period
+        key_record = KeyRecord.from_metadata(key)
+
+        if last_used_date is None:
+            # if the key is expired and has never been used, just delete it
+            if expire_date <= now:
+                action_queue.append(Action(
+                    ActionType.ROTATE_AND_DELETE, key_record,
+                    ActionReasons.UNUSED_EXPIRED_KEY))
+                continue
+            # if the key is about to expire and has never been used, warn
+            if expire_date <= warn_by:
+                action_queue.append(Action(
+                    ActionType.WARN, key_record,
+                    ActionReasons.UNUSED_KEY_PENDING_DELETION, expire_date))
+
+        active = key['Status'] == 'Active'
+        if active:
+            num_active += 1
+            if expire_date <= now:
+                num_expired_active += 1
+        elif expire_date <= now:
+            num_expired_inactive += 1
+        states.append(KeyState(key_record, active, key['CreateDate'],
+                               last_used_date, expire_date))
+
+    rule = DECISION_TABLE.get((len(states), num_active, num_expired_active,
+                               num_expired_inactive), _no_action)
+    action_queue += rule(states, RuleContext(now, warn_by, thresholds,
+                                             force_rotate))
+    return action_queue
+
+
+def key_action_dates(key, thresholds):
+    """
+    The nominal dates of a key, assuming it is rotated when it expires.
+
+    :return Dict with the RotateDate, DeactivateDate and DeleteDate.
+    """
+    rotate_date = key['CreateDate'] + thresholds.rotation_period
+    deactivate_date = rotate_date + thresholds.installation_grace_period
+    return {
+        'RotateDate': rotate_date,
+        'DeactivateDate': deactivate_date,
+        'DeleteDate': deactivate_date + thresholds.recovery_grace_period
+    }
+
+
+def next_evaluation_date(access_key_metadata, now, thresholds):
+    """
+    Finds the earliest time from now on at which evaluate_keys returns an
+    action or warning for the keys, assuming the keys do not change. The
+    rules only compare key dates with now and now + warn period, so the
+    result can only change at those dates or one warn period before them.
+
+    :return The next evaluation date, now if there are actions now, or None
+        if no rule will fire for these keys.
+    """
+    if evaluate_keys(access_key_metadata, now, thresholds):
+        return now
+
+    grace_periods = thresholds.installation_grace_period + \
+        thresholds.recovery_grace_period
+    dates = set()
+    for key in access_key_metadata:
+        create_date = key['CreateDate']
+        dates.update((create_date + thresholds.rotation_period,
+                      create_date + thresholds.installation_grace_period,
+                      create_date + grace_periods))
+        if key['LastUsedDate'] is not None:
+            dates.add(key['LastUsedDate'] + grace_periods)
+
+    boundaries = dates | {date - thresholds.warn_period for date in dates}
+    for boundary in sorted(date for date in boundaries if date > now):
+        if evaluate_keys(access_key_metadata, boundary, thresholds):
+            return boundary
+    return None
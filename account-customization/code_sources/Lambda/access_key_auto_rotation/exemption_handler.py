@@ -3,74 +3,111 @@
 """Exemption Handler.
 
 This module provides the functionality necessary to exclude users
-from key rotation based on user defined IAM Group.
+from key rotation based on user defined IAM Groups.
 """
 
 from config import log
 
 
-def get_exemption_group(groupName, iam_client):
+def get_exemption_group(groupName, iam_client, account_snapshot=None):
     """
-    Gets the current list of exempt user accounts.
+    Gets the current set of exempt user accounts, reading all pages of
+    the group membership, or the membership in the account snapshot.
 
-    :return The current list of exempt user accounts.
+    :return The current set of exempt user accounts, empty if the group
+        does not exist.
+    :raises ClientError: If the membership could not be read, e.g. a later
+        page was throttled. A partial membership would remove exemptions.
     """
-    exemption_group_users = []
+    exemption_group_users = set()
 
-    try:
-        exemption_group_response = iam_client.get_group(GroupName=groupName)
-        exemption_group = exemption_group_response['Users']
+    if account_snapshot is not None:
+        if groupName not in account_snapshot.group_members:
+            log.info(
+                f'The IAM Group [{groupName}] does not exist in this account. '
+                f'Skipping exemptions check.')
+            return frozenset()
+        exemption_group_users = account_snapshot.group_members[groupName]
+        log.info(
+            f'The exempted users list [{groupName}] has '
+            f'{len(exemption_group_users)} active exemptions.')
+        return frozenset(exemption_group_users)
 
-        for users in exemption_group:
-            user_name = users['UserName']
-            exemption_group_users.append(user_name)
+    try:
+        paginator = iam_client.get_paginator('get_group')
+        for page in paginator.paginate(GroupName=groupName):
+            for users in page['Users']:
+                exemption_group_users.add(users['UserName'])
 
         if not exemption_group_users:
             log.info(f'The exempted users list [{groupName}] is empty.')
         else:
             log.info(
-                f'The exempted users list [{groupName}] has active '
-                f'exemptions.')
+                f'The exempted users list [{groupName}] has '
+                f'{len(exemption_group_users)} active exemptions.')
 
-    except iam_client.exceptions.ClientError as error:
+    except iam_client.exceptions.NoSuchEntityException:
         log.info(
             f'The IAM Group [{groupName}] does not exist in this account. '
             f'Skipping exemptions check.')
+        return frozenset()
+
+    return frozenset(exemption_group_users)
+
 
-    return exemption_group_users
+def parse_exemption_groups(iamExemptionGroup):
+    """
+    Splits the configured exemption groups, a comma separated string.
+
+    :return The list of group names.
+    """
+    if not iamExemptionGroup:
+        return []
+    return [group.strip() for group in iamExemptionGroup.split(',')
+            if group.strip()]
 
 
-def validate_exemption_group(iamExemptionGroup, iam_client, log):
+def validate_exemption_group(iamExemptionGroup, iam_client, log,
+                             account_snapshot=None):
+    """
+    Resolves the members of all configured exemption groups. The account
+    scan calls this once and shares the result for all users it evaluates.
+
+    :return Whether an exemption group was found and the frozenset of
+        exempt user names.
+    :raises ClientError: If the members of a group could not be read, the
+        account must not be evaluated without its exemptions.
+    """
     # Initialize Values
     exemption_group = None
+    exemption_groups = parse_exemption_groups(iamExemptionGroup)
 
     # Check to see if user entered an IAM Exemption Group
     # (check to see if iamExemptionGroup is not blank).
-    if iamExemptionGroup:
+    if exemption_groups:
         log.info(
-            f'The following IAM Exemption Group was configured via '
-            f'CloudFormation Template [{iamExemptionGroup}]')
+            f'The following IAM Exemption Groups were configured via '
+            f'CloudFormation Template {exemption_groups}')
 
-        # If IAM Exemption Group was added, check to see if the IAM Group
-        # exists within the account's IAM Service.
+        # If IAM Exemption Groups were added, check to see if the IAM Groups
+        # exist within the account's IAM Service.
         try:
-            exempt_list = get_exemption_group(
-                iamExemptionGroup, iam_client)
+            exempt_list = frozenset().union(*(
+                get_exemption_group(group_name, iam_client, account_snapshot)
+                for group_name in exemption_groups))
             exemption_group = True
         except iam_client.exceptions.ClientError as error:
             log.error(
-                f'An IAM Exemption Group name was added to the CloudFormation'
-                f' Template but the IAM Group does not exist in this account. '
-                f'Please double check that the Assumed Role CloudFormation '
-                f'StackSet was deployed successfully to this account. '
-                f'Raw Error: {error}')
-            exempt_list = []
-            exemption_group = False
+                f'Unable to read the members of the IAM Exemption Groups,'
+                f' the account is not evaluated. Please double check that the'
+                f' Assumed Role CloudFormation StackSet was deployed'
+                f' successfully to this account. Raw Error: {error}')
+            raise
     else:
         log.info(
             'An IAM Exemption Group name was not added to the CloudFormation '
             'Template. Please double check your CloudFormation deployment.')
-        exempt_list = []
+        exempt_list = frozenset()
         exemption_group = False
 
     return exemption_group, exempt_list
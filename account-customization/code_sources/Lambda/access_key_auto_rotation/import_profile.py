@@ -0,0 +1,141 @@
+
+
+"""Import Profile.
+
+Profiles the imports of the function on a cold start, similar to python
+-X importtime, and logs the slowest modules so that the Init Duration of
+the function can be tracked and reduced. The profile is enabled with the
+ImportProfile environment variable. Imports made during an invocation,
+e.g. the service models loaded when the first client is created, are logged
+after the invocation.
+
+Only imports made through import statements are timed. For a complete
+breakdown set PYTHONPROFILEIMPORTTIME=1 on the function, Python then
+writes the -X importtime output to the function's log.
+
+This module only uses the standard library, it is imported first.
+"""
+
+import builtins
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+
+# Profile the imports of the function
+PROFILE_IMPORTS = os.getenv('ImportProfile', 'false').lower() == 'true'
+
+# Number of modules logged per profile
+TOP_MODULES = 25
+
+log = logging.getLogger()
+
+
+class ImportProfiler:
+    """Times the modules imported since it was installed."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._original_import = builtins.__import__
+        # (module name, depth, cumulative seconds, self seconds)
+        self._timings = []
+        # per thread stack of the seconds spent in nested imports
+        self._local = threading.local()
+
+    def install(self):
+        builtins.__import__ = self._import
+
+    def _import(self, name, globals=None, locals=None, fromlist=(),
+                level=0):
+        if level or name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist,
+                                         level)
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist,
+                                         level)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self._timings.append((name, len(stack), elapsed,
+                                  elapsed - nested))
+
+    def take_timings(self):
+        """
+        Removes the timings collected since the last call.
+
+        :return List of (module name, depth, cumulative, self) tuples.
+        """
+        timings, self._timings = self._timings, []
+        return timings
+
+
+_profiler = None
+_cold_start = True
+
+
+def start_import_profile():
+    """Installs the import profiler if the profile is enabled."""
+    global _profiler
+    if PROFILE_IMPORTS and _profiler is None:
+        _profiler = ImportProfiler()
+        _profiler.install()
+
+
+def log_import_profile(phase):
+    """
+    Logs the modules imported since the last profile, slowest first.
+
+    :param phase: e.g. 'init' or 'invocation', logged with the profile
+    :return The number of modules imported, None if not profiled.
+    """
+    if _profiler is None:
+        return None
+    timings = _profiler.take_timings()
+    if not timings:
+        return 0
+    total = sum(cumulative for _, depth, cumulative, _ in timings
+                if depth == 0)
+    count = len(timings)
+    lines = [f'Import profile ({phase}): {count} modules in'
+             f' {total * 1000:.1f} ms']
+    if phase == 'init':
+        since_start = time.perf_counter() - _profiler.started
+        lines[0] += f', {since_start * 1000:.1f} ms since the profile started'
+    lines.append(f'{"cumulative ms":>14} {"self ms":>9}  module')
+    timings.sort(key=lambda timing: timing[2], reverse=True)
+    for name, depth, cumulative, self_time in timings[:TOP_MODULES]:
+        lines.append(f'{cumulative * 1000:14.1f} {self_time * 1000:9.1f}  '
+                     f'{"  " * depth}{name}')
+    log.info('\n'.join(lines))
+    return count
+
+
+def profile_imports(handler):
+    """
+    Decorates a Lambda handler to log the init imports on the cold start
+    and the imports made by each invocation.
+
+    :return The handler, unchanged if the profile is not enabled.
+    """
+    if not PROFILE_IMPORTS:
+        return handler
+
+    @functools.wraps(handler)
+    def profiled_handler(event, context):
+        global _cold_start
+        if _cold_start:
+            _cold_start = False
+            log_import_profile('init')
+        try:
+            return handler(event, context)
+        finally:
+            log_import_profile('invocation')
+
+    return profiled_handler
@@ -7,13 +7,27 @@ rotate, deactivate, and delete IAM Keys.
 """
 
 import json
+import os
+import threading
+import time
+import weakref
+
+from collections import Counter, namedtuple
 
 from config import Config, log
+from client_factory import get_client
+from call_metrics import NAMESPACE
+from decision_engine import ActionType, group_actions
+from user_pipeline import map_in_order
 from aws_partitions import get_partition_for_region, get_iam_region,\
     get_partition_regions
 
 config = Config()
 
+# session -> account id of the session's credentials
+_account_ids = weakref.WeakKeyDictionary()
+_account_ids_lock = threading.Lock()
+
 
 def log_actions(action_queue, dryrun=False):
     if not action_queue:
@@ -21,12 +35,11 @@ def log_actions(action_queue, dryrun=False):
         return
 
     for action_spec in action_queue:
-        action = action_spec['action']
-        key_metadata = action_spec['key']
-        access_key_id = key_metadata["AccessKeyId"]
-        reason = action_spec['reason'].value
+        action = action_spec.action
+        access_key_id = action_spec.key.access_key_id
+        reason = action_spec.reason.value
 
-        if action == 'ROTATE':
+        if action == ActionType.ROTATE:
             if dryrun:
                 log.info(
                     f"Would create new key to replace {access_key_id}"
@@ -35,7 +48,7 @@ def log_actions(action_queue, dryrun=False):
                 log.info(
                     f"Creating new key to replace {access_key_id}"
                     f" -- {reason}")
-        elif action == 'DEACTIVATE':
+        elif action == ActionType.DEACTIVATE:
             if dryrun:
                 log.info(
                     f"Would deactivate {access_key_id}"
@@ -44,7 +57,7 @@ def log_actions(action_queue, dryrun=False):
                 log.info(
                     f"Deactivating {access_key_id}"
                     f" -- {reason}")
-        elif action == 'DELETE':
+        elif action == ActionType.DELETE:
             if dryrun:
                 log.info(
                     f"Would delete {access_key_id}"
@@ -55,36 +68,259 @@ def log_actions(action_queue, dryrun=False):
                     f" -- {reason}")
 
 
-def execute_actions(action_queue, account_session, central_account_sm_client):
-    for action_spec in action_queue:
-        action = action_spec['action']
-        key_metadata = action_spec['key']
-
-        if action == 'ROTATE':
-            rotate_key(key_metadata, account_session, central_account_sm_client)
-        elif action == 'DEACTIVATE':
-            deactivate_key(key_metadata, account_session)
-        elif action == 'DELETE':
-            delete_key(key_metadata, account_session)
-        elif action == 'ROTATE_AND_DELETE':
-            delete_key(key_metadata, account_session)
-            rotate_key(key_metadata, account_session, central_account_sm_client)
-
-
-def rotate_key(key_metadata, account_session, central_account_sm_client):
-    user_name = key_metadata['UserName']
-    access_key_id = key_metadata['AccessKeyId']
+# Outcome of one action: 'SUCCEEDED', 'FAILED', or 'SKIPPED' after an
+# earlier action of the same user failed
+ActionResult = namedtuple(
+    'ActionResult', ['action_spec', 'status', 'error', 'calls_saved'])
+
+
+def report_action_results(account_id, results, mode=None):
+    """
+    Logs the actions of an account that did not succeed and prints the
+    action counts as an EMF log line. Failures do not fail the invocation,
+    a retry would notify the account again and repeat the other actions.
+
+    :return Summary of the action results, with the failed and skipped
+        actions.
+    """
+    statuses = Counter(result.status for result in results)
+    not_succeeded = [{
+        'action': result.action_spec.action.value,
+        'user': result.action_spec.key.user_name,
+        'key': result.action_spec.key.access_key_id,
+        'status': result.status,
+        'error': str(result.error) if result.error else None
+    } for result in results if result.status != 'SUCCEEDED']
+    summary = {
+        'account': account_id,
+        'succeeded': statuses['SUCCEEDED'],
+        'failed': statuses['FAILED'],
+        'skipped': statuses['SKIPPED'],
+        'not_succeeded': not_succeeded
+    }
+    if not_succeeded:
+        log.error(f'{len(not_succeeded)} of {len(results)} actions of'
+                  f' Account ID: {account_id} did not succeed:'
+                  f' {not_succeeded}')
+
+    line = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': NAMESPACE,
+                'Dimensions': [['Mode']] if mode else [[]],
+                'Metrics': [
+                    {'Name': 'ActionsSucceeded', 'Unit': 'Count'},
+                    {'Name': 'ActionsFailed', 'Unit': 'Count'},
+                    {'Name': 'ActionsSkipped', 'Unit': 'Count'}
+                ]
+            }]
+        },
+        'ActionsSucceeded': summary['succeeded'],
+        'ActionsFailed': summary['failed'],
+        'ActionsSkipped': summary['skipped'],
+        'AccountId': account_id,
+        'FunctionName': os.getenv('AWS_LAMBDA_FUNCTION_NAME')
+    }
+    if mode:
+        line['Mode'] = mode
+    # EMF lines must be printed as plain JSON, without log prefix
+    print(json.dumps(line, separators=(',', ':')))
+    return summary
+
+
+def get_succeeded_actions(action_queue, results):
+    """
+    :return The actions of the queue that succeeded, in queue order.
+    """
+    succeeded = {id(result.action_spec) for result in results
+                 if result.status == 'SUCCEEDED'}
+    return [action_spec for action_spec in action_queue
+            if id(action_spec) in succeeded]
+
+
+def get_pending_actions(action_queue, results):
+    """
+    :return The actions of the queue that were not executed, in queue
+        order.
+    """
+    executed = {id(result.action_spec) for result in results}
+    return [action_spec for action_spec in action_queue
+            if id(action_spec) not in executed]
+
+
+def build_action_chains(action_queue):
+    """
+    Groups the action queue into one chain per user. A chain keeps the
+    queue order, so a DELETE frees the key slot before the ROTATE that
+    needs it.
+
+    :return List of chains, in the order of the first action of each user.
+    """
+    return list(group_actions(action_queue,
+                              lambda action: action.key.user_name).values())
+
+
+def execute_action(action_spec, account_session, central_account_sm_client,
+                   account_snapshot=None):
+    """
+    :return The number of API calls saved by rotations.
+    """
+    action = action_spec.action
+    key = action_spec.key
+    calls_saved = 0
+
+    if action == ActionType.ROTATE:
+        calls_saved = rotate_key(key, account_session,
+                                 central_account_sm_client, account_snapshot)
+    elif action == ActionType.DEACTIVATE:
+        deactivate_key(key, account_session)
+    elif action == ActionType.DELETE:
+        delete_key(key, account_session)
+    elif action == ActionType.ROTATE_AND_DELETE:
+        delete_key(key, account_session)
+        calls_saved = rotate_key(key, account_session,
+                                 central_account_sm_client, account_snapshot)
+    return calls_saved
+
+
+def execute_chain(chain, account_session, central_account_sm_client,
+                  account_snapshot=None):
+    """
+    Executes the actions of one user in order. Once an action fails the
+    remaining actions of the user are skipped, except warnings, which have
+    nothing to execute and are still notified.
+
+    :return The list of ActionResults of the chain.
+    """
+    results = []
+    failed = False
+    for action_spec in chain:
+        if failed and action_spec.action != ActionType.WARN:
+            results.append(ActionResult(action_spec, 'SKIPPED', None, 0))
+            continue
+        try:
+            calls_saved = execute_action(action_spec, account_session,
+                                         central_account_sm_client,
+                                         account_snapshot)
+            results.append(ActionResult(action_spec, 'SUCCEEDED', None,
+                                        calls_saved))
+        except Exception as error:
+            log.exception(
+                f'{action_spec.action.value} of user'
+                f' {action_spec.key.user_name} key'
+                f' {action_spec.key.access_key_id} failed.'
+                f' Raw Error: {error}')
+            failed = True
+            results.append(ActionResult(action_spec, 'FAILED', error, 0))
+    return results
+
+
+def execute_actions(action_queue, account_session, central_account_sm_client,
+                    account_snapshot=None, time_is_up=None):
+    """
+    Executes the action queue of an account. The actions of a user run in
+    order, the users run concurrently on config.actionWorkers threads. A
+    failing action does not stop the actions of other users.
+
+    :param time_is_up: Returns True when no further user should be
+        started, the chains already started are finished. None runs all
+        actions
+    :return The list of ActionResults, grouped by user. Actions of users
+        that were not started have no result.
+    """
+    chains = build_action_chains(action_queue)
+    log.info(
+        f'Executing {len(action_queue)} actions for {len(chains)} users'
+        f' with {config.actionWorkers} worker(s).')
+
+    def started_chains():
+        for chain in chains:
+            if time_is_up is not None and time_is_up():
+                log.info('Time is up, no further users are started.')
+                return
+            yield chain
+
+    results = []
+    for chain_results in map_in_order(
+            lambda chain: execute_chain(chain, account_session,
+                                        central_account_sm_client,
+                                        account_snapshot),
+            started_chains(), config.actionWorkers):
+        results += chain_results
+
+    statuses = Counter(result.status for result in results)
+    calls_saved = sum(result.calls_saved for result in results)
+    log.info(
+        f'Executed actions: {statuses["SUCCEEDED"]} succeeded,'
+        f' {statuses["FAILED"]} failed, {statuses["SKIPPED"]} skipped.')
+    if calls_saved:
+        log.info(f'Key rotations saved {calls_saved} API calls.')
+    return results
+
+
+def get_session_account_id(account_session):
+    """
+    Gets the account id of a session once, the assumed role sessions are
+    reused for all keys of an account.
+
+    :return The account id.
+    """
+    # held during the call, so that concurrent actions make it once
+    with _account_ids_lock:
+        account_id = _account_ids.get(account_session)
+        if account_id is None:
+            sts_client = get_client('sts', account_session)
+            account_id = sts_client.get_caller_identity()["Account"]
+            _account_ids[account_session] = account_id
+    return account_id
+
+
+def get_missing_replica_regions(secret, replication_regions):
+    """
+    Uses the ReplicationStatus of describe_secret to find the regions the
+    secret still has to be replicated to.
+
+    :return The regions without a replica.
+    """
+    replicated = {status['Region'] for status
+                  in secret.get('ReplicationStatus', [])}
+    return [region for region in replication_regions
+            if region not in replicated]
+
+
+def get_failed_replica_regions(secret, replication_regions):
+    """
+    :return The regions whose replica of the secret failed.
+    """
+    failed = {status['Region'] for status
+              in secret.get('ReplicationStatus', [])
+              if status.get('Status') == 'Failed'}
+    return [region for region in replication_regions if region in failed]
+
+
+def rotate_key(key, account_session, central_account_sm_client,
+               account_snapshot=None):
+    """
+    Creates a new key for the user and stores it in the user's secret.
+    Replication is skipped when the secret already has all replicas, and
+    reads are served from the account snapshot when it was loaded.
+
+    :return The number of API calls saved by the skipped steps.
+    """
+    user_name = key.user_name
+    access_key_id = key.access_key_id
     log.info(f'Rotating user {user_name} key {access_key_id}')
     my_region = account_session.region_name
+    calls_saved = 0
+    writes_skipped = []
 
-    iam_client = account_session.client('iam')
-    if Config.runLambdaInVPC:
-        sts_client = account_session.client('sts', region_name=my_region, endpoint_url="https://sts." + my_region + ".amazonaws.com")
-    else:
-        sts_client = account_session.client('sts')
+    iam_client = get_client('iam', account_session)
 
     # get account id and region from session
-    account_id = sts_client.get_caller_identity()["Account"]
+    if account_session in _account_ids:
+        calls_saved += 1
+    account_id = get_session_account_id(account_session)
     # use default iam regions to store secret
     partition = get_partition_for_region(my_region)
     log.info(config.storeSecretsInCentralAccount)
@@ -94,10 +330,7 @@ def rotate_key(key_metadata, account_session, central_account_sm_client):
         sm_client = central_account_sm_client
     else:
         log.info("Secret will be stored in tenant Account")
-        if Config.runLambdaInVPC:
-            sm_client = account_session.client('secretsmanager', region_name=my_region, endpoint_url="https://secretsmanager." + my_region + ".amazonaws.com")
-        else:
-            sm_client = account_session.client('secretsmanager', region_name=my_region)
+        sm_client = get_client('secretsmanager', account_session, my_region)
 
     # TODO: parameterize this instead of hardcoding
     if partition == 'aws-us-gov':
@@ -115,39 +348,67 @@ def rotate_key(key_metadata, account_session, central_account_sm_client):
     secret_arn = config.secretArnFormat.format(
         partition=partition, account_id=account_id, secret_name=secret_name,
         region_name=my_region)
+    replica_regions = [{'Region': x} for x in Config.replicationRegions]
 
     # Create new secret, or store in existing
     try:
         # will throw error if secret does not yet exist
         secret = sm_client.describe_secret(
             SecretId=secret_name)
-        # update secret
-        sm_client.put_secret_value(SecretId=secret_name,
-                                   SecretString=new_access_key_str)
-        # make sure secret is replicated to all regions
-        sm_client.replicate_secret_to_regions(
-                SecretId=secret_name,
-                AddReplicaRegions=[{'Region': x} for x in Config.replicationRegions],
-                ForceOverwriteReplicaSecret=True
-            )
     except sm_client.exceptions.ClientError as error:
         log.info('SecretsManager Error')
         log.info(error)
         # create if we caught an error on describe
         if error.response['Error']['Code'] == 'ResourceNotFoundException':
-            sm_client.create_secret(
-                Name=secret_name, Description='Auto-created secret',
-                SecretString=new_access_key_str,
-                AddReplicaRegions=[{'Region': x} for x in Config.replicationRegions],
+            secret = None
+        else:
+            raise error
+
+    if secret is None:
+        replication = {'AddReplicaRegions': replica_regions,
+                       'ForceOverwriteReplicaSecret': True} \
+            if replica_regions else {}
+        sm_client.create_secret(
+            Name=secret_name, Description='Auto-created secret',
+            SecretString=new_access_key_str, **replication)
+    else:
+        # update secret
+        sm_client.put_secret_value(SecretId=secret_name,
+                                   SecretString=new_access_key_str)
+        # make sure secret is replicated to all regions, the replication
+        # status of describe_secret tells which replicas already exist.
+        # A failed replica is removed and added again
+        missing_regions = get_missing_replica_regions(
+            secret, Config.replicationRegions)
+        failed_regions = get_failed_replica_regions(
+            secret, Config.replicationRegions)
+        if failed_regions:
+            log.warning(f'Replicas of secret {secret_name} failed in'
+                        f' {failed_regions}, replicating them again')
+            sm_client.remove_regions_from_replication(
+                SecretId=secret_name, RemoveReplicaRegions=failed_regions)
+            missing_regions += failed_regions
+        if missing_regions:
+            sm_client.replicate_secret_to_regions(
+                SecretId=secret_name,
+                AddReplicaRegions=[{'Region': x} for x in missing_regions],
                 ForceOverwriteReplicaSecret=True
             )
         else:
-            raise error
+            calls_saved += 1
+            writes_skipped.append('replicate_secret_to_regions')
 
-    user = iam_client.get_user(
-        UserName=user_name
-    )['User']
-    user_arn = user['Arn']
+    # read the user from the account snapshot if it was loaded
+    user_snapshot = account_snapshot.get_user(user_name) \
+        if account_snapshot else None
+    if user_snapshot is not None:
+        user_arn = user_snapshot.arn
+        calls_saved += 1
+    else:
+        user = iam_client.get_user(
+            UserName=user_name
+        )['User']
+        user_arn = user['Arn']
 
     resource_policy_document = config.secretPolicyFormat.format(
         user_arn=user_arn)
@@ -155,40 +416,55 @@ def rotate_key(key_metadata, account_session, central_account_sm_client):
                                   ResourcePolicy=resource_policy_document,
                                   BlockPublicPolicy=True)
 
+    # the policy is only written when the user does not have it yet
     policy_name = 'SecretsAccessPolicy'
-    try:
-        iam_client.get_user_policy(UserName=user_name, PolicyName=policy_name)
-    except iam_client.exceptions.ClientError as error:
-        # TODO - IAM uses IAM.Client.exceptions.NoSuchEntityException
-        #  Find out if it inherits from ClientError. If it does, this code is probably ok,
-        #  but may need to change ResourceNotFoundException to NoSuchEntityException
-        if error.response['Error']['Code'] == 'NoSuchEntity':
-            policy_document = config.iamPolicyFormat.format(
-                account_id=account_id, secret_arn=secret_arn)
-            iam_client.put_user_policy(UserName=user_name,
-                                       PolicyName=policy_name,
-                                       PolicyDocument=policy_document)
-        else:
-            raise error
+    if user_snapshot is not None:
+        has_policy = policy_name in user_snapshot.inline_policy_names
+        calls_saved += 1
+    else:
+        try:
+            iam_client.get_user_policy(UserName=user_name,
+                                       PolicyName=policy_name)
+            has_policy = True
+        except iam_client.exceptions.ClientError as error:
+            # TODO - IAM uses IAM.Client.exceptions.NoSuchEntityException
+            #  Find out if it inherits from ClientError. If it does, this code is probably ok,
+            #  but may need to change ResourceNotFoundException to NoSuchEntityException
+            if error.response['Error']['Code'] == 'NoSuchEntity':
+                has_policy = False
+            else:
+                raise error
+    if has_policy:
+        log.info(f'User {user_name} already has policy {policy_name}')
+    else:
+        policy_document = config.iamPolicyFormat.format(
+            account_id=account_id, secret_arn=secret_arn)
+        iam_client.put_user_policy(UserName=user_name,
+                                   PolicyName=policy_name,
+                                   PolicyDocument=policy_document)
+
+    log.info(
+        f'Rotated user {user_name} key {access_key_id}, saved {calls_saved}'
+        f' calls, skipped writes: {writes_skipped}')
+    return calls_saved
 
-    return
 
-def deactivate_key(key_metadata, account_session):
-    user_name = key_metadata['UserName']
-    access_key_id = key_metadata['AccessKeyId']
+def deactivate_key(key, account_session):
+    user_name = key.user_name
+    access_key_id = key.access_key_id
     log.info(f'Deactivating user {user_name} key {access_key_id}')
 
-    iam_client = account_session.client('iam')
+    iam_client = get_client('iam', account_session)
     iam_client.update_access_key(UserName=user_name,
                                  AccessKeyId=access_key_id,
                                  Status='Inactive')
 
 
-def delete_key(key_metadata, account_session):
-    user_name = key_metadata['UserName']
-    access_key_id = key_metadata['AccessKeyId']
+def delete_key(key, account_session):
+    user_name = key.user_name
+    access_key_id = key.access_key_id
     log.info(f'Deleting user {user_name} key {access_key_id}')
 
-    iam_client = account_session.client('iam')
+    iam_client = get_client('iam', account_session)
     iam_client.delete_access_key(UserName=user_name,
                                  AccessKeyId=access_key_id)
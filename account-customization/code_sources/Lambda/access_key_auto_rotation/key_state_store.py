@@ -0,0 +1,279 @@
+
+
+"""Key State Store.
+
+Keeps the computed RotateDate, DeactivateDate and DeleteDate of the access
+keys of each user, together with the next date on which an action or
+warning can fire for the user. Daily runs skip the users, and whole
+accounts, that are not due yet. The store is pluggable: the SQLite store
+keeps the state in a local file, the DynamoDB store in a table. The
+SQLite file is local to a container and is meant for local runs, the
+deployed function uses the DynamoDB store.
+"""
+
+import abc
+import datetime
+import json
+import sqlite3
+import threading
+
+from typing import Dict, List, NamedTuple, Optional
+
+from config import Config, log
+from client_factory import get_client
+from stores import StoreRegistry, batch_write_items
+
+config = Config()
+
+
+class UserKeyState(NamedTuple):
+    """The key dates of a user at the last evaluation."""
+
+    user_name: str
+    next_evaluation: datetime.datetime
+    # one dict per key: AccessKeyId, RotateDate, DeactivateDate, DeleteDate
+    keys: List[Dict[str, datetime.datetime]]
+
+
+def format_date(date: datetime.datetime) -> str:
+    """Formats a date so that formatted dates sort chronologically."""
+    return date.astimezone(datetime.timezone.utc).isoformat(
+        timespec='seconds')
+
+
+def parse_date(value: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(value)
+
+
+def _serialize_keys(keys):
+    return [{name: format_date(value)
+             if isinstance(value, datetime.datetime) else value
+             for name, value in key.items()} for key in keys]
+
+
+def _encode_keys(keys):
+    return json.dumps(_serialize_keys(keys))
+
+
+def serialize_user_key_state(state):
+    """
+    Serializes a UserKeyState as a JSON compatible list, e.g. for a scan
+    checkpoint.
+
+    :return [user name, next evaluation, list of key dicts]
+    """
+    return [state.user_name, format_date(state.next_evaluation),
+            _serialize_keys(state.keys)]
+
+
+def deserialize_user_key_state(values):
+    """
+    Restores a UserKeyState of serialize_user_key_state.
+
+    :return The UserKeyState.
+    """
+    user_name, next_evaluation, keys = values
+    return UserKeyState(
+        user_name, parse_date(next_evaluation),
+        [{name: value if name == 'AccessKeyId' else parse_date(value)
+          for name, value in key.items()} for key in keys])
+
+
+class KeyStateStore(abc.ABC):
+    """Keeps the key state of the users of all accounts."""
+
+    @abc.abstractmethod
+    def get_users_not_due(self, account_id, now):
+        """
+        :return Dict of user name -> next evaluation date, for the users of
+            the account not due at now.
+        """
+
+    @abc.abstractmethod
+    def get_user_names(self, account_id):
+        """
+        :return The names of all users of the account in the store.
+        """
+
+    @abc.abstractmethod
+    def put_user_states(self, account_id, user_states):
+        """Stores the UserKeyStates of users of the account."""
+
+    @abc.abstractmethod
+    def delete_users(self, account_id, user_names):
+        """Removes users that no longer exist."""
+
+    @abc.abstractmethod
+    def get_account_next_evaluation(self, account_id):
+        """
+        :return The next date any user of the account is due, or None if
+            the account was never scanned.
+        """
+
+    @abc.abstractmethod
+    def put_account_next_evaluation(self, account_id, next_evaluation):
+        """Stores the next date any user of the account is due."""
+
+
+class SQLiteKeyStateStore(KeyStateStore):
+    """Key state store in a local SQLite database file."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS user_key_state ('
+                ' account_id TEXT NOT NULL,'
+                ' user_name TEXT NOT NULL,'
+                ' next_evaluation TEXT NOT NULL,'
+                ' keys TEXT NOT NULL,'
+                ' PRIMARY KEY (account_id, user_name))')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS user_key_state_next_evaluation'
+                ' ON user_key_state (account_id, next_evaluation)')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS account_key_state ('
+                ' account_id TEXT PRIMARY KEY,'
+                ' next_evaluation TEXT NOT NULL)')
+
+    def get_users_not_due(self, account_id, now):
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT user_name, next_evaluation FROM user_key_state'
+                ' WHERE account_id = ? AND next_evaluation > ?',
+                (account_id, format_date(now))).fetchall()
+        return {user_name: parse_date(next_evaluation)
+                for user_name, next_evaluation in rows}
+
+    def get_user_names(self, account_id):
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT user_name FROM user_key_state WHERE account_id = ?',
+                (account_id,)).fetchall()
+        return {user_name for user_name, in rows}
+
+    def put_user_states(self, account_id, user_states):
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO user_key_state'
+                ' (account_id, user_name, next_evaluation, keys)'
+                ' VALUES (?, ?, ?, ?)',
+                [(account_id, state.user_name,
+                  format_date(state.next_evaluation),
+                  _encode_keys(state.keys)) for state in user_states])
+
+    def delete_users(self, account_id, user_names):
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'DELETE FROM user_key_state'
+                ' WHERE account_id = ? AND user_name = ?',
+                [(account_id, user_name) for user_name in user_names])
+
+    def get_account_next_evaluation(self, account_id):
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT next_evaluation FROM account_key_state'
+                ' WHERE account_id = ?', (account_id,)).fetchone()
+        return parse_date(row[0]) if row else None
+
+    def put_account_next_evaluation(self, account_id, next_evaluation):
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO account_key_state'
+                ' (account_id, next_evaluation) VALUES (?, ?)',
+                (account_id, format_date(next_evaluation)))
+
+
+class DynamoDBKeyStateStore(KeyStateStore):
+    """
+    Key state store in a DynamoDB table, or any service with the DynamoDB
+    API. The table has the string hash key AccountId and range key
+    UserName, and a local secondary index NextEvaluationIndex with the
+    string range key NextEvaluation. The account item uses the reserved
+    user name '#ACCOUNT'.
+    """
+
+    ACCOUNT_ITEM = '#ACCOUNT'
+    NEXT_EVALUATION_INDEX = 'NextEvaluationIndex'
+
+    def __init__(self, table_name: str, dynamodb_client=None) -> None:
+        self.table_name = table_name
+        self.dynamodb_client = dynamodb_client or get_client('dynamodb')
+
+    def _query(self, **kwargs):
+        paginator = self.dynamodb_client.get_paginator('query')
+        for page in paginator.paginate(TableName=self.table_name, **kwargs):
+            yield from page['Items']
+
+    def get_users_not_due(self, account_id, now):
+        items = self._query(
+            IndexName=self.NEXT_EVALUATION_INDEX,
+            KeyConditionExpression='AccountId = :account AND'
+                                   ' NextEvaluation > :now',
+            ExpressionAttributeValues={':account': {'S': account_id},
+                                       ':now': {'S': format_date(now)}},
+            ProjectionExpression='UserName, NextEvaluation')
+        return {item['UserName']['S']: parse_date(item['NextEvaluation']['S'])
+                for item in items
+                if item['UserName']['S'] != self.ACCOUNT_ITEM}
+
+    def get_user_names(self, account_id):
+        items = self._query(
+            KeyConditionExpression='AccountId = :account',
+            ExpressionAttributeValues={':account': {'S': account_id}},
+            ProjectionExpression='UserName')
+        return {item['UserName']['S'] for item in items} - \
+            {self.ACCOUNT_ITEM}
+
+    def put_user_states(self, account_id, user_states):
+        batch_write_items(
+            self.dynamodb_client, self.table_name,
+            [{'PutRequest': {'Item': {
+                'AccountId': {'S': account_id},
+                'UserName': {'S': state.user_name},
+                'NextEvaluation': {'S': format_date(state.next_evaluation)},
+                'KeyDates': {'S': _encode_keys(state.keys)}
+            }}} for state in user_states])
+
+    def delete_users(self, account_id, user_names):
+        batch_write_items(
+            self.dynamodb_client, self.table_name,
+            [{'DeleteRequest': {'Key': {
+                'AccountId': {'S': account_id},
+                'UserName': {'S': user_name}
+            }}} for user_name in user_names])
+
+    def get_account_next_evaluation(self, account_id):
+        item = self.dynamodb_client.get_item(
+            TableName=self.table_name,
+            Key={'AccountId': {'S': account_id},
+                 'UserName': {'S': self.ACCOUNT_ITEM}}).get('Item')
+        return parse_date(item['NextEvaluation']['S']) if item else None
+
+    def put_account_next_evaluation(self, account_id, next_evaluation):
+        self.dynamodb_client.put_item(
+            TableName=self.table_name,
+            Item={'AccountId': {'S': account_id},
+                  'UserName': {'S': self.ACCOUNT_ITEM},
+                  'NextEvaluation': {'S': format_date(next_evaluation)}})
+
+
+# store name -> function creating the store
+KEY_STATE_STORES = {
+    'sqlite': lambda: SQLiteKeyStateStore(config.keyStatePath),
+    'dynamodb': lambda: DynamoDBKeyStateStore(config.keyStateTable),
+}
+
+key_state_stores = StoreRegistry('key state store', KEY_STATE_STORES,
+                                 lambda: config.keyStateStore)
+
+
+def get_key_state_store() -> Optional[KeyStateStore]:
+    """
+    Gets the configured key state store, shared by warm invocations.
+
+    :return The KeyStateStore, or None if key state is not kept.
+    """
+    return key_state_stores.get()
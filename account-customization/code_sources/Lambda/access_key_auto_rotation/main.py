@@ -1,31 +1,183 @@
 
 
 
-import time
+from import_profile import start_import_profile, profile_imports
+
+# started before the other imports so that they are profiled
+start_import_profile()
+
+import datetime
 
 from config import Config, log
-from sts_connection_handler import get_account_session
+from sts_connection_handler import get_account_session, \
+    get_central_account_session, get_session_cache_stats
 from force_rotation_handler import check_force_rotate_users
 from account_scan import get_actions_for_account
 from notification_handler import send_to_notifier
-from key_actions import log_actions, execute_actions
-import boto3
-
-timestamp = int(round(time.time() * 1000))
-
-config = Config()
+from key_actions import log_actions, execute_actions, \
+    get_succeeded_actions, get_pending_actions, report_action_results
+from client_factory import get_client
+from account_snapshot import load_account_snapshot
+from owner_digest import OwnerDigest, get_digest_store
+from key_state_store import get_key_state_store
+from decision_engine import group_actions
+from call_metrics import flush_call_metrics
+from scan_checkpoint import ScanProgress, ScanSuspended, continue_scan
 
 
+@profile_imports
 def lambda_handler(event, context):
     """Handler for Lambda.
 
-    :param event: Dictionary account object (Account ID and Email) sent to Lambda via 'Account Inventory' Lambda Function
+    :param event: Dictionary account object (Account ID and Email) sent to Lambda via 'Account Inventory' Lambda Function,
+        or a batch of them in an "accounts" list, or {"flush_digest": run_id} to send the owner digests of a run.
+        An account with a "continuation_token" resumes a suspended scan. Events with "defer_digest" also carry
+        "batch_ids" and "run_batches", the digest is sent once all batches of the run are finished.
     :param context: Lambda context object
+    :return The summary of the action results of the account, or of each
+        account of a batch.
     """
 
+    config = Config()
     log.info('Function starting.')
     log.info(event)
 
+    if "flush_digest" in event:
+        OwnerDigest(event["flush_digest"], get_digest_store()).flush(context)
+        flush_call_metrics(mode=get_run_mode(event))
+        return
+
+    # resource owner actions are collected and sent once per owner
+    run_id = event.get("run_id", context.aws_request_id)
+    digest = None
+    if config.ownerDigest:
+        digest = OwnerDigest(run_id, get_digest_store())
+
+    try:
+        if "accounts" in event:
+            summary = evaluate_account_batch(event, context, digest)
+        else:
+            try:
+                summary = evaluate_account(event, context, digest)
+            finally:
+                flush_call_metrics(event.get("account"),
+                                   get_run_mode(event))
+    except ScanSuspended as suspended:
+        # a digest that is not deferred may be kept by this container only,
+        # it is sent before the scan continues in another one. Otherwise the
+        # invocation finishing the work of the run sends the digest
+        if digest and not event.get("defer_digest"):
+            digest.flush(context)
+        continue_scan(context, {**suspended.event, "run_id": run_id},
+                      suspended.resumed_token)
+        flush_call_metrics(mode=get_run_mode(event))
+        log.info('Function has suspended.')
+        return
+    except Exception:
+        # the batch is finished, a retry of the invocation sends the digest
+        # of its own entries
+        send_digest(digest, event, context)
+        raise
+
+    send_digest(digest, event, context)
+    flush_call_metrics(mode=get_run_mode(event))
+
+    log.info(f'Session cache: {get_session_cache_stats()}')
+    log.info('---------------------------')
+    log.info('Function has completed.')
+    return summary
+
+
+def send_digest(digest, event, context):
+    """
+    Sends the owner digest of the run. With "defer_digest" it is only sent
+    by the invocation finishing the last batch of the run.
+    """
+    if digest is None:
+        return
+    if event.get("defer_digest") and not digest.finish_batches(
+            event.get("batch_ids", []), event.get("run_batches", 1)):
+        return
+    digest.flush(context)
+
+
+def get_run_mode(event):
+    """
+    :return 'audit' for dry runs, 'enforce' otherwise.
+    """
+    config = Config()
+    if str(event.get('dryrun')).lower() == 'true' or config.dryrun:
+        return 'audit'
+    return 'enforce'
+
+
+def evaluate_account_batch(event, context, digest=None):
+    """Evaluates a batch of accounts sent in one invocation.
+
+    Flags of the batch event (e.g. "dryrun", "ForceRotate") apply to every
+    account. A failing account is logged and does not stop the batch.
+
+    :return The failed accounts and the action summaries of the others.
+    """
+    batch_flags = {k: v for k, v in event.items() if k != "accounts"}
+    accounts = event["accounts"]
+    failed_accounts = []
+    summaries = []
+
+    log.info(f'Evaluating a batch of {len(accounts)} accounts.')
+    for n, account in enumerate(accounts):
+        account_event = {**batch_flags, **account}
+        try:
+            summary = evaluate_account(account_event, context, digest)
+            if summary:
+                summaries.append(summary)
+        except ScanSuspended as suspended:
+            # continue with the suspended account and the rest of the batch
+            suspended.event = {
+                **batch_flags,
+                "accounts": [{**account, "continuation_token":
+                              suspended.continuation_token}] +
+                accounts[n + 1:]}
+            log.info(
+                f'Batch suspended. {n - len(failed_accounts)} accounts'
+                f' succeeded, {len(failed_accounts)} failed:'
+                f' {failed_accounts}, {len(accounts) - n} continued.')
+            raise
+        except Exception as error:
+            log.exception(
+                f'Evaluation of Account ID: {account.get("account")} failed.'
+                f' Raw Error: {error}')
+            failed_accounts.append(account.get("account"))
+        finally:
+            flush_call_metrics(account.get("account"),
+                               get_run_mode(account_event))
+
+    log.info(
+        f'Batch completed. {len(accounts) - len(failed_accounts)} accounts'
+        f' succeeded, {len(failed_accounts)} failed: {failed_accounts}')
+    return {"accounts": summaries, "failed_accounts": failed_accounts}
+
+
+def evaluate_account(event, context, digest=None):
+    """Evaluates and remediates the keys of a single account. Only the
+    actions that succeeded are notified. Actions that did not succeed are
+    reported in the returned summary and do not fail the invocation.
+
+    With a scan checkpoint store, the scan and the execution of its actions
+    are suspended before the invocation times out. The executed actions are
+    notified, the others are continued by the next invocation. The
+    checkpoint is deleted once all actions were executed and notified.
+
+    :param event: Dictionary account object (Account ID, Name and Email)
+    :param context: Lambda context object
+    :param digest: OwnerDigest collecting the resource owner actions, None
+        sends them to the owners right away
+    :return The summary of the action results, None if no action was
+        executed.
+    """
+
+    config = Config()
+
     # Error handling - Ensure that the correct object is getting passed
     # to the function
     if "account" not in event and "email" not in event and "name" not in event:
@@ -38,7 +190,7 @@ def lambda_handler(event, context):
     force_rotate_users = check_force_rotate_users(event)
 
     # check for dryrun flag
-    dryrun = str(event.get('dryrun')).lower() == 'true' or config.dryrun
+    dryrun = get_run_mode(event) == 'audit'
 
     # Parse event to get Account ID and Email
     aws_account_id = event['account']
@@ -46,45 +198,105 @@ def lambda_handler(event, context):
     account_email = event['email']
     log.info(f'Currently evaluating Account ID: {aws_account_id} | Account Name: {account_name}')
 
+    # Skip the account if none of its users is due, "full_scan" evaluates
+    # all users regardless of the stored key state
+    full_scan = str(event.get('full_scan')).lower() == 'true'
+    continuation_token = event.get('continuation_token')
+    key_state_store = get_key_state_store()
+    if key_state_store is not None and not force_rotate_users \
+            and not full_scan and not continuation_token:
+        next_evaluation = key_state_store.get_account_next_evaluation(
+            aws_account_id)
+        if next_evaluation is not None and \
+                next_evaluation > datetime.datetime.now(datetime.timezone.utc):
+            log.info(
+                f'Skipping Account ID: {aws_account_id}, no user is due'
+                f' before {next_evaluation.isoformat()}.')
+            return
+
     account_session = get_account_session(aws_account_id, config.iamAssumedRoleName)
-    central_account_session = get_account_session(Config.orgListAccount, config.orgListRole)
+    central_account_session = get_central_account_session()
     log.info(config.storeSecretsInCentralAccount)
     if config.storeSecretsInCentralAccount:
         log.info("Secret will be stored in Central Account")
         my_region = account_session.region_name
-        if Config.runLambdaInVPC:
-            central_account_sm_client = central_account_session.client('secretsmanager', region_name=my_region, endpoint_url="https://secretsmanager." + my_region + ".amazonaws.com")
-        else:
-            central_account_sm_client = central_account_session.client('secretsmanager', region_name=my_region)
+        central_account_sm_client = get_client(
+            'secretsmanager', central_account_session, my_region)
     else:
         log.info("Secret will be stored in tenant  Account")
         central_account_sm_client = None
-    action_queue = get_actions_for_account(account_session, force_rotate_users)
-
-    if action_queue:
-        log_actions(action_queue, dryrun)
-
-        # Extract subsets of actions for resource owners
-        resource_owners = {action.get("resource_owner") for action in action_queue}
-        resource_owners.discard(None)
-        resource_actions = {}
-        for resource_owner in resource_owners:
-            resource_actions[resource_owner] = [action for action in action_queue if action.get("resource_owner") == resource_owner]
-
-        # Send notifications
-        if dryrun:
-            send_to_notifier(context, aws_account_id, account_name, account_email,
-                             action_queue, dryrun, config.emailTemplateAudit)
-            for resource_owner in resource_owners:
-                send_to_notifier(context, aws_account_id, account_name, resource_owner,
-                                resource_actions[resource_owner], dryrun, config.emailTemplateAudit)
+
+    # Load users, groups and tags of the account in one pass
+    account_snapshot = None
+    if config.accountSnapshot:
+        iam_client = get_client('iam', account_session)
+        try:
+            account_snapshot = load_account_snapshot(iam_client)
+        except iam_client.exceptions.ClientError as error:
+            log.error(
+                f'Unable to load the account snapshot, falling back to per'
+                f' user calls. Raw Error: {error}')
+
+    scan_progress = ScanProgress.start(aws_account_id, context,
+                                       continuation_token)
+    try:
+        summary = None
+        next_token = None
+        if scan_progress is not None and scan_progress.scan_finished:
+            # an earlier invocation finished the scan
+            action_queue = scan_progress.action_queue
         else:
-            execute_actions(action_queue, account_session, central_account_sm_client)
-            send_to_notifier(context, aws_account_id, account_name, account_email,
-                             action_queue, dryrun, config.emailTemplateEnforce)
-            for resource_owner in resource_owners:
-                send_to_notifier(context, aws_account_id, account_name, resource_owner,
-                                resource_actions[resource_owner], dryrun, config.emailTemplateEnforce)
+            action_queue = get_actions_for_account(
+                account_session, force_rotate_users, account_snapshot,
+                aws_account_id, full_scan, scan_progress)
 
-    log.info('---------------------------')
-    log.info('Function has completed.')
+        if action_queue:
+            log_actions(action_queue, dryrun)
+
+            results = []
+            if dryrun:
+                email_template = config.emailTemplateAudit
+            else:
+                results = execute_actions(
+                    action_queue, account_session, central_account_sm_client,
+                    account_snapshot,
+                    scan_progress.time_is_up if scan_progress else None)
+                email_template = config.emailTemplateEnforce
+                # stored before the notifications, a retry does not execute
+                # the actions again
+                if scan_progress is not None:
+                    next_token = scan_progress.record_execution(
+                        get_pending_actions(action_queue, results))
+                # only the actions that were taken are notified
+                action_queue = get_succeeded_actions(action_queue, results)
+
+            # Extract subsets of actions for resource owners
+            resource_actions = group_actions(
+                action_queue, lambda action: action.resource_email or None)
+
+            # Send notifications
+            if action_queue:
+                send_to_notifier(context, aws_account_id, account_name, account_email,
+                                 action_queue, dryrun, email_template)
+            for resource_owner, owner_actions in resource_actions.items():
+                if digest:
+                    digest.add(resource_owner, aws_account_id, account_name,
+                               owner_actions, dryrun, email_template)
+                else:
+                    send_to_notifier(context, aws_account_id, account_name, resource_owner,
+                                     owner_actions, dryrun, email_template)
+
+            if results:
+                summary = report_action_results(aws_account_id, results,
+                                                get_run_mode(event))
+
+        if next_token:
+            raise ScanSuspended(next_token)
+    except ScanSuspended as suspended:
+        suspended.event = {**event,
+                           "continuation_token": suspended.continuation_token}
+        raise
+
+    if scan_progress is not None:
+        scan_progress.finish()
+    return summary
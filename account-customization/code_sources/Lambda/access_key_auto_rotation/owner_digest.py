@@ -0,0 +1,331 @@
+
+
+"""Owner Digest.
+
+Collects the actions of resource owners across the accounts of a run, so
+an owner of users in many accounts gets one digest email per run instead
+of one email per account. Digest entries are kept in a pluggable store,
+the SQLite store keeps them in a local file, the DynamoDB store in a table
+shared by all invocations.
+
+A run of the inventory function spans many rotation invocations. Its
+events carry "defer_digest", the run's number of batches and the ids of
+their own batches. Each invocation marks its batches as finished in the
+store, the invocation finishing the last batch sends the digests. The
+SQLite store is meant for local runs: it is not shared by the containers
+of the function, each invocation sends the digest of its own accounts.
+"""
+
+import abc
+import sqlite3
+import threading
+import time
+
+from config import Config, log
+from client_factory import get_client
+from stores import StoreRegistry, batch_write_items
+from notification_handler import build_notifier_payload, \
+    format_action_messages, invoke_notifier
+
+config = Config()
+
+
+class DigestStore(abc.ABC):
+    """Keeps the digest entries of runs until they are sent."""
+
+    # Whether all containers of the function share the store, only a
+    # shared store can collect the digest of a run of many invocations
+    shared = True
+
+    @abc.abstractmethod
+    def add(self, run_id, recipient, email_template, entries):
+        """
+        Adds entries for a recipient.
+
+        :param entries: List of (account id, account name, message)
+        """
+
+    @abc.abstractmethod
+    def recipients(self, run_id):
+        """
+        :return List of (recipient, email template) with entries in the run.
+        """
+
+    @abc.abstractmethod
+    def entries(self, run_id, recipient, email_template):
+        """
+        :return List of (account id, account name, message) in insert order.
+        """
+
+    @abc.abstractmethod
+    def delete(self, run_id, recipient, email_template):
+        """Deletes the entries of a recipient once the digest was sent."""
+
+    @abc.abstractmethod
+    def finish_batches(self, run_id, batch_ids):
+        """
+        Marks batches of the run as finished. Finishing a batch again has
+        no effect.
+
+        :return The number of finished batches of the run.
+        """
+
+
+class SQLiteDigestStore(DigestStore):
+    """Digest store in a local SQLite database file."""
+
+    shared = False
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS digest_entry ('
+                ' seq INTEGER PRIMARY KEY AUTOINCREMENT,'
+                ' run_id TEXT NOT NULL,'
+                ' recipient TEXT NOT NULL,'
+                ' email_template TEXT NOT NULL,'
+                ' account_id TEXT NOT NULL,'
+                ' account_name TEXT,'
+                ' message TEXT NOT NULL)')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS digest_entry_recipient'
+                ' ON digest_entry (run_id, recipient, email_template)')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS digest_batch ('
+                ' run_id TEXT NOT NULL,'
+                ' batch_id TEXT NOT NULL,'
+                ' PRIMARY KEY (run_id, batch_id))')
+
+    def add(self, run_id, recipient, email_template, entries):
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT INTO digest_entry (run_id, recipient, email_template,'
+                ' account_id, account_name, message)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                [(run_id, recipient, email_template, account_id,
+                  account_name, message)
+                 for account_id, account_name, message in entries])
+
+    def recipients(self, run_id):
+        with self._lock:
+            return self._connection.execute(
+                'SELECT recipient, email_template FROM digest_entry'
+                ' WHERE run_id = ? GROUP BY recipient, email_template'
+                ' ORDER BY MIN(seq)', (run_id,)).fetchall()
+
+    def entries(self, run_id, recipient, email_template):
+        with self._lock:
+            return self._connection.execute(
+                'SELECT account_id, account_name, message FROM digest_entry'
+                ' WHERE run_id = ? AND recipient = ? AND email_template = ?'
+                ' ORDER BY seq', (run_id, recipient, email_template)).fetchall()
+
+    def delete(self, run_id, recipient, email_template):
+        with self._lock, self._connection:
+            self._connection.execute(
+                'DELETE FROM digest_entry'
+                ' WHERE run_id = ? AND recipient = ? AND email_template = ?',
+                (run_id, recipient, email_template))
+
+    def finish_batches(self, run_id, batch_ids):
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO digest_batch (run_id, batch_id)'
+                ' VALUES (?, ?)',
+                [(run_id, batch_id) for batch_id in batch_ids])
+            return self._connection.execute(
+                'SELECT COUNT(*) FROM digest_batch WHERE run_id = ?',
+                (run_id,)).fetchone()[0]
+
+
+class DynamoDBDigestStore(DigestStore):
+    """
+    Digest store in a DynamoDB table. The table has the string hash key
+    RunId and range key EntryKey, and the number attribute ExpiresAt
+    should be its TTL attribute. The finished batches of a run are kept in
+    the item with the reserved entry key '#RUN'.
+
+    Entry keys are derived from the recipient, template and account, so
+    an account evaluated again by a retried invocation overwrites its
+    entries instead of adding them twice.
+    """
+
+    RUN_ITEM = '#RUN'
+
+    # Days after which the items of a run expire
+    EXPIRES_AFTER_DAYS = 7
+
+    def __init__(self, table_name: str, dynamodb_client=None) -> None:
+        self.table_name = table_name
+        self.dynamodb_client = dynamodb_client or get_client('dynamodb')
+
+    def _expires_at(self):
+        return str(int(time.time()) + self.EXPIRES_AFTER_DAYS * 86400)
+
+    def _query(self, run_id, **kwargs):
+        paginator = self.dynamodb_client.get_paginator('query')
+        for page in paginator.paginate(
+                TableName=self.table_name,
+                KeyConditionExpression='RunId = :run_id' + kwargs.pop(
+                    'key_condition', ''),
+                ExpressionAttributeValues={':run_id': {'S': run_id},
+                                           **kwargs.pop('values', {})},
+                **kwargs):
+            yield from page['Items']
+
+    @staticmethod
+    def _entry_prefix(recipient, email_template):
+        return f'{recipient}#{email_template}#'
+
+    def add(self, run_id, recipient, email_template, entries):
+        prefix = self._entry_prefix(recipient, email_template)
+        expires_at = self._expires_at()
+        # numbered per account, in insert order
+        numbers = {}
+        requests = []
+        for account_id, account_name, message in entries:
+            number = numbers[account_id] = numbers.get(account_id, -1) + 1
+            requests.append({'PutRequest': {'Item': {
+                'RunId': {'S': run_id},
+                'EntryKey': {'S': f'{prefix}{account_id}#{number:05d}'},
+                'Recipient': {'S': recipient},
+                'EmailTemplate': {'S': email_template},
+                'AccountId': {'S': account_id},
+                'AccountName': {'S': account_name or ''},
+                'Message': {'S': message},
+                'ExpiresAt': {'N': expires_at}
+            }}})
+        batch_write_items(self.dynamodb_client, self.table_name, requests)
+
+    def recipients(self, run_id):
+        items = self._query(
+            run_id, ProjectionExpression='EntryKey, Recipient, EmailTemplate')
+        return list(dict.fromkeys(
+            (item['Recipient']['S'], item['EmailTemplate']['S'])
+            for item in items if item['EntryKey']['S'] != self.RUN_ITEM))
+
+    def _entry_items(self, run_id, recipient, email_template):
+        items = self._query(
+            run_id, key_condition=' AND begins_with(EntryKey, :prefix)',
+            values={':prefix': {'S': self._entry_prefix(recipient,
+                                                        email_template)}})
+        # a recipient containing '#' may share the prefix of another one
+        return [item for item in items
+                if item['Recipient']['S'] == recipient and
+                item['EmailTemplate']['S'] == email_template]
+
+    def entries(self, run_id, recipient, email_template):
+        return [(item['AccountId']['S'], item['AccountName']['S'],
+                 item['Message']['S'])
+                for item in self._entry_items(run_id, recipient,
+                                              email_template)]
+
+    def delete(self, run_id, recipient, email_template):
+        batch_write_items(
+            self.dynamodb_client, self.table_name,
+            [{'DeleteRequest': {'Key': {
+                'RunId': item['RunId'],
+                'EntryKey': item['EntryKey']
+            }}} for item in self._entry_items(run_id, recipient,
+                                              email_template)])
+
+    def finish_batches(self, run_id, batch_ids):
+        key = {'RunId': {'S': run_id}, 'EntryKey': {'S': self.RUN_ITEM}}
+        if not batch_ids:
+            item = self.dynamodb_client.get_item(
+                TableName=self.table_name, Key=key).get('Item', {})
+            return len(item.get('FinishedBatches', {}).get('SS', []))
+        item = self.dynamodb_client.update_item(
+            TableName=self.table_name,
+            Key=key,
+            UpdateExpression='ADD FinishedBatches :batch_ids'
+                             ' SET ExpiresAt = :expires_at',
+            ExpressionAttributeValues={
+                ':batch_ids': {'SS': list(batch_ids)},
+                ':expires_at': {'N': self._expires_at()}},
+            ReturnValues='ALL_NEW')['Attributes']
+        return len(item['FinishedBatches']['SS'])
+
+
+# store name -> function creating the store
+DIGEST_STORES = {
+    'sqlite': lambda: SQLiteDigestStore(config.digestStorePath),
+    'dynamodb': lambda: DynamoDBDigestStore(config.digestTable),
+}
+
+digest_stores = StoreRegistry('digest store', DIGEST_STORES,
+                              lambda: config.digestStore)
+
+
+def get_digest_store():
+    """
+    Gets the configured digest store, shared by warm invocations.
+
+    :return The DigestStore.
+    """
+    return digest_stores.get()
+
+
+class OwnerDigest:
+    """The resource owner actions of one run."""
+
+    def __init__(self, run_id, store: DigestStore) -> None:
+        self.run_id = run_id
+        self.store = store
+
+    def add(self, recipient, account_id, account_name, action_queue, dryrun,
+            email_template):
+        """Adds the actions of an account for a resource owner."""
+        self.store.add(
+            self.run_id, recipient, email_template,
+            [(account_id, account_name, message)
+             for message in format_action_messages(action_queue, dryrun)])
+
+    def finish_batches(self, batch_ids, run_batches):
+        """
+        Marks batches of the run as finished.
+
+        :param batch_ids: The batches evaluated by the invocation
+        :param run_batches: The number of batches of the run
+        :return True if all batches of the run are finished.
+        """
+        if not self.store.shared:
+            # the other batches are finished in other containers
+            log.warning(
+                f'The digest store is not shared by the invocations of run'
+                f' {self.run_id}, sending the digest of this invocation.')
+            return True
+        finished = self.store.finish_batches(self.run_id,
+                                             [str(batch_id)
+                                              for batch_id in batch_ids])
+        log.info(f'Finished {finished} of {run_batches} batches of run'
+                 f' {self.run_id}.')
+        return finished >= int(run_batches)
+
+    def flush(self, context):
+        """
+        Sends one digest per recipient and removes the sent entries.
+
+        :return The number of digests sent.
+        """
+        sent = 0
+        for recipient, email_template in self.store.recipients(self.run_id):
+            entries = self.store.entries(self.run_id, recipient,
+                                         email_template)
+            account_ids = list(dict.fromkeys(
+                account_id for account_id, _, _ in entries))
+            actions_formatted = [
+                f'{account_id} ({account_name}): {message}'
+                for account_id, account_name, message in entries]
+            payload = build_notifier_payload(
+                context, ', '.join(account_ids),
+                f'{len(account_ids)} accounts', recipient, actions_formatted,
+                email_template)
+            invoke_notifier(payload)
+            self.store.delete(self.run_id, recipient, email_template)
+            sent += 1
+        log.info(f'Sent {sent} owner digests for run {self.run_id}.')
+        return sent
@@ -0,0 +1 @@
+../common/rate_limiter.py
\ No newline at end of file
@@ -0,0 +1,357 @@
+
+
+"""Scan Checkpoint.
+
+Lets the scan of a large account span several invocations. When the
+remaining time of an invocation drops below config.scanTimeBuffer, the
+scan stores the users processed so far, their partial action queue and
+key states as a checkpoint and raises ScanSuspended. The handler then
+invokes the function again with a continuation token, and the next
+invocation resumes the scan from the checkpoint.
+
+Once the scan is finished, the actions are executed until the time is up
+as well. The actions not started yet are stored as a checkpoint of the
+execute phase, in place of the checkpoint the invocation was resumed from,
+so that a retry does not execute the other actions again. The checkpoint
+is deleted once all actions were executed and notified.
+
+The checkpoint a scan was resumed from is deleted only once the next
+invocation was accepted, and tokens are derived from the token or request
+id of the invocation, so that a retried invocation stores its checkpoint
+under the same token and can still load the one it resumes from. The
+checkpoint store is pluggable: the S3 store keeps checkpoints in a bucket,
+the file store in a directory shared by all containers of the function,
+e.g. an EFS mount.
+"""
+
+import abc
+import json
+import os
+
+from config import Config, log
+from client_factory import get_client
+from decision_engine import serialize_action, deserialize_action
+from key_state_store import serialize_user_key_state, \
+    deserialize_user_key_state
+from stores import StoreRegistry
+
+config = Config()
+
+
+class ScanSuspended(Exception):
+    """Raised when a scan was checkpointed before the function timed out."""
+
+    def __init__(self, continuation_token, resumed_token=None):
+        super().__init__(f'Scan suspended, continuation token'
+                         f' {continuation_token}')
+        self.continuation_token = continuation_token
+        # the checkpoint the suspended scan was resumed from, deleted once
+        # the scan is continued
+        self.resumed_token = resumed_token
+        # the event continuing the work of the invocation, set by the
+        # handler
+        self.event = None
+
+
+class CheckpointStore(abc.ABC):
+    """Keeps the checkpoints of suspended scans until they are resumed."""
+
+    @abc.abstractmethod
+    def save(self, token, data):
+        """Stores the checkpoint data, a JSON string, under a token."""
+
+    @abc.abstractmethod
+    def load(self, token):
+        """
+        :return The checkpoint data stored under the token, or None if it
+            does not exist.
+        """
+
+    @abc.abstractmethod
+    def delete(self, token):
+        """Deletes the checkpoint stored under the token, if it exists."""
+
+
+# Directories of a container's own file system, a scan continued in
+# another container would not find its checkpoint there
+CONTAINER_LOCAL_DIRS = ('/tmp',)
+
+
+class FileCheckpointStore(CheckpointStore):
+    """
+    Checkpoint store in a directory shared by all containers of the
+    function, one file per checkpoint.
+    """
+
+    def __init__(self, directory):
+        path = os.path.realpath(directory) if directory else None
+        if path is None or any(
+                path == local_dir or path.startswith(local_dir + os.sep)
+                for local_dir in CONTAINER_LOCAL_DIRS):
+            raise ValueError(
+                f'The file checkpoint store needs a directory shared by all'
+                f' containers of the function, e.g. an EFS mount, not'
+                f' {directory}')
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, token):
+        return os.path.join(self.directory, f'{token}.json')
+
+    def save(self, token, data):
+        # write the whole file before it becomes visible
+        path = self._path(token)
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as checkpoint_file:
+            checkpoint_file.write(data)
+        os.replace(f'{path}.tmp', path)
+
+    def load(self, token):
+        try:
+            with open(self._path(token), encoding='utf-8') as checkpoint_file:
+                return checkpoint_file.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, token):
+        try:
+            os.remove(self._path(token))
+        except FileNotFoundError:
+            pass
+
+
+class S3CheckpointStore(CheckpointStore):
+    """Checkpoint store in an S3 bucket, one object per checkpoint."""
+
+    def __init__(self, bucket, prefix, s3_client=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.s3_client = s3_client or get_client('s3')
+
+    def _key(self, token):
+        return f'{self.prefix}{token}.json'
+
+    def save(self, token, data):
+        self.s3_client.put_object(Bucket=self.bucket, Key=self._key(token),
+                                  Body=data.encode('utf-8'))
+
+    def load(self, token):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket,
+                                                 Key=self._key(token))
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+        return response['Body'].read().decode('utf-8')
+
+    def delete(self, token):
+        self.s3_client.delete_object(Bucket=self.bucket,
+                                     Key=self._key(token))
+
+
+# store name -> function creating the store
+CHECKPOINT_STORES = {
+    'file': lambda: FileCheckpointStore(config.scanCheckpointPath),
+    's3': lambda: S3CheckpointStore(config.scanCheckpointBucket,
+                                    config.scanCheckpointPrefix),
+}
+
+checkpoint_stores = StoreRegistry('scan checkpoint store',
+                                  CHECKPOINT_STORES,
+                                  lambda: config.scanCheckpointStore)
+
+
+def get_checkpoint_store():
+    """
+    Gets the configured checkpoint store, shared by warm invocations.
+
+    :return The CheckpointStore, or None if scans are not checkpointed.
+    """
+    return checkpoint_stores.get()
+
+
+class ScanProgress:
+    """
+    The progress of the scan of one account, restored from a checkpoint
+    when the scan is resumed.
+    """
+
+    def __init__(self, account_id, context, store, continuation_token=None):
+        self.account_id = account_id
+        self.context = context
+        self.store = store
+        self.continuation_token = continuation_token
+        # names of the users processed in order, by this and earlier
+        # invocations
+        self.processed_users = []
+        self.action_queue = []
+        self.user_key_states = []
+        # set when an earlier invocation finished the scan, the action
+        # queue holds the actions still to be executed
+        self.scan_finished = False
+        if continuation_token:
+            data = store.load(continuation_token)
+            if data is not None:
+                self._restore(json.loads(data))
+            else:
+                # a retry of an invocation that finished the scan
+                log.warning(
+                    f'Checkpoint {continuation_token} of Account ID:'
+                    f' {account_id} no longer exists, scanning the account'
+                    f' from the start.')
+
+    @classmethod
+    def start(cls, account_id, context, continuation_token=None):
+        """
+        :return The ScanProgress of the account, or None if the scan is not
+            checkpointed.
+        """
+        store = get_checkpoint_store()
+        if store is None or context is None or account_id is None:
+            return None
+        return cls(account_id, context, store, continuation_token)
+
+    def _restore(self, checkpoint):
+        if checkpoint['account_id'] != self.account_id:
+            raise ValueError(
+                f'Checkpoint {self.continuation_token} belongs to account'
+                f' {checkpoint["account_id"]}, not {self.account_id}')
+        if checkpoint.get('phase') == 'execute':
+            self.scan_finished = True
+            self.action_queue = [deserialize_action(values)
+                                 for values in checkpoint['actions']]
+            log.info(
+                f'Resuming the execution of {len(self.action_queue)}'
+                f' actions of Account ID: {self.account_id}.')
+            return
+        self.processed_users = checkpoint['processed_users']
+        self.action_queue = [deserialize_action(values)
+                             for values in checkpoint['actions']]
+        self.user_key_states = [deserialize_user_key_state(values)
+                                for values in checkpoint['user_key_states']]
+        log.info(
+            f'Resuming the scan of Account ID: {self.account_id} after user'
+            f' {checkpoint["last_user"]}, {len(self.processed_users)} users'
+            f' and {len(self.action_queue)} actions restored.')
+
+    def skip_processed(self, user_keys):
+        """
+        Leaves out the users processed before the scan was suspended.
+
+        :return A generator of (user name, key records) tuples.
+        """
+        processed_users = set(self.processed_users)
+        for user in user_keys:
+            if user[0] not in processed_users:
+                yield user
+
+    def get_next_token(self):
+        """
+        Derives the token of the next checkpoint from the token the scan
+        was resumed from, or from the request id when it was not, e.g.
+        123456789012-<request id>.2 after 123456789012-<request id>.1.
+
+        :return The token.
+        """
+        if self.continuation_token:
+            base, _, sequence = self.continuation_token.rpartition('.')
+            if base and sequence.isdigit():
+                return f'{base}.{int(sequence) + 1}'
+            return f'{self.continuation_token}.1'
+        return f'{self.account_id}-{self.context.aws_request_id}.1'
+
+    def time_is_up(self):
+        """
+        :return True if the invocation is about to time out.
+        """
+        return self.context.get_remaining_time_in_millis() < \
+            config.scanTimeBuffer * 1000
+
+    def suspend(self, processed_users, action_queue, user_key_states):
+        """
+        Stores a checkpoint of the scan and raises ScanSuspended with its
+        token. Key states of users still being evaluated are left out, the
+        users are evaluated again when the scan resumes. The checkpoint the
+        scan was resumed from is kept until the scan is continued.
+
+        :param processed_users: Names of the users processed by this
+            invocation, in order
+        :param action_queue: Actions of all processed users
+        :param user_key_states: Key states of the processed users, or None
+        """
+        processed_users = self.processed_users + processed_users
+        processed = set(processed_users)
+        checkpoint = {
+            'account_id': self.account_id,
+            'phase': 'scan',
+            'last_user': processed_users[-1] if processed_users else None,
+            'processed_users': processed_users,
+            'actions': [serialize_action(action) for action in action_queue],
+            'user_key_states': [
+                serialize_user_key_state(state)
+                for state in user_key_states or ()
+                if state.user_name in processed],
+        }
+        token = self.get_next_token()
+        self.store.save(token, json.dumps(checkpoint,
+                                          separators=(',', ':')))
+        log.info(
+            f'Suspended the scan of Account ID: {self.account_id} after'
+            f' {len(processed_users)} users with {len(action_queue)}'
+            f' actions, continuation token {token}.')
+        raise ScanSuspended(token, self.continuation_token)
+
+    def record_execution(self, pending_actions):
+        """
+        Stores the actions that were not executed yet as a checkpoint of
+        the execute phase. It replaces the checkpoint the invocation was
+        resumed from, a retry of the invocation does not execute the
+        other actions again. Nothing is stored when the invocation was not
+        resumed and all actions were executed.
+
+        :param pending_actions: Actions that were not started, in order
+        :return The continuation token to execute the pending actions
+            with, or None if there are none.
+        """
+        if not pending_actions and not self.continuation_token:
+            return None
+        token = self.continuation_token or self.get_next_token()
+        checkpoint = {
+            'account_id': self.account_id,
+            'phase': 'execute',
+            'actions': [serialize_action(action)
+                        for action in pending_actions],
+        }
+        self.store.save(token, json.dumps(checkpoint,
+                                          separators=(',', ':')))
+        self.continuation_token = token
+        if not pending_actions:
+            return None
+        log.info(
+            f'Suspended the execution of Account ID: {self.account_id} with'
+            f' {len(pending_actions)} actions left, continuation token'
+            f' {token}.')
+        return token
+
+    def finish(self):
+        """
+        Deletes the checkpoint the scan was resumed from, once its actions
+        were executed and notified.
+        """
+        if self.continuation_token:
+            self.store.delete(self.continuation_token)
+            self.continuation_token = None
+
+
+def continue_scan(context, event, resumed_token=None):
+    """
+    Invokes the function again with the event continuing a suspended
+    scan. Once the invocation was accepted, the checkpoint the suspended
+    scan was resumed from is deleted.
+    """
+    lambda_client = get_client('lambda')
+    lambda_client.invoke(FunctionName=context.invoked_function_arn,
+                         InvocationType='Event',
+                         Payload=json.dumps(event, separators=(',', ':')))
+    log.info(f'Invoked {context.invoked_function_arn} to continue with'
+             f' {event}.')
+    if resumed_token:
+        get_checkpoint_store().delete(resumed_token)
@@ -0,0 +1,70 @@
+
+
+"""Stores.
+
+Helpers shared by the pluggable stores of the function: the key state,
+owner digest and scan checkpoint stores. A StoreRegistry creates the
+store selected by a config setting once, and shares it with warm
+invocations.
+"""
+
+import threading
+
+from typing import Callable, Dict
+
+from config import log
+
+
+class StoreRegistry:
+    """The stores of one kind, by the names of their config setting."""
+
+    def __init__(self, kind: str, stores: Dict[str, Callable],
+                 get_store_name: Callable[[], str]) -> None:
+        """
+        :param kind: e.g. 'key state store', used in messages
+        :param stores: Dict of store name -> function creating the store
+        :param get_store_name: Returns the configured store name, 'none'
+            for no store
+        """
+        self.kind = kind
+        self.stores = stores
+        self.get_store_name = get_store_name
+        self._store = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Gets the configured store, created on first use.
+
+        :return The store, or None if the store name is 'none'.
+        """
+        store_name = self.get_store_name()
+        if store_name == 'none':
+            return None
+        with self._lock:
+            if self._store is None:
+                if store_name not in self.stores:
+                    raise ValueError(
+                        f'Unknown {self.kind} {store_name}, expected one of'
+                        f' {sorted(self.stores)}')
+                self._store = self.stores[store_name]()
+                log.info(f'Using the {store_name} {self.kind}.')
+            return self._store
+
+    def clear(self):
+        """Drops the created store, the next get creates it again."""
+        with self._lock:
+            self._store = None
+
+
+def batch_write_items(dynamodb_client, table_name, requests):
+    """
+    Writes put and delete requests to a DynamoDB table, retrying the
+    unprocessed ones.
+    """
+    # batch_write_item takes up to 25 requests
+    for i in range(0, len(requests), 25):
+        pending = {table_name: requests[i:i + 25]}
+        while pending:
+            response = dynamodb_client.batch_write_item(RequestItems=pending)
+            pending = response.get('UnprocessedItems')
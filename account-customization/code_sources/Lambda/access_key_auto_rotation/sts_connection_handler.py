@@ -4,19 +4,98 @@
 
 This module provides the functionality to establish connections to 
 different AWS accounts.
+
+The session of the central orgListAccount account is cached at module
+level and reused across warm invocations until shortly before its
+credentials expire. Sessions of the evaluated accounts are not cached:
+each one holds its own clients, rate limiter and metric handlers, several
+MB per account, and is released once its account has been evaluated.
 """
 
+import datetime
+import threading
 import boto3
 
 from aws_partitions import get_partition_for_region
+from client_factory import get_client, get_default_session
 from config import Config, log
 
+# (assumed session, credentials expiration) of the central account
+_central_session = None
+_central_session_lock = threading.Lock()
+
+# Counters for the central session, kept for the lifetime of the container
+_session_cache_stats = {'hits': 0, 'misses': 0, 'refreshes': 0}
+
+
+def get_session_cache_stats():
+    """
+    Gets the hit, miss and refresh counters of the central session.
+
+    :return A copy of the counters.
+    """
+    with _central_session_lock:
+        return dict(_session_cache_stats)
+
+
+def clear_session_cache():
+    """
+    Drops the cached central session, the next call assumes the role again.
+    """
+    global _central_session
+    with _central_session_lock:
+        _central_session = None
+
+
+def get_central_account_session():
+    """
+    Gets the session of the central orgListAccount account, cached across
+    warm invocations.
+
+    :return The assumed boto3 session.
+    """
+    global _central_session
+    config = Config()
+    account_id = config.orgListAccount
+
+    with _central_session_lock:
+        if _central_session is not None:
+            assumed_session, expiration = _central_session
+            now = datetime.datetime.now(datetime.timezone.utc)
+            refresh_at = expiration - datetime.timedelta(
+                seconds=config.sessionRefreshMargin)
+            if now < refresh_at:
+                _session_cache_stats['hits'] += 1
+                log.info(
+                    f'Reusing session for AccountID: [{account_id}],'
+                    f' credentials expire at {expiration.isoformat()}.')
+                return assumed_session
+            _session_cache_stats['refreshes'] += 1
+            log.info(
+                f'Session for AccountID: [{account_id}] expires at'
+                f' {expiration.isoformat()}, refreshing credentials.')
+        else:
+            _session_cache_stats['misses'] += 1
+
+        _central_session = _assume_role(account_id, config.orgListRole)
+        return _central_session[0]
+
 
 def get_account_session(aws_account_id, iam_assumed_role_name):
+    """
+    Assumes a role in an account. The session is not cached, it is
+    released with the last reference of the caller.
+
+    :return The assumed boto3 session.
+    """
+    assumed_session, _ = _assume_role(aws_account_id, iam_assumed_role_name)
+    return assumed_session
+
+
+def _assume_role(aws_account_id, iam_assumed_role_name):
     config = Config()
 
-    my_session = boto3.session.Session()
-    my_region = my_session.region_name
+    my_region = get_default_session().region_name
     partition = get_partition_for_region(my_region)
     # Call the assume_role method of the STSConnection object and pass the
     # role ARN and a role session name.
@@ -24,10 +103,7 @@ def get_account_session(aws_account_id, iam_assumed_role_name):
                     f"role/{iam_assumed_role_name}"
     # Create an STS client object that represents a live connection to the
     # STS service
-    if Config.runLambdaInVPC:
-        base_sts_client = my_session.client('sts', region_name=my_region, endpoint_url="https://sts." + my_region + ".amazonaws.com")
-    else:
-        base_sts_client = my_session.client('sts')
+    base_sts_client = get_client('sts')
     try:
         credentials = base_sts_client.assume_role(
             RoleArn=roleArnString,
@@ -47,4 +123,4 @@ def get_account_session(aws_account_id, iam_assumed_role_name):
         aws_secret_access_key=credentials['SecretAccessKey'],
         aws_session_token=credentials['SessionToken']
     )
-    return assumed_session
+    return assumed_session, credentials['Expiration']
@@ -0,0 +1,82 @@
+
+
+"""User Pipeline.
+
+This module provides generators that stream the IAM users of an account
+page by page, so evaluation can start before the whole account is listed.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from config import log
+
+
+def prefetch_pages(page_iterator):
+    """
+    Yields the pages of a paginator while the next page is already being
+    fetched in the background. At most two pages are held in memory.
+
+    :return A generator of pages.
+    """
+    pages = iter(page_iterator)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        next_page = executor.submit(next, pages, None)
+        while True:
+            page = next_page.result()
+            if page is None:
+                return
+            next_page = executor.submit(next, pages, None)
+            yield page
+
+
+def iter_users(iam_client):
+    """
+    Streams all IAM users of the account using the list_users paginator.
+
+    :return A generator of user dicts as returned by list_users.
+    """
+    paginator = iam_client.get_paginator('list_users')
+    page_number = 0
+    for page in prefetch_pages(paginator.paginate()):
+        page_number += 1
+        log.info(
+            f'--Fetched page {page_number} of users '
+            f'({len(page["Users"])} users).')
+        yield from page['Users']
+
+
+def list_user_access_keys(iam_client, user_name):
+    """
+    Gets all access keys of a user using the list_access_keys paginator.
+
+    :return The list of access key metadata for the user.
+    """
+    paginator = iam_client.get_paginator('list_access_keys')
+    access_key_metadata = []
+    for page in paginator.paginate(UserName=user_name):
+        access_key_metadata += page['AccessKeyMetadata']
+    return access_key_metadata
+
+
+def map_in_order(function, items, max_workers):
+    """
+    Applies function to every item on a bounded pool of worker threads.
+    Results are yielded in the order of the items, so the output is the
+    same as for a serial loop. At most 2 * max_workers items are in flight,
+    so items can be streamed from a generator.
+
+    :return A generator of results.
+    """
+    if max_workers <= 1:
+        yield from map(function, items)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= 2 * max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1 @@
+../common/aws_partitions.py
\ No newline at end of file
@@ -29,3 +29,20 @@ class Config:
 
     # Flag- If lambda is running  in VPC
     runLambdaInVPC = str(os.getenv('RunLambdaInVPC')).lower() == 'true'
+
+    # Number of rotation function invocations made concurrently
+    invocationConcurrency = int(os.getenv('InvocationConcurrency', 10))
+
+    # Number of accounts evaluated by one rotation function invocation.
+    # 1 sends the single account event.
+    accountsPerInvocation = int(os.getenv('AccountsPerInvocation', 1))
+
+    # Flag- The rotation function collects owner digests in a shared store,
+    # invocations defer them until all batches of the run are finished
+    deferOwnerDigest = str(os.getenv('DeferOwnerDigest')).lower() == 'true'
+
+    # Number of OUs fetched concurrently when walking the OU hierarchy
+    orgTraversalConcurrency = int(os.getenv('OrgTraversalConcurrency', 4))
+
+    # Seconds the OU tree is reused by warm invocations
+    orgTreeCacheTtl = int(os.getenv('OrgTreeCacheTtlSeconds', 3600))
@@ -7,13 +7,17 @@ for a full list of account IDs and emails. This script kicks off the
 access_key_auto_rotation function.
 """
 
-import boto3
 import os
 import json
 import logging
 
+from concurrent.futures import ThreadPoolExecutor
+
 from config import Config, log
 from sts_connection_handler import get_account_session
+from client_factory import get_client
+from org_tree import get_accounts_for_ous
+from call_metrics import flush_call_metrics
 
 config = Config()
 
@@ -21,28 +25,31 @@ config = Config()
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
-# AWS Lambda Client
-lambda_client = boto3.client('lambda')
-
 
 # main Python Function, parses events sent to lambda
 def lambda_handler(event, context):
 
     # environment Variables
     lambdaRotationFunction = os.environ['LambdaRotationFunction']
-    ou_id = os.getenv('InventoryOU')
+    # one or more comma separated OU ids
+    ou_ids = [ou_id.strip() for ou_id in
+              os.getenv('InventoryOU', '').split(',') if ou_id.strip()]
     
-    # Assume role in account with Organizations permissions
-    org_session = get_account_session(config.orgListAccount)
-    org_client = org_session.client('organizations')
-
-    # get AWS account details from AWS Organizations
-    if ou_id:
-        account_list = list_aws_accounts_for_ou(org_client, ou_id)
-    else:
-        account_list = list_all_aws_accounts(org_client)
-    # loop through all accounts and trigger the IAM Rotation Lambda
-    run_lambda_function(account_list, lambdaRotationFunction)
+    try:
+        # Assume role in account with Organizations permissions
+        org_session = get_account_session(config.orgListAccount)
+        org_client = get_client('organizations', org_session)
+
+        # get AWS account details from AWS Organizations
+        if ou_ids:
+            account_list = list_aws_accounts_for_ou(org_client, ou_ids)
+        else:
+            account_list = list_all_aws_accounts(org_client)
+        # loop through all accounts and trigger the IAM Rotation Lambda
+        return run_lambda_function(account_list, lambdaRotationFunction,
+                                   context.aws_request_id)
+    finally:
+        flush_call_metrics(config.orgListAccount, 'inventory')
 
 
 def list_all_aws_accounts(org_client):
@@ -66,73 +73,130 @@ def list_all_aws_accounts(org_client):
     return account_list
 
 
-def list_aws_accounts_for_ou(org_client, ou_id):
+def list_aws_accounts_for_ou(org_client, ou_ids):
     """
-    Gets the current list of AWS Accounts in an OU from AWS Organizations.
+    Gets the current list of AWS Accounts in one or more OUs, including
+    their child OUs, from AWS Organizations.
 
     :return The current dict of all AWS Accounts.
     """
-    log.info(f"Searching for accounts in OU {ou_id}")
-    account_list = []
+    log.info(f"Searching for accounts in OUs {ou_ids}")
+    account_list = get_accounts_for_ous(org_client, ou_ids)
+    log.info(f"Found {len(account_list)} accounts in OUs {ou_ids}")
 
-    # first add accounts directly in the ou
-    try:
-        # max limit of 20 accounts per listing
-        # use paginator to iterate through each page
-        lafp_paginator = org_client.get_paginator('list_accounts_for_parent')
-        lafp_page_iterator = lafp_paginator.paginate(ParentId=ou_id)
-        for page in lafp_page_iterator:
-            for acct in page['Accounts']:
-                account_list.append(acct)
-    except org_client.exceptions.ClientError as error:
-        log.error(f'Error: {error}')
+    return account_list
 
-    # next add accounts in child ous
-    try:
-        # max limit of 20 children per listing
-        # use paginator to iterate through each page
-        lc_paginator = org_client.get_paginator('list_children')
-        ou_page_iterator = lc_paginator.paginate(
-            ParentId=ou_id,
-            ChildType='ORGANIZATIONAL_UNIT'
-        )
-        for page in ou_page_iterator:
-            for child in page['Children']:
-                # recurse over child ous and add the accounts they contain
-                log.info(f"Adding accounts from child OU {child['Id']}")
-                account_list += list_aws_accounts_for_ou(child['Id'])
-    except org_client.exceptions.ClientError as error:
-        log.error(f'Error: {error}')
 
-    log.info(f"Found {len(account_list)} accounts in OU {ou_id}")
+def batch_accounts(awsAccountArray, batch_size):
+    """
+    Splits the active accounts into batches of batch_size accounts.
 
-    return account_list
+    :return A list of account batches.
+    """
+    # skip accounts that are suspended
+    active_accounts = [account for account in awsAccountArray
+                       if account['Status'] == 'ACTIVE']
+    batch_size = max(batch_size, 1)
+    return [active_accounts[i:i + batch_size]
+            for i in range(0, len(active_accounts), batch_size)]
+
+
+def build_payload(batch, run_id=None, batch_ids=None, run_batches=None):
+    """
+    Builds the rotation function event for a batch. A batch of one account
+    uses the single account event. The run id groups the owner digests of
+    the accounts of one inventory run. With batch ids the digest is
+    deferred until all run_batches batches of the run are finished.
+
+    :return The encoded payload.
+    """
+    accounts = [{
+        "account": account['Id'],
+        "name": account['Name'],
+        "email": account['Email']
+    } for account in batch]
+    if len(accounts) == 1:
+        jsonPayload = accounts[0]
+    else:
+        jsonPayload = {"accounts": accounts}
+    if run_id:
+        jsonPayload["run_id"] = run_id
+    if batch_ids is not None:
+        jsonPayload["defer_digest"] = True
+        jsonPayload["batch_ids"] = batch_ids
+        jsonPayload["run_batches"] = run_batches
+    return json.dumps(jsonPayload).encode('utf-8')
+
+
+def invoke_batch(lambda_client, lambdaFunction, batch, run_id=None,
+                 batch_ids=None, run_batches=None):
+    """
+    Invokes the rotation function asynchronously for a batch of accounts.
+
+    :return True if the invocation was accepted.
+    """
+    lambdaPayloadEncoded = build_payload(batch, run_id, batch_ids,
+                                         run_batches)
+    try:
+        lambda_client.invoke(
+            FunctionName=lambdaFunction, InvocationType='Event',
+            Payload=lambdaPayloadEncoded)
+        lambdaPayloadEncoded_str = str(lambdaPayloadEncoded)
+        log.info(f'Invoked: FunctionName= {lambdaFunction},'
+                 f' InvocationType=Event,'
+                 f' Payload= {lambdaPayloadEncoded_str}')
+        return True
+    except lambda_client.exceptions.ClientError as error:
+        log.error(f'Error: {error}')
+        return False
 
 
-def run_lambda_function(awsAccountArray, lambdaFunction):
+def run_lambda_function(awsAccountArray, lambdaFunction, run_id=None):
     """
-    Invokes the Lambda Function that evaluates key rotation.
+    Invokes the Lambda Function that evaluates key rotation. Batches of
+    accounts are invoked concurrently.
 
-    :return Response from Invoke command.
+    :return Summary of the succeeded and failed invocations.
     """
-    for account in awsAccountArray:
-        # skip accounts that are suspended
-        if account['Status'] != 'ACTIVE':
-            continue
-        jsonPayload = {
-            "account": account['Id'],
-            "name": account['Name'],
-            "email": account['Email']
-        }
-        lambdaPayloadEncoded = json.dumps(jsonPayload).encode('utf-8')
-        try:
-            response = lambda_client.invoke(
-                FunctionName=lambdaFunction, InvocationType='Event',
-                Payload=lambdaPayloadEncoded)
-            lambdaPayloadEncoded_str = str(lambdaPayloadEncoded)
-            log.info(f'Invoked: FunctionName= {lambdaFunction},'
-                     f' InvocationType=Event,'
-                     f' Payload= {lambdaPayloadEncoded_str}')
-        except lambda_client.exceptions.ClientError as error:
-            log.error(f'Error: {error}')
-    return response
+    # AWS Lambda Client
+    lambda_client = get_client('lambda')
+
+    batches = batch_accounts(awsAccountArray, config.accountsPerInvocation)
+    log.info(
+        f'Invoking {lambdaFunction} for {len(batches)} batches of up to'
+        f' {config.accountsPerInvocation} accounts with concurrency'
+        f' {config.invocationConcurrency}.')
+
+    # the invocation finishing the last batch sends the owner digests
+    defer_digest = config.deferOwnerDigest and bool(batches)
+    run_batches = len(batches) if defer_digest else None
+
+    with ThreadPoolExecutor(
+            max_workers=max(config.invocationConcurrency, 1)) as executor:
+        results = list(executor.map(
+            lambda n: invoke_batch(lambda_client, lambdaFunction, batches[n],
+                                   run_id, [n] if defer_digest else None,
+                                   run_batches),
+            range(len(batches))))
+
+    failed_batches = [n for n, succeeded in enumerate(results)
+                      if not succeeded]
+    if defer_digest and failed_batches:
+        # the failed batches are finished by an event without accounts, so
+        # that the digests of the others are sent
+        invoke_batch(lambda_client, lambdaFunction, [], run_id,
+                     failed_batches, run_batches)
+
+    failed_accounts = [account['Id']
+                       for batch, succeeded in zip(batches, results)
+                       if not succeeded for account in batch]
+    summary = {
+        "batches_succeeded": results.count(True),
+        "batches_failed": results.count(False),
+        "accounts_succeeded": sum(len(batch) for batch in batches)
+        - len(failed_accounts),
+        "accounts_failed": len(failed_accounts),
+        "failed_accounts": failed_accounts
+    }
+    log.info(f'Invocation summary: {summary}')
+    return summary
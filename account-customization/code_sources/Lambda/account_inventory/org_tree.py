@@ -0,0 +1,134 @@
+
+
+"""Organization Tree.
+
+This module walks the OU hierarchy of AWS Organizations breadth-first,
+fetching the OUs of one level concurrently. Every fetched OU is kept in a
+module-level cache, so warm invocations reuse the tree until it is older
+than the configured TTL.
+"""
+
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config, log
+
+# ou id -> (fetch time, accounts directly in the ou, child ou ids)
+_ou_cache = {}
+_ou_cache_lock = threading.Lock()
+
+
+def clear_ou_cache():
+    """
+    Drops the cached tree, the next traversal fetches every OU again.
+    """
+    with _ou_cache_lock:
+        _ou_cache.clear()
+
+
+def _fetch_ou(org_client, ou_id):
+    """
+    Gets the accounts and the child OUs directly under an OU.
+
+    :return The list of accounts, the list of child OU ids and whether
+        both listings succeeded.
+    """
+    accounts = []
+    child_ou_ids = []
+    complete = True
+
+    try:
+        # max limit of 20 accounts per listing
+        # use paginator to iterate through each page
+        lafp_paginator = org_client.get_paginator('list_accounts_for_parent')
+        for page in lafp_paginator.paginate(ParentId=ou_id):
+            accounts += page['Accounts']
+    except org_client.exceptions.ClientError as error:
+        log.error(f'Error: {error}')
+        complete = False
+
+    try:
+        # max limit of 20 children per listing
+        # use paginator to iterate through each page
+        lc_paginator = org_client.get_paginator('list_children')
+        for page in lc_paginator.paginate(ParentId=ou_id,
+                                          ChildType='ORGANIZATIONAL_UNIT'):
+            child_ou_ids += [child['Id'] for child in page['Children']]
+    except org_client.exceptions.ClientError as error:
+        log.error(f'Error: {error}')
+        complete = False
+
+    return accounts, child_ou_ids, complete
+
+
+def _get_cached_ou(ou_id, now, ttl):
+    with _ou_cache_lock:
+        cached = _ou_cache.get(ou_id)
+    if cached is None or now - cached[0] > ttl:
+        return None
+    return cached[1], cached[2]
+
+
+def get_ou_tree(org_client, root_ou_ids):
+    """
+    Walks the OUs under the root OUs breadth-first. The OUs of one level
+    are fetched concurrently, OUs found in the cache are not fetched.
+
+    :return A dict of ou id -> (accounts, child ou ids) for all visited OUs.
+    """
+    config = Config()
+    now = time.monotonic()
+    tree = {}
+    level = list(dict.fromkeys(root_ou_ids))
+    fetched = 0
+
+    with ThreadPoolExecutor(
+            max_workers=max(config.orgTraversalConcurrency, 1)) as executor:
+        while level:
+            to_fetch = []
+            for ou_id in level:
+                cached = _get_cached_ou(ou_id, now, config.orgTreeCacheTtl)
+                if cached is None:
+                    to_fetch.append(ou_id)
+                else:
+                    tree[ou_id] = cached
+
+            results = executor.map(
+                lambda ou_id: _fetch_ou(org_client, ou_id), to_fetch)
+            for ou_id, (accounts, child_ou_ids, complete) in \
+                    zip(to_fetch, results):
+                tree[ou_id] = (accounts, child_ou_ids)
+                # OUs that failed to list are fetched again next time
+                if complete:
+                    with _ou_cache_lock:
+                        _ou_cache[ou_id] = (now, accounts, child_ou_ids)
+            fetched += len(to_fetch)
+
+            next_level = []
+            for ou_id in level:
+                for child_ou_id in tree[ou_id][1]:
+                    if child_ou_id not in tree:
+                        next_level.append(child_ou_id)
+            level = list(dict.fromkeys(next_level))
+
+    log.info(
+        f'Visited {len(tree)} OUs, {fetched} fetched from AWS Organizations'
+        f' and {len(tree) - fetched} from cache.')
+    return tree
+
+
+def get_accounts_for_ous(org_client, root_ou_ids):
+    """
+    Gets the accounts in the root OUs and all OUs below them. An account
+    is returned once even if root OUs are nested.
+
+    :return The list of accounts.
+    """
+    tree = get_ou_tree(org_client, root_ou_ids)
+    accounts = {}
+    for ou_accounts, _ in tree.values():
+        for account in ou_accounts:
+            accounts.setdefault(account['Id'], account)
+    return list(accounts.values())
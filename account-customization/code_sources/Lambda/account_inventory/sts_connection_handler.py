@@ -9,6 +9,7 @@ different AWS accounts.
 import boto3
 
 from aws_partitions import get_partition_for_region
+from client_factory import get_client, get_default_session
 from config import Config, log
 
 
@@ -17,13 +18,8 @@ def get_account_session(aws_account_id):
 
     # Create an STS client object that represents a live connection to the
     # STS service
-    my_session = boto3.session.Session()
-    my_region = my_session.region_name
-
-    if Config.runLambdaInVPC:
-        base_sts_client = my_session.client('sts', region_name=my_region, endpoint_url="https://sts." + my_region + ".amazonaws.com")
-    else:
-        base_sts_client = my_session.client('sts')
+    my_region = get_default_session().region_name
+    base_sts_client = get_client('sts')
 
     partition = get_partition_for_region(my_region)
 
@@ -0,0 +1,98 @@
+
+
+"""Get AWS Partition.
+
+This module grabs the environment partition
+and the endpoint resolver.
+
+The partitions of the botocore endpoint data are indexed once per process:
+regions map to their partition in a dict, the partition region regexes are
+compiled once and their matches for regions that are not listed are
+memoized. It is shared by the rotation and inventory functions, each
+function directory holds a symlink to this file.
+"""
+
+import re
+import threading
+
+from client_factory import get_default_session
+
+
+class PartitionIndex:
+    """Lookup tables built from the partitions of the endpoint data."""
+
+    def __init__(self, partitions) -> None:
+        # partition id -> partition
+        self.partitions = {partition['partition']: partition
+                           for partition in partitions}
+        # region name -> partition id of the listed regions
+        self.region_partitions = {}
+        # (partition id, compiled region regex) in endpoint data order
+        self.region_patterns = []
+        # region name -> partition id, or None, of matched regex lookups
+        self._matched_regions = {}
+
+        for partition in partitions:
+            for region_name in partition['regions']:
+                self.region_partitions.setdefault(region_name,
+                                                  partition['partition'])
+            if 'regionRegex' in partition:
+                self.region_patterns.append(
+                    (partition['partition'],
+                     re.compile(partition['regionRegex'])))
+
+    def get_partition_for_region(self, region_name):
+        partition_id = self.region_partitions.get(region_name)
+        if partition_id is not None:
+            return partition_id
+        if region_name not in self._matched_regions:
+            self._matched_regions[region_name] = next(
+                (partition_id
+                 for partition_id, pattern in self.region_patterns
+                 if region_name is not None and pattern.match(region_name)),
+                None)
+        return self._matched_regions[region_name]
+
+    def get_partition(self, partition_id):
+        partition = self.partitions.get(partition_id)
+        if partition is None:
+            raise ValueError('Invalid partition: {0}'.format(partition_id))
+        return partition
+
+
+_partition_index = None
+_partition_index_lock = threading.Lock()
+
+
+def _get_partition_index():
+    global _partition_index
+    if _partition_index is None:
+        with _partition_index_lock:
+            if _partition_index is None:
+                endpoint_resolver = get_default_session()._session \
+                    ._get_internal_component('endpoint_resolver')
+                _partition_index = PartitionIndex(
+                    endpoint_resolver._endpoint_data['partitions'])
+    return _partition_index
+
+
+def get_partition_for_region(region_name=None):
+    partition_id = _get_partition_index().get_partition_for_region(
+        region_name)
+    if partition_id is None:
+        raise ValueError('Invalid region name: {0}'.format(region_name))
+    return partition_id
+
+
+def get_partition_name(partition_id=None):
+    return _get_partition_index().get_partition(partition_id)['partitionName']
+
+
+def get_iam_region(partition_id=None):
+    iam = _get_partition_index().get_partition(partition_id)['services']['iam']
+    partition_endpoint = iam['partitionEndpoint']
+    return iam['endpoints'][partition_endpoint]['credentialScope']['region']
+
+
+def get_partition_regions(partition_id=None):
+    return _get_partition_index().get_partition(partition_id)['regions'].keys()
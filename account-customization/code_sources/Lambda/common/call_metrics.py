@@ -0,0 +1,209 @@
+
+
+"""Call Metrics.
+
+Instruments the boto3 clients of the Lambda functions through the botocore
+before-call, after-call, after-call-error and needs-retry events, and
+collects per operation call counts, errors, retries, throttled attempts
+and a latency histogram. The metrics are flushed once per invocation, or
+per evaluated account, as CloudWatch Embedded Metric Format log lines.
+
+It is shared by all functions: each function directory holds a symlink to
+this file. client_factory instruments every client it creates.
+"""
+
+import json
+import os
+import threading
+import time
+
+# CloudWatch namespace of the metrics
+NAMESPACE = os.getenv('MetricsNamespace', 'IAMKeyRotation')
+
+# Upper bounds of the latency histogram buckets, the last bucket is open
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# EMF takes up to 100 values per metric
+MAX_LATENCY_SAMPLES = 100
+
+THROTTLING_ERROR_CODES = frozenset((
+    'Throttling', 'ThrottlingException', 'ThrottledException',
+    'RequestThrottledException', 'TooManyRequestsException',
+    'RequestLimitExceeded', 'RequestThrottled', 'SlowDown'))
+
+# key of the call start time in the botocore request context
+_START_KEY = 'call_metrics_start'
+
+
+class OperationMetrics:
+    """The calls of one operation since the last flush."""
+
+    __slots__ = ('calls', 'errors', 'retries', 'throttles', 'latency_sum',
+                 'latency_max', 'latency_samples', 'histogram')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttles = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.latency_samples = []
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def add_latency(self, latency_ms):
+        self.latency_sum += latency_ms
+        self.latency_max = max(self.latency_max, latency_ms)
+        if len(self.latency_samples) < MAX_LATENCY_SAMPLES:
+            self.latency_samples.append(round(latency_ms, 3))
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if latency_ms <= bound:
+                self.histogram[i] += 1
+                return
+        self.histogram[-1] += 1
+
+    def get_histogram(self):
+        """
+        :return Dict of bucket upper bound in ms -> number of calls.
+        """
+        bounds = [f'le_{bound}' for bound in LATENCY_BUCKETS_MS] + ['inf']
+        return dict(zip(bounds, self.histogram))
+
+
+def _split_event_name(event_name):
+    # e.g. after-call.secrets-manager.PutSecretValue
+    _, service, operation = event_name.split('.', 2)
+    return service, operation
+
+
+class CallMetrics:
+    def __init__(self) -> None:
+        # (service, operation) -> OperationMetrics
+        self._operations = {}
+        self._lock = threading.Lock()
+
+    def instrument(self, client):
+        """
+        Registers the metric handlers on the events of a client. The timer
+        starts after the other before-call handlers, so that waits of the
+        rate limiter are not counted as latency.
+        """
+        events = client.meta.events
+        events.register_last('before-call.*.*', self._before_call,
+                             unique_id='call-metrics-before-call')
+        events.register('after-call.*.*', self._after_call,
+                        unique_id='call-metrics-after-call')
+        events.register('after-call-error.*.*', self._after_call_error,
+                        unique_id='call-metrics-after-call-error')
+        events.register('needs-retry.*.*', self._needs_retry,
+                        unique_id='call-metrics-needs-retry')
+
+    def _get(self, event_name):
+        key = _split_event_name(event_name)
+        operation = self._operations.get(key)
+        if operation is None:
+            operation = self._operations[key] = OperationMetrics()
+        return operation
+
+    def _before_call(self, context, **kwargs):
+        context[_START_KEY] = time.perf_counter()
+
+    def _record(self, event_name, context, error, retries=0):
+        start = context.get(_START_KEY)
+        with self._lock:
+            operation = self._get(event_name)
+            operation.calls += 1
+            operation.errors += int(error)
+            operation.retries += retries
+            if start is not None:
+                operation.add_latency((time.perf_counter() - start) * 1000)
+
+    def _after_call(self, event_name, http_response, parsed, context,
+                    **kwargs):
+        self._record(
+            event_name, context, http_response.status_code >= 400,
+            parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0))
+
+    def _after_call_error(self, event_name, context, **kwargs):
+        self._record(event_name, context, True)
+
+    def _needs_retry(self, event_name, response, **kwargs):
+        # called after every attempt, the retry decision is left to botocore
+        if response is None:
+            return None
+        error_code = response[1].get('Error', {}).get('Code')
+        if error_code in THROTTLING_ERROR_CODES:
+            with self._lock:
+                self._get(event_name).throttles += 1
+        return None
+
+    def take(self):
+        """
+        Removes the metrics collected since the last call.
+
+        :return Dict of (service, operation) -> OperationMetrics.
+        """
+        with self._lock:
+            operations, self._operations = self._operations, {}
+        return operations
+
+    def flush(self, account_id=None, mode=None):
+        """
+        Prints the metrics collected since the last flush as EMF log lines,
+        one per operation, and resets them.
+
+        :param account_id: The evaluated account, logged as a property
+        :param mode: e.g. 'audit' or 'enforce', logged as a dimension
+        :return The number of lines printed.
+        """
+        operations = self.take()
+        timestamp = int(time.time() * 1000)
+        dimensions = [['Service', 'Operation']]
+        if mode:
+            dimensions.append(['Mode', 'Service', 'Operation'])
+
+        for (service, operation_name), operation in sorted(
+                operations.items()):
+            line = {
+                '_aws': {
+                    'Timestamp': timestamp,
+                    'CloudWatchMetrics': [{
+                        'Namespace': NAMESPACE,
+                        'Dimensions': dimensions,
+                        'Metrics': [
+                            {'Name': 'Calls', 'Unit': 'Count'},
+                            {'Name': 'Errors', 'Unit': 'Count'},
+                            {'Name': 'Retries', 'Unit': 'Count'},
+                            {'Name': 'Throttles', 'Unit': 'Count'},
+                            {'Name': 'Latency', 'Unit': 'Milliseconds'},
+                            {'Name': 'LatencyMax', 'Unit': 'Milliseconds'}
+                        ]
+                    }]
+                },
+                'Service': service,
+                'Operation': operation_name,
+                'Calls': operation.calls,
+                'Errors': operation.errors,
+                'Retries': operation.retries,
+                'Throttles': operation.throttles,
+                'Latency': operation.latency_samples,
+                'LatencyMax': round(operation.latency_max, 3),
+                'LatencySum': round(operation.latency_sum, 3),
+                'LatencyHistogram': operation.get_histogram(),
+                'FunctionName': os.getenv('AWS_LAMBDA_FUNCTION_NAME')
+            }
+            if mode:
+                line['Mode'] = mode
+            if account_id:
+                line['AccountId'] = account_id
+            # EMF lines must be printed as plain JSON, without log prefix
+            print(json.dumps(line, separators=(',', ':')))
+        return len(operations)
+
+
+# Shared by all clients of a function
+call_metrics = CallMetrics()
+
+
+def flush_call_metrics(account_id=None, mode=None):
+    return call_metrics.flush(account_id, mode)
@@ -0,0 +1,89 @@
+
+
+"""Client Factory.
+
+This module creates the boto3 clients used by the Lambda functions. Clients
+are cached per (session, service, region, endpoint) so that creating a
+client is a one-time cost per session, and the VPC endpoint rules are
+applied in one place. Every client is paced by the rate limiter of its
+session and instrumented with call_metrics.
+
+It is shared by all functions: each function directory holds a symlink to
+this file, which zip follows when the function packages are built, and
+provides its own config module with the runLambdaInVPC flag.
+"""
+
+import threading
+import weakref
+import boto3
+
+from config import Config
+from call_metrics import call_metrics
+from rate_limiter import limit_client_rate
+
+# Services reached through an interface VPC endpoint when the functions
+# run in a VPC
+VPC_ENDPOINT_SERVICES = ('sts', 'secretsmanager', 'ssm')
+
+# session -> {(service, region, endpoint): client}
+_clients = weakref.WeakKeyDictionary()
+
+# boto3 sessions are not thread-safe, clients are created under this lock
+_clients_lock = threading.Lock()
+
+_default_session = None
+
+
+def get_default_session():
+    """
+    Gets the session of the function's own execution role.
+
+    :return The default boto3 session.
+    """
+    global _default_session
+    with _clients_lock:
+        if _default_session is None:
+            _default_session = boto3.session.Session()
+        return _default_session
+
+
+def get_endpoint_url(service_name, region_name):
+    """
+    Gets the VPC endpoint URL for a service.
+
+    :return The endpoint URL, or None to use the default endpoint.
+    """
+    if Config.runLambdaInVPC and service_name in VPC_ENDPOINT_SERVICES:
+        return f'https://{service_name}.{region_name}.amazonaws.com'
+    return None
+
+
+def get_client(service_name, session=None, region_name=None):
+    """
+    Gets a cached client for a service. Clients are thread-safe and can be
+    shared by all threads working with the same session.
+
+    :param service_name: The boto3 service name
+    :param session: The session to create the client from, defaults to the
+        function's own session
+    :param region_name: The region of the client, defaults to the region of
+        the session
+    :return The boto3 client.
+    """
+    if session is None:
+        session = get_default_session()
+    region_name = region_name or session.region_name
+    endpoint_url = get_endpoint_url(service_name, region_name)
+    cache_key = (service_name, region_name, endpoint_url)
+
+    with _clients_lock:
+        session_clients = _clients.setdefault(session, {})
+        client = session_clients.get(cache_key)
+        if client is None:
+            client = session.client(service_name, region_name=region_name,
+                                    endpoint_url=endpoint_url)
+            # the latency of a call starts after the rate limiter's wait
+            limit_client_rate(client, session)
+            call_metrics.instrument(client)
+            session_clients[cache_key] = client
+        return client
@@ -0,0 +1,234 @@
+
+
+"""Rate Limiter.
+
+Paces the API calls made with one session, i.e. one account, through
+adaptive token buckets shared by all threads and clients of the session.
+A bucket shrinks its rate when a call is throttled and recovers slowly
+while calls succeed, so concurrent scans run close to the highest rate the
+account sustains instead of bouncing off its limit. Every attempt of a
+call takes a token, so retries of throttled calls are paced as well.
+
+Rates are configured per service, or per service and operation, in calls
+per second with the RateLimits environment variable, e.g.
+{"iam": 20, "iam.GetAccessKeyLastUsed": 10}. An operation with its own
+rate has its own bucket; the other operations of the service share the
+service bucket. Services without a rate are not limited.
+
+It is shared by all functions: each function directory holds a symlink to
+this file. client_factory limits every client it creates.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+
+from call_metrics import THROTTLING_ERROR_CODES
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+DEFAULT_RATE_LIMITS = {'iam': 20, 'secretsmanager': 40, 'sts': 40}
+
+# rule -> calls per second, {} disables the rate limiter
+RATE_LIMITS = json.loads(os.getenv('RateLimits') or 'null') \
+    or ({} if os.getenv('RateLimits') else DEFAULT_RATE_LIMITS)
+
+# Services whose limits apply to the account in all regions
+GLOBAL_SERVICES = ('iam', 'organizations')
+
+# The rate is multiplied by this factor on a throttled call
+DECREASE_FACTOR = 0.5
+
+# Share of the configured rate recovered per second without throttling
+RECOVERY_RATE = 0.05
+
+# Lowest share of the configured rate a bucket shrinks to
+MIN_RATE_SHARE = 0.05
+
+# Seconds during which further throttled calls do not shrink the rate
+# again, concurrent calls are often throttled together
+DECREASE_COOLDOWN = 1.0
+
+
+class AdaptiveTokenBucket:
+    def __init__(self, name, rate):
+        self.name = name
+        self.max_rate = float(rate)
+        self.min_rate = self.max_rate * MIN_RATE_SHARE
+        self.rate = self.max_rate
+        self.tokens = self._capacity()
+        self.updated = time.monotonic()
+        self.last_change = self.updated
+        self.last_decrease = None
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'waits': 0, 'wait_seconds': 0.0,
+                      'throttles': 0}
+
+    def _capacity(self):
+        # bursts shrink with the rate
+        return max(1.0, self.rate)
+
+    def _refill(self, now):
+        self.tokens = min(self._capacity(),
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """
+        Takes a token, waiting until one is available.
+
+        :return The seconds waited.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.stats['calls'] += 1
+                    if waited:
+                        self.stats['waits'] += 1
+                        self.stats['wait_seconds'] += waited
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def on_throttle(self):
+        with self._lock:
+            now = time.monotonic()
+            self.stats['throttles'] += 1
+            if self.last_decrease is not None and \
+                    now - self.last_decrease < DECREASE_COOLDOWN:
+                return
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate * DECREASE_FACTOR)
+            self.tokens = min(self.tokens, 0.0)
+            self.last_decrease = self.last_change = now
+            rate = self.rate
+        log.info(f'Throttled on {self.name}, reduced rate to {rate:.2f}/s')
+
+    def on_success(self):
+        with self._lock:
+            if self.rate >= self.max_rate:
+                return
+            now = time.monotonic()
+            elapsed = now - self.last_change
+            if elapsed < 1.0:
+                return
+            self._refill(now)
+            self.rate = min(self.max_rate,
+                            self.rate + self.max_rate * RECOVERY_RATE *
+                            elapsed)
+            self.last_change = now
+
+
+class RateLimiter:
+    """The token buckets of one session."""
+
+    def __init__(self, rate_limits):
+        self.rate_limits = rate_limits
+        # (rule, region) -> AdaptiveTokenBucket
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def get_bucket(self, service_name, region_name, operation_name):
+        """
+        :return The bucket of an operation, or None if it is not limited.
+        """
+        rule = f'{service_name}.{operation_name}'
+        if rule not in self.rate_limits:
+            rule = service_name
+            if rule not in self.rate_limits:
+                return None
+        if service_name in GLOBAL_SERVICES:
+            region_name = None
+        key = (rule, region_name)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = AdaptiveTokenBucket(
+                    f'{rule} {region_name or "global"}',
+                    self.rate_limits[rule])
+            return bucket
+
+    def get_stats(self):
+        """
+        :return Dict of bucket name -> rate and stats.
+        """
+        with self._lock:
+            buckets = list(self._buckets.values())
+        return {bucket.name: dict(bucket.stats, rate=round(bucket.rate, 2))
+                for bucket in buckets}
+
+
+# session -> RateLimiter
+_rate_limiters = weakref.WeakKeyDictionary()
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(session):
+    """
+    :return The RateLimiter shared by all clients of a session.
+    """
+    with _rate_limiters_lock:
+        rate_limiter = _rate_limiters.get(session)
+        if rate_limiter is None:
+            rate_limiter = _rate_limiters[session] = RateLimiter(RATE_LIMITS)
+        return rate_limiter
+
+
+def limit_client_rate(client, session):
+    """Paces the calls of a client with the rate limiter of its session."""
+    if not RATE_LIMITS:
+        return
+    rate_limiter = get_rate_limiter(session)
+    service_name = client.meta.service_model.service_name
+    region_name = client.meta.region_name
+
+    def get_bucket(event_name):
+        operation_name = event_name.rsplit('.', 1)[1]
+        return rate_limiter.get_bucket(service_name, region_name,
+                                       operation_name)
+
+    def before_call(event_name, **kwargs):
+        bucket = get_bucket(event_name)
+        if bucket is not None:
+            bucket.acquire()
+
+    def request_created(event_name, request, **kwargs):
+        # a request is created for every attempt, retries take a token as
+        # well. The first attempt took its token before the call
+        if request.context.get('retries', {}).get('attempt', 1) > 1:
+            bucket = get_bucket(event_name)
+            if bucket is not None:
+                bucket.acquire()
+
+    def after_call(event_name, http_response, **kwargs):
+        bucket = get_bucket(event_name)
+        if bucket is not None and http_response.status_code < 400:
+            bucket.on_success()
+
+    def needs_retry(event_name, response, **kwargs):
+        # called after every attempt, the retry decision is left to botocore
+        if response is None:
+            return None
+        if response[1].get('Error', {}).get('Code') in THROTTLING_ERROR_CODES:
+            bucket = get_bucket(event_name)
+            if bucket is not None:
+                bucket.on_throttle()
+        return None
+
+    events = client.meta.events
+    events.register('before-call.*.*', before_call,
+                    unique_id='rate-limiter-before-call')
+    events.register('request-created.*.*', request_created,
+                    unique_id='rate-limiter-request-created')
+    events.register('after-call.*.*', after_call,
+                    unique_id='rate-limiter-after-call')
+    events.register('needs-retry.*.*', needs_retry,
+                    unique_id='rate-limiter-needs-retry')
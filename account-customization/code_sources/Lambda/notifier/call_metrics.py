@@ -0,0 +1 @@
+../common/call_metrics.py
\ No newline at end of file
@@ -0,0 +1 @@
+../common/client_factory.py
\ No newline at end of file
@@ -19,4 +19,16 @@ class Config:
     runLambdaInVPC = str(os.getenv('RunLambdaInVPC')).lower() == 'true'
     smtp_user_param = os.getenv("SMTPUserParamName")
     smtp_password_param = os.getenv("SMTPPasswordParamName")
+    # Seconds the SMTP credentials read from SSM are reused
+    smtp_credentials_ttl = int(os.getenv('SMTPCredentialsTtlSeconds', 900))
+    # Seconds a kept SMTP session may be idle before it is checked with NOOP
+    smtp_health_check_after = int(os.getenv('SMTPHealthCheckAfterSeconds', 10))
+    # Templates kept in memory across warm invocations
+    template_cache_size = int(os.getenv('TemplateCacheSize', 16))
+    # Seconds before a cached S3 template is revalidated with its ETag
+    template_cache_ttl = int(os.getenv('TemplateCacheTtlSeconds', 300))
+    # Templates shipped with the deployment package, served without S3
+    template_package_dir = os.getenv(
+        'TemplatePackageDir',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Template'))
 
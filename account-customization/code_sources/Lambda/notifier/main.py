@@ -11,6 +11,7 @@ from datetime import datetime
 
 from config import Config
 from notifier import Notifier
+from call_metrics import flush_call_metrics
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
@@ -31,7 +32,10 @@ def lambda_handler(event: dict = None, context=None):
 
     notifier = Notifier(config.admin_email, email, config.s3_bucket_name,
                         config.s3_bucket_prefix, email_template, subject)
-    notifier.send_email(template_values)
+    try:
+        notifier.send_email(template_values)
+    finally:
+        flush_call_metrics(template_values.get('account_id'), 'notify')
 
 
 def parse_template_values(event, config):
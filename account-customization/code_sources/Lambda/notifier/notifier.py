@@ -6,11 +6,14 @@ Provies core logic for the Notifier Lambda Function.
 """
 
 import logging
-import boto3
 
 from botocore.exceptions import ClientError
 from config import Config
-import smtplib
+from client_factory import get_client, get_default_session
+from template_cache import TemplateCache
+from template_renderer import compile_template, render_template
+from smtp_connection import CachedCredentials, SmtpConnection
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
@@ -18,6 +21,32 @@ from email.mime.multipart import MIMEMultipart
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
+# Shared by all invocations of a warm container
+template_cache = TemplateCache(Config.template_cache_size,
+                               Config.template_cache_ttl)
+template_cache.preload(Config.template_package_dir)
+
+# SMTP session and credentials, opened on the first SMTP email
+smtp_connection = None
+smtp_connection_lock = threading.Lock()
+
+
+def get_smtp_connection() -> SmtpConnection:
+    """
+    :return The SMTP connection shared by all invocations.
+    """
+    global smtp_connection
+    with smtp_connection_lock:
+        if smtp_connection is None:
+            my_region = get_default_session().region_name
+            credentials = CachedCredentials(
+                lambda: get_client('ssm'), Config.smtp_user_param,
+                Config.smtp_password_param, Config.smtp_credentials_ttl)
+            smtp_connection = SmtpConnection(
+                "email-smtp." + my_region + ".amazonaws.com", 465,
+                credentials, Config.smtp_health_check_after)
+        return smtp_connection
+
 
 class Notifier:
     def __init__(self, sender_email: str, recipient_email: str,
@@ -52,24 +81,23 @@ class Notifier:
         return result
 
     def __get_template(self, template_name):
-        log.info(f'Getting template {template_name} from S3')
-        s3 = boto3.client('s3')
+        log.info(f'Getting template {template_name}')
+        s3 = get_client('s3')
 
         try:
-            obj = s3.get_object(
-                Bucket=self.template_s3_bucket,
-                Key=f'{self.template_s3_prefix}/Template/{template_name}'
-            )
-
-            data = obj['Body'].read()
-            template = data.decode('utf-8')
-            log.info(f'Successfully retrieved content for {template_name}')
+            template = template_cache.get(
+                s3, self.template_s3_bucket,
+                f'{self.template_s3_prefix}/Template/{template_name}',
+                template_name)
+            log.info(f'Successfully retrieved content for {template_name}'
+                     f' - cache {template_cache.stats}')
             return template
         except ClientError as err:
             log.error(
                 f'Error while getting file contents for {template_name}'
                 f' - {err}'
             )
+            raise
 
     def __render_email_body(self, template_values: dict):
         subject = self.subject
@@ -79,29 +107,20 @@ class Notifier:
             log.error(f'Unable to get template for {subject}')
             raise ValueError(f'Unable to get template for {subject}')
         else:
-            # stream the template contents from S3
-            email = self.__get_template(template_s3_key)
+            # get the template from the cache, the package or S3
+            template = self.__get_template(template_s3_key)
+
+            # the template is compiled once and kept with the cached template
+            if template.compiled is None:
+                template.compiled = compile_template(template.body)
 
             log.info('Rendering email contents')
-            for k, v in template_values.items():
-                placeholder = '{{' + f'{k}' + '}}'
-                if isinstance(v, list):
-                    value = self.__format_html_list(v)
-                else:
-                    value = str(v)
-                email = email.replace(placeholder, value)
+            email = render_template(template.compiled, template_values)
 
-            log.info(f'Rendered Email: {email}')
+            log.info(f'Rendered Email: {len(email)} characters')
 
             return email
 
-    @staticmethod
-    def __format_html_list(value):
-        value_formatted = ''
-        for line in value:
-            value_formatted += f'&bull; {str(line)}<br>'
-        return value_formatted
-
     def send_email(self, template_values):
         if Config.runLambdaInVPC:
             self.send_smtp_email(template_values)
@@ -109,9 +128,7 @@ class Notifier:
             self.send_ses_email(template_values)
 
     def send_ses_email(self, template_values):
-        my_session = boto3.session.Session()
-        my_region = my_session.region_name
-        ses = my_session.client('ses', region_name=my_region)
+        ses = get_client('ses')
 
         email_body = self.__render_email_body(template_values)
 
@@ -147,32 +164,41 @@ class Notifier:
             print(err)
             raise err
 
-    def send_smtp_email(self, template_values):
-        my_session = boto3.session.Session()
-        my_region = my_session.region_name
-        port = 465
+    def build_smtp_message(self, template_values) -> str:
         email_body = self.__render_email_body(template_values)
         message = MIMEMultipart()
         message['Subject'] = self.subject
         message['From'] = self.sender_email
         message['To'] = self.recipient_email
         message.attach(MIMEText(email_body, "html"))
-        msgbody = message.as_string()
+        return message.as_string()
 
-        ssm = my_session.client('ssm', region_name=my_region, endpoint_url="https://ssm." + my_region + ".amazonaws.com")
-        user = ssm.get_parameter(Name=Config.smtp_user_param, WithDecryption=False)
-        password = ssm.get_parameter(Name=Config.smtp_password_param, WithDecryption=True)
+    def send_smtp_email(self, template_values):
+        msgbody = self.build_smtp_message(template_values)
 
         try:
             log.info(f'Sending email to {self.recipient_email}')
-            server = smtplib.SMTP_SSL("email-smtp." + my_region + ".amazonaws.com", port)
-
-            server.login(user.get("Parameter").get("Value"), password.get("Parameter").get("Value"))
-            server.sendmail(self.sender_email, self.recipient_email, msgbody)
-            log.info('Email sent successfully - Exiting Gracefully')
+            connection = get_smtp_connection()
+            connection.send_messages(
+                [(self.sender_email, self.recipient_email, msgbody)])
+            log.info(f'Email sent successfully - SMTP {connection.stats}')
         except ClientError as err:
             log.error(
                 f'Encountered error while attempting to send email - {err}'
             )
             print(err)
-            raise err
\ No newline at end of file
+            raise err
+
+    @staticmethod
+    def send_smtp_emails(notifiers_and_values):
+        """
+        Sends several emails over one SMTP session.
+
+        :param notifiers_and_values: List of (Notifier, template values)
+        :return The number of emails sent.
+        """
+        messages = [(notifier.sender_email, notifier.recipient_email,
+                     notifier.build_smtp_message(template_values))
+                    for notifier, template_values in notifiers_and_values]
+        log.info(f'Sending {len(messages)} emails')
+        return get_smtp_connection().send_messages(messages)
@@ -0,0 +1,144 @@
+
+
+"""SMTP Connection.
+
+Keeps an authenticated SMTP session open across emails and warm
+invocations of the notifier. The session is health checked before use
+when it has been idle, and re-established when the server dropped it.
+After any other error the session is closed, the next email opens a new
+one. SMTP credentials are read from SSM and cached for a TTL.
+"""
+
+import logging
+import smtplib
+import threading
+import time
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+
+class CachedCredentials:
+    """SMTP user and password read from SSM, cached for a TTL."""
+
+    def __init__(self, ssm_client_factory, user_param: str,
+                 password_param: str, ttl: int) -> None:
+        self.ssm_client_factory = ssm_client_factory
+        self.user_param = user_param
+        self.password_param = password_param
+        self.ttl = ttl
+        self._credentials = None
+        self._fetched_at = None
+
+    def get(self):
+        """
+        :return The (user, password) tuple.
+        """
+        now = time.monotonic()
+        if self._credentials is None or now - self._fetched_at >= self.ttl:
+            log.info('Getting SMTP credentials from SSM')
+            ssm = self.ssm_client_factory()
+            user = ssm.get_parameter(Name=self.user_param,
+                                     WithDecryption=False)
+            password = ssm.get_parameter(Name=self.password_param,
+                                         WithDecryption=True)
+            self._credentials = (user.get("Parameter").get("Value"),
+                                 password.get("Parameter").get("Value"))
+            self._fetched_at = now
+        return self._credentials
+
+    def invalidate(self):
+        self._credentials = None
+
+
+class SmtpConnection:
+    def __init__(self, host: str, port: int, credentials: CachedCredentials,
+                 health_check_after: int) -> None:
+        self.host = host
+        self.port = port
+        self.credentials = credentials
+        self.health_check_after = health_check_after
+        self._server = None
+        self._last_used = None
+        self._lock = threading.Lock()
+        self.stats = {'connects': 0, 'reconnects': 0, 'sent': 0}
+
+    def _connect(self):
+        self.close()
+        log.info(f'Opening SMTP session to {self.host}:{self.port}')
+        server = smtplib.SMTP_SSL(self.host, self.port)
+        try:
+            user, password = self.credentials.get()
+            try:
+                server.login(user, password)
+            except smtplib.SMTPAuthenticationError:
+                # the password may have been rotated, retry with fresh values
+                self.credentials.invalidate()
+                user, password = self.credentials.get()
+                server.login(user, password)
+        except Exception:
+            server.close()
+            raise
+        self._server = server
+        self._last_used = time.monotonic()
+        self.stats['connects'] += 1
+
+    def _is_healthy(self):
+        if self._server is None:
+            return False
+        if self._last_used is not None and \
+                time.monotonic() - self._last_used < self.health_check_after:
+            return True
+        try:
+            return self._server.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+        except OSError:
+            return False
+
+    def _send(self, sender, recipients, message):
+        try:
+            self._server.sendmail(sender, recipients, message)
+        except OSError as error:
+            # SMTPException is an OSError too, only a dropped session is
+            # retried
+            if isinstance(error, smtplib.SMTPException) and \
+                    not isinstance(error, smtplib.SMTPServerDisconnected):
+                raise
+            log.info('SMTP session was closed, reconnecting')
+            self.stats['reconnects'] += 1
+            self._connect()
+            self._server.sendmail(sender, recipients, message)
+        self._last_used = time.monotonic()
+        self.stats['sent'] += 1
+
+    def send_messages(self, messages):
+        """
+        Sends messages over the shared session, reconnecting once if the
+        server dropped it. Any other error closes the session and is
+        raised.
+
+        :param messages: List of (sender, recipients, message string)
+        :return The number of messages sent.
+        """
+        with self._lock:
+            try:
+                if not self._is_healthy():
+                    self._connect()
+                for sender, recipients, message in messages:
+                    self._send(sender, recipients, message)
+            except Exception:
+                # the state of the session is unknown, it is not reused
+                self.close()
+                raise
+            return len(messages)
+
+    def close(self):
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._server = None
+        self._last_used = None
@@ -0,0 +1,137 @@
+
+
+"""Template Cache.
+
+Keeps email templates in memory across warm invocations of the notifier.
+Templates shipped in the deployment package are preloaded at import time
+and served without calling S3. Templates read from S3 are kept in a
+bounded LRU cache and revalidated with their ETag once they are older
+than the TTL. If the revalidation fails, the cached body is served until
+S3 can be reached again.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from botocore.exceptions import BotoCoreError, ClientError
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+
+class CachedTemplate:
+    """A template body with the data needed to revalidate it."""
+
+    __slots__ = ('body', 'etag', 'checked_at', 'compiled')
+
+    def __init__(self, body, etag=None, checked_at=None):
+        self.body = body
+        self.etag = etag
+        self.checked_at = checked_at
+        # rendering data derived from the body, owned by the renderer
+        self.compiled = None
+
+
+class TemplateCache:
+    def __init__(self, max_size: int, ttl: int) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._packaged = {}
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'packaged': 0, 'hits': 0, 'misses': 0,
+                      'revalidated': 0, 'stale': 0}
+
+    def preload(self, directory: str) -> int:
+        """
+        Loads all templates of a directory of the deployment package.
+
+        :return The number of templates loaded.
+        """
+        if not os.path.isdir(directory):
+            return 0
+        loaded = 0
+        for template_name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, template_name)
+            if not os.path.isfile(path):
+                continue
+            with open(path, encoding='utf-8') as template_file:
+                self._packaged[template_name] = CachedTemplate(
+                    template_file.read())
+            loaded += 1
+        log.info(f'Preloaded {loaded} templates from {directory}')
+        return loaded
+
+    def _get_stale(self, cached, key, error):
+        """
+        Serves the cached body of a template that could not be revalidated.
+        It is revalidated again on the next get.
+
+        :return The CachedTemplate, the error is raised if nothing is
+            cached.
+        """
+        if cached is None:
+            raise error
+        log.warning(f'Unable to revalidate template {key}, serving the'
+                    f' cached template. Raw Error: {error}')
+        with self._lock:
+            self.stats['stale'] += 1
+        return cached
+
+    def get(self, s3_client, bucket: str, key: str,
+            template_name: str) -> CachedTemplate:
+        """
+        Gets a template from the package, the cache, or S3.
+
+        :return The CachedTemplate.
+        :raises ClientError, BotoCoreError: If the template is not cached
+            and cannot be read from S3
+        """
+        with self._lock:
+            packaged = self._packaged.get(template_name)
+            if packaged is not None:
+                self.stats['packaged'] += 1
+                return packaged
+
+            now = time.monotonic()
+            cache_key = (bucket, key)
+            cached = self._templates.get(cache_key)
+            if cached is not None:
+                self._templates.move_to_end(cache_key)
+                if now - cached.checked_at < self.ttl:
+                    self.stats['hits'] += 1
+                    return cached
+
+        # fetch or revalidate outside of the lock
+        request = {'Bucket': bucket, 'Key': key}
+        if cached is not None and cached.etag:
+            request['IfNoneMatch'] = cached.etag
+        try:
+            obj = s3_client.get_object(**request)
+        except ClientError as err:
+            status = err.response.get('ResponseMetadata', {}) \
+                .get('HTTPStatusCode')
+            if cached is not None and (
+                    status == 304 or
+                    err.response['Error']['Code'] in ('304', 'NotModified')):
+                log.info(f'Template {key} not modified since last check')
+                with self._lock:
+                    cached.checked_at = now
+                    self.stats['revalidated'] += 1
+                return cached
+            return self._get_stale(cached, key, err)
+        except BotoCoreError as err:
+            return self._get_stale(cached, key, err)
+
+        template = CachedTemplate(obj['Body'].read().decode('utf-8'),
+                                  obj.get('ETag'), now)
+        with self._lock:
+            self.stats['misses'] += 1
+            self._templates[cache_key] = template
+            self._templates.move_to_end(cache_key)
+            while len(self._templates) > self.max_size:
+                self._templates.popitem(last=False)
+        return template
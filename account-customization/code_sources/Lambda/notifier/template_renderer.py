@@ -0,0 +1,63 @@
+
+
+"""Template Renderer.
+
+Compiles an email template once into literal text and {{placeholder}}
+names, so rendering is a single join instead of one string replace per
+template value. Values are HTML-escaped, list values are rendered as a
+bulleted list.
+"""
+
+import html
+import re
+
+from collections import namedtuple
+
+PLACEHOLDER_PATTERN = re.compile(r'\{\{([^{}]+?)\}\}')
+
+# literals has one more entry than names: literal, name, literal, ...
+CompiledTemplate = namedtuple('CompiledTemplate', ['literals', 'names'])
+
+
+def compile_template(template: str) -> CompiledTemplate:
+    """
+    Splits a template into its literal text and placeholder names.
+
+    :return The CompiledTemplate.
+    """
+    parts = PLACEHOLDER_PATTERN.split(template)
+    return CompiledTemplate(tuple(parts[0::2]), tuple(parts[1::2]))
+
+
+def format_value(value) -> str:
+    """
+    Formats a template value as escaped HTML.
+
+    :return The HTML for the value.
+    """
+    if isinstance(value, list):
+        return ''.join([f'&bull; {html.escape(str(line))}<br>'
+                        for line in value])
+    return html.escape(str(value))
+
+
+def render_template(compiled: CompiledTemplate, template_values: dict) -> str:
+    """
+    Renders a compiled template. Placeholders without a value are kept
+    as they are.
+
+    :return The rendered template.
+    """
+    formatted = {}
+    parts = [compiled.literals[0]]
+    for name, literal in zip(compiled.names, compiled.literals[1:]):
+        value = formatted.get(name)
+        if value is None:
+            if name in template_values:
+                value = format_value(template_values[name])
+            else:
+                value = '{{' + name + '}}'
+            formatted[name] = value
+        parts.append(value)
+        parts.append(literal)
+    return ''.join(parts)
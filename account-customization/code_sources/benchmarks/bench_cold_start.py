@@ -0,0 +1,159 @@
+
+
+"""Cold Start Benchmark.
+
+Imports the handler module of a Lambda function in fresh interpreters, as
+the Lambda runtime does on a cold start, and measures the import time, the
+time to create the first clients, the peak memory and the number of loaded
+modules. A separate run with python -X importtime lists the modules with
+the highest import times. Results are written as JSON so the Init Duration
+of the functions can be compared between releases. No AWS access needed.
+
+    python bench_cold_start.py --function access_key_auto_rotation \\
+        --runs 20 --output results.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_DIR = os.path.join(HERE, '..', 'Lambda')
+
+# function -> clients created by its first invocation
+FUNCTIONS = {
+    'access_key_auto_rotation': ('sts', 'iam', 'secretsmanager'),
+    'account_inventory': ('sts', 'organizations', 'lambda'),
+    'notifier': ('ssm', 'ses'),
+}
+
+# Run in the fresh interpreter, prints the measurements as JSON
+CHILD_SCRIPT = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+from client_factory import get_client
+for service_name in sys.argv[1:]:
+    get_client(service_name)
+clients_created = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'first_clients_ms': (clients_created - imported) * 1000,
+    'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'modules': len(sys.modules),
+}))
+'''
+
+
+def get_environment():
+    environment = dict(os.environ)
+    # read by the configs at import time
+    environment.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    environment.setdefault('CredentialReplicationRegions', '')
+    environment.pop('PYTHONPROFILEIMPORTTIME', None)
+    return environment
+
+
+def run_child(function_dir, services, *options):
+    result = subprocess.run(
+        [sys.executable, *options, '-c', CHILD_SCRIPT, *services],
+        cwd=function_dir, env=get_environment(), capture_output=True,
+        text=True, check=True)
+    return json.loads(result.stdout), result.stderr
+
+
+def parse_importtime(output):
+    """
+    Parses the -X importtime output.
+
+    :return List of (module name, depth, self ms, cumulative ms).
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split(
+            '|', 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), depth, int(self_us) / 1000,
+                        int(cumulative_us) / 1000))
+    return modules
+
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        'min': round(values[0], 3),
+        'median': round(statistics.median(values), 3),
+        'p90': round(values[int(0.9 * (len(values) - 1))], 3),
+        'max': round(values[-1], 3),
+    }
+
+
+def run(args):
+    function_dir = os.path.join(LAMBDA_DIR, args.function)
+    services = FUNCTIONS[args.function]
+
+    runs = [run_child(function_dir, services)[0] for _ in range(args.runs)]
+    for n, measurement in enumerate(runs):
+        print(f'run {n}: import {measurement["import_ms"]:.1f} ms, first'
+              f' clients {measurement["first_clients_ms"]:.1f} ms',
+              file=sys.stderr)
+
+    _, importtime_output = run_child(function_dir, services, '-X',
+                                     'importtime')
+    modules = parse_importtime(importtime_output)
+
+    return {
+        'benchmark': 'cold_start',
+        'timestamp': datetime.datetime.now(
+            datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'parameters': {
+            'function': args.function,
+            'runs': args.runs,
+            'clients': services,
+        },
+        'results': {
+            'import_ms': summarize([run['import_ms'] for run in runs]),
+            'first_clients_ms': summarize(
+                [run['first_clients_ms'] for run in runs]),
+            'max_rss_kb': summarize([run['max_rss_kb'] for run in runs]),
+            'modules': runs[0]['modules'],
+        },
+        'top_level_imports': [
+            {'module': name, 'cumulative_ms': cumulative}
+            for name, depth, _, cumulative in sorted(
+                modules, key=lambda module: module[3], reverse=True)
+            if depth == 0][:args.top],
+        'top_self_imports': [
+            {'module': name, 'self_ms': self_ms}
+            for name, _, self_ms, _ in sorted(
+                modules, key=lambda module: module[2], reverse=True)
+        ][:args.top],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--function', choices=sorted(FUNCTIONS),
+                        default='access_key_auto_rotation')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--top', type=int, default=15,
+                        help='number of modules listed by import time')
+    parser.add_argument('--output', help='JSON file, default stdout')
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,129 @@
+
+
+"""Key Population Benchmark.
+
+Classifies synthetic key populations with evaluate_keys, one user at a
+time, and with the vectorized classify_keys of key_population, checks
+that both return the same action, reason and date for every key, and
+compares their keys per second. Requires NumPy, see requirements.txt, no
+AWS access needed.
+
+    python bench_key_population.py --users 500000 --force-rate 0.01
+"""
+
+import argparse
+import collections
+import datetime
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', 'Lambda',
+                                'access_key_auto_rotation'))
+sys.path.insert(0, os.path.join(HERE, '..', 'tools'))
+
+# read by the rotation function's config, which key_population imports
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('CredentialReplicationRegions', '')
+
+import numpy as np  # noqa: E402
+
+from bench_decision_engine import THRESHOLDS, generate_users  # noqa: E402
+from decision_engine import evaluate_keys  # noqa: E402
+from key_population import KeyPopulation, classify_keys  # noqa: E402
+
+
+def get_scalar_actions(users, now, thresholds, force_rotate):
+    """
+    :return List of per user Counters of (slot, action, reason, date).
+    """
+    user_actions = []
+    for keys, force in zip(users, force_rotate):
+        slots = {key['AccessKeyId']: slot for slot, key in enumerate(keys)}
+        user_actions.append(collections.Counter(
+            (slots[action.key.access_key_id], action.action, action.reason,
+             action.action_date)
+            for action in evaluate_keys(keys, now, thresholds, force)))
+    return user_actions
+
+
+def get_vectorized_actions(population_actions, num_users):
+    user_actions = [collections.Counter() for _ in range(num_users)]
+    for user, slot, action, reason, date in \
+            population_actions.iter_actions():
+        user_actions[user][(slot, action, reason, date)] += 1
+    return user_actions
+
+
+def run(num_users, force_rate, repeat, seed):
+    now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    users = generate_users(num_users, now, seed)
+    rng = random.Random(seed)
+    force_rotate = [rng.random() < force_rate for _ in users]
+    num_keys = sum(len(keys) for keys in users)
+
+    start = time.perf_counter()
+    population = KeyPopulation.from_key_metadata(
+        (keys[0]['UserName'], keys) for keys in users)
+    load_seconds = time.perf_counter() - start
+    force_array = np.array(force_rotate, dtype=bool)
+
+    scalar_best = vectorized_best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        scalar_actions = get_scalar_actions(users, now, THRESHOLDS,
+                                            force_rotate)
+        elapsed = time.perf_counter() - start
+        scalar_best = elapsed if scalar_best is None else \
+            min(scalar_best, elapsed)
+
+        start = time.perf_counter()
+        population_actions = classify_keys(population, now, THRESHOLDS,
+                                           force_array)
+        elapsed = time.perf_counter() - start
+        vectorized_best = elapsed if vectorized_best is None else \
+            min(vectorized_best, elapsed)
+
+    vectorized_actions = get_vectorized_actions(population_actions,
+                                                num_users)
+    mismatches = [i for i in range(num_users)
+                  if scalar_actions[i] != vectorized_actions[i]]
+    scalar_counts = collections.Counter(
+        reason for actions in scalar_actions
+        for (_, _, reason, _), count in actions.items()
+        for _ in range(count))
+
+    print(f'users:              {num_users}')
+    print(f'keys:               {num_keys}')
+    print(f'load:               {load_seconds:.3f} s')
+    print(f'scalar best of {repeat}:   {scalar_best:.3f} s,'
+          f' {num_keys / scalar_best:,.0f} keys per sec')
+    print(f'vectorized best of {repeat}: {vectorized_best:.3f} s,'
+          f' {num_keys / vectorized_best:,.0f} keys per sec')
+    print(f'speedup:            {scalar_best / vectorized_best:.1f}x')
+    print(f'mismatched users:   {len(mismatches)}')
+    print(f'reason counts match: '
+          f'{scalar_counts == population_actions.reason_counts()}')
+    for reason, count in sorted(population_actions.reason_counts().items(),
+                                key=lambda item: item[0].name):
+        print(f'  {reason.name:<35} {count}')
+    if mismatches:
+        i = mismatches[0]
+        print(f'first mismatch, user {i}: {users[i]}\n'
+              f'  scalar:     {dict(scalar_actions[i])}\n'
+              f'  vectorized: {dict(vectorized_actions[i])}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--force-rate', type=float, default=0.0,
+                        help='fraction of users whose keys are force rotated')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(args.users, args.force_rate, args.repeat, args.seed)
@@ -0,0 +1,89 @@
+
+
+"""Notifier Rendering Benchmark.
+
+Compares rendering the enforcement email template with one str.replace
+per template value and += list formatting against the compiled renderer
+of the notifier function. No AWS access needed.
+
+    python bench_notifier_render.py --actions 10000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'Lambda', 'notifier'))
+
+from template_renderer import compile_template, render_template  # noqa: E402
+
+TEMPLATE_PATH = os.path.join(HERE, '..', 'template',
+                             'iam-auto-key-rotation-enforcement.html')
+
+
+def build_template_values(num_actions):
+    return {
+        'account_id': '111122223333',
+        'account_name': 'benchmark',
+        'timestamp': '2021-11-04T22:48:39.640450+00:00',
+        'actions': [f'ACTION: ROTATE key user-{i}:AKIA{i:016d}.  '
+                    f'Active key has expired.' for i in range(num_actions)],
+        'rotation_period': 90,
+        'installation_grace_period': 7,
+        'recovery_grace_period': 10,
+        'partition_name': 'AWS Standard',
+        'sender_email': 'admin@example.com'
+    }
+
+
+def render_replace(template, template_values):
+    """The rendering used before the compiled renderer."""
+    email = template
+    for k, v in template_values.items():
+        placeholder = '{{' + f'{k}' + '}}'
+        if isinstance(v, list):
+            value = ''
+            for line in v:
+                value += f'&bull; {str(line)}<br>'
+        else:
+            value = str(v)
+        email = email.replace(placeholder, value)
+    return email
+
+
+def best_of(repeat, function, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(num_actions, repeat):
+    with open(TEMPLATE_PATH, encoding='utf-8') as template_file:
+        template = template_file.read()
+    template_values = build_template_values(num_actions)
+
+    compiled = compile_template(template)
+    replace_time = best_of(repeat, render_replace, template, template_values)
+    compile_time = best_of(repeat, compile_template, template)
+    render_time = best_of(repeat, render_template, compiled, template_values)
+
+    print(f'actions:             {num_actions}')
+    print(f'email size:          '
+          f'{len(render_template(compiled, template_values))} characters')
+    print(f'replace rendering:   {replace_time * 1000:.2f} ms')
+    print(f'compile (once):      {compile_time * 1000:.2f} ms')
+    print(f'compiled rendering:  {render_time * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--actions', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.actions, args.repeat)
@@ -0,0 +1,381 @@
+
+
+"""Rotation Pipeline Benchmark.
+
+Generates synthetic accounts in moto with a configurable number of users,
+distribution of key states and density of tags, then runs the rotation
+pipeline on them. Wall time, peak traced memory and API calls per
+operation are measured for get_actions_for_account, execute_actions,
+format_notifier_payload and the rendering of the notifier email, and
+written as JSON so results can be compared between releases.
+
+Requires moto. Key creation and last used dates are set on the IAM
+responses through botocore after-call events, since moto creates every
+key with the current date.
+
+    python bench_rotation_pipeline.py --accounts 2 --users 500 \\
+        --key-states fresh=0.6,warn=0.1,expired=0.2,unused=0.05,inactive=0.05 \\
+        --tag-density 0.5 --output results.json
+
+Wall times include the tracemalloc overhead unless --no-trace-memory is
+given, only compare results taken with the same flags.
+"""
+
+import argparse
+import collections
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROTATION_DIR = os.path.join(HERE, '..', 'Lambda', 'access_key_auto_rotation')
+NOTIFIER_DIR = os.path.join(HERE, '..', 'Lambda', 'notifier')
+TEMPLATE_DIR = os.path.join(HERE, '..', 'template')
+EMAIL_TEMPLATE = 'iam-auto-key-rotation-enforcement.html'
+
+OWNER_TAG = 'owner'
+ROLE_NAME = 'benchmark-role'
+
+# key state -> function(rng) returning [(status, age days, used)] per key
+KEY_STATES = {
+    # one active key, used, well within the rotation period
+    'fresh': lambda rng: [('Active', rng.randint(0, 80), True)],
+    # one active key about to expire
+    'warn': lambda rng: [('Active', rng.randint(84, 89), True)],
+    # one active key past the rotation period
+    'expired': lambda rng: [('Active', rng.randint(91, 200), True)],
+    # one expired key that has never been used
+    'unused': lambda rng: [('Active', rng.randint(91, 200), False)],
+    # an old inactive key waiting for deletion
+    'inactive': lambda rng: [('Inactive', rng.randint(105, 200), True)],
+    # rotated: expired old key and a new key in the installation grace
+    'rotated': lambda rng: [('Active', rng.randint(91, 100), True),
+                            ('Active', rng.randint(0, 6), True)],
+}
+
+
+def parse_key_states(value):
+    """
+    Parses state=weight pairs, e.g. "fresh=0.8,expired=0.2".
+
+    :return Dict of key state -> weight.
+    """
+    weights = {}
+    for pair in value.split(','):
+        state, weight = pair.split('=')
+        if state not in KEY_STATES:
+            raise argparse.ArgumentTypeError(
+                f'Unknown key state {state}, expected one of'
+                f' {sorted(KEY_STATES)}')
+        weights[state] = float(weight)
+    return weights
+
+
+def setup_environment(args):
+    """Sets the function configuration before its modules are imported."""
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    os.environ['CredentialReplicationRegions'] = ''
+    os.environ['ResourceOwnerTag'] = OWNER_TAG
+    os.environ['IAMExemptionGroup'] = 'benchmark-exempt'
+    os.environ['IAMAssumedRoleName'] = ROLE_NAME
+    os.environ['RoleSessionName'] = 'benchmark'
+    os.environ['ScanMode'] = 'api'
+    os.environ['UserScanWorkers'] = str(args.workers)
+    os.environ['ActionWorkers'] = str(args.workers)
+    os.environ['KeyStateStore'] = 'none'
+    os.environ['RateLimits'] = args.rate_limits
+    os.environ['TemplatePackageDir'] = TEMPLATE_DIR
+
+
+def generate_account(iam_client, num_users, key_states, tag_density,
+                     tags_per_user, now, rng):
+    """
+    Creates the users and keys of one account.
+
+    :return Dict of access key id -> (create date, last used date or None).
+    """
+    key_dates = {}
+    states = list(key_states)
+    weights = [key_states[state] for state in states]
+    iam_client.create_group(GroupName='benchmark-exempt')
+    for i in range(num_users):
+        user_name = f'user-{i}'
+        tags = [{'Key': f'tag-{t}', 'Value': f'value-{t}'}
+                for t in range(tags_per_user)]
+        if rng.random() < tag_density:
+            tags.append({'Key': OWNER_TAG,
+                         'Value': f'owner-{i % 50}@example.com'})
+        iam_client.create_user(UserName=user_name, Tags=tags)
+
+        state = rng.choices(states, weights)[0]
+        for status, age_days, used in KEY_STATES[state](rng):
+            key = iam_client.create_access_key(UserName=user_name)['AccessKey']
+            if status != 'Active':
+                iam_client.update_access_key(
+                    UserName=user_name, AccessKeyId=key['AccessKeyId'],
+                    Status=status)
+            create_date = now - datetime.timedelta(
+                days=age_days, hours=rng.randint(0, 23))
+            last_used_date = create_date + (now - create_date) / 2 \
+                if used else None
+            key_dates[key['AccessKeyId']] = (create_date, last_used_date)
+    return key_dates
+
+
+def register_key_dates(session, key_dates):
+    """Sets the synthetic key dates on the IAM responses of a session."""
+
+    def on_list_access_keys(parsed, **kwargs):
+        for key in parsed.get('AccessKeyMetadata', []):
+            if key['AccessKeyId'] in key_dates:
+                key['CreateDate'] = key_dates[key['AccessKeyId']][0]
+
+    def before_get_access_key_last_used(params, context, **kwargs):
+        # the request context is passed on to the after-call event
+        context['benchmark_access_key_id'] = params['body'].get('AccessKeyId')
+
+    def on_get_access_key_last_used(parsed, context, **kwargs):
+        dates = key_dates.get(context.get('benchmark_access_key_id'))
+        if dates is None:
+            return
+        last_used = parsed.setdefault('AccessKeyLastUsed', {})
+        if dates[1] is None:
+            last_used.pop('LastUsedDate', None)
+        else:
+            last_used['LastUsedDate'] = dates[1]
+
+    session.events.register('after-call.iam.ListAccessKeys',
+                            on_list_access_keys)
+    session.events.register('before-call.iam.GetAccessKeyLastUsed',
+                            before_get_access_key_last_used)
+    session.events.register('after-call.iam.GetAccessKeyLastUsed',
+                            on_get_access_key_last_used)
+
+
+class ApiCallCounter:
+    """Counts API calls by operation name."""
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        # the pipeline calls from several worker threads
+        self._lock = threading.Lock()
+
+    def __call__(self, event_name, **kwargs):
+        with self._lock:
+            self.counts[event_name.split('.', 1)[1]] += 1
+
+    def register(self, session):
+        session.events.register('before-call', self)
+
+    def take(self):
+        with self._lock:
+            counts = dict(sorted(self.counts.items()))
+            self.counts.clear()
+        return counts
+
+
+def measure(name, function, counter, trace_memory):
+    """
+    Runs function once.
+
+    :return (result, measurement dict)
+    """
+    counter.take()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    wall_seconds = time.perf_counter() - start
+    peak_memory = None
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    api_calls = counter.take()
+    measurement = {
+        'operation': name,
+        'wall_seconds': round(wall_seconds, 6),
+        'peak_memory_bytes': peak_memory,
+        'api_calls_total': sum(api_calls.values()),
+        'api_calls': api_calls,
+    }
+    print(f'{name}: {wall_seconds:.3f} s, {sum(api_calls.values())} calls',
+          file=sys.stderr)
+    return result, measurement
+
+
+class BenchmarkContext:
+    """The parts of the Lambda context used by the pipeline."""
+
+    invoked_function_arn = \
+        'arn:aws:lambda:us-east-1:123456789012:function:benchmark'
+    aws_request_id = 'benchmark'
+
+
+def run_rotation(args, counter):
+    sys.path.insert(0, ROTATION_DIR)
+    from account_scan import get_actions_for_account
+    from account_snapshot import load_account_snapshot
+    from client_factory import get_client, get_default_session
+    from key_actions import execute_actions
+    from notification_handler import format_notifier_payload
+    from sts_connection_handler import get_account_session
+
+    counter.register(get_default_session())
+    rng = random.Random(args.seed)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    measurements = []
+    payloads = []
+
+    for n in range(args.accounts):
+        account_id = f'{100000000000 + n:012d}'
+        account_session = get_account_session(account_id, ROLE_NAME)
+        counter.register(account_session)
+        key_dates = generate_account(
+            account_session.client('iam'), args.users, args.key_states,
+            args.tag_density, args.tags_per_user, now, rng)
+        register_key_dates(account_session, key_dates)
+        # generating the account is not measured
+        counter.take()
+
+        def scan_account():
+            # as evaluate_account does, the snapshot load is part of the scan
+            account_snapshot = load_account_snapshot(
+                get_client('iam', account_session)) \
+                if args.account_snapshot else None
+            return account_snapshot, get_actions_for_account(
+                account_session, [], account_snapshot)
+
+        (account_snapshot, action_queue), measurement = measure(
+            'get_actions_for_account', scan_account, counter,
+            args.trace_memory)
+        measurement.update(account=account_id, users=args.users,
+                           keys=len(key_dates), actions=len(action_queue))
+        measurements.append(measurement)
+
+        payload, measurement = measure(
+            'format_notifier_payload',
+            lambda: format_notifier_payload(
+                BenchmarkContext(), account_id, 'benchmark',
+                'admin@example.com', action_queue, False, EMAIL_TEMPLATE),
+            counter, args.trace_memory)
+        measurement.update(account=account_id, actions=len(action_queue),
+                           payload_bytes=len(payload))
+        measurements.append(measurement)
+        payloads.append(payload)
+
+        if not args.dryrun:
+            results, measurement = measure(
+                'execute_actions',
+                lambda: execute_actions(action_queue, account_session, None,
+                                        account_snapshot),
+                counter, args.trace_memory)
+            statuses = collections.Counter(result.status
+                                           for result in results)
+            measurement.update(account=account_id,
+                               actions=len(action_queue), **statuses)
+            measurements.append(measurement)
+
+    return measurements, payloads
+
+
+def run_notifier(args, counter, payloads):
+    # The notifier has its own config and client_factory modules, the ones
+    # of the rotation function are unloaded first
+    for module in ('config', 'client_factory'):
+        sys.modules.pop(module, None)
+    sys.path.insert(0, NOTIFIER_DIR)
+    from client_factory import get_default_session
+    from notifier import Notifier
+
+    counter.register(get_default_session())
+    measurements = []
+    for payload in payloads:
+        event = json.loads(payload)
+        template_values = dict(event['template_values'],
+                               sender_email='admin@example.com')
+        notifier = Notifier('admin@example.com', event['email'],
+                            'benchmark-bucket', 'benchmark',
+                            event['email_template'], event['subject'])
+        message, measurement = measure(
+            'notifier_render',
+            lambda: notifier.build_smtp_message(template_values),
+            counter, args.trace_memory)
+        measurement.update(actions=len(template_values['actions']),
+                           message_bytes=len(message))
+        measurements.append(measurement)
+    return measurements
+
+
+def run(args):
+    setup_environment(args)
+    from moto import mock_aws
+
+    counter = ApiCallCounter()
+    with mock_aws():
+        measurements, payloads = run_rotation(args, counter)
+        measurements += run_notifier(args, counter, payloads)
+
+    return {
+        'benchmark': 'rotation_pipeline',
+        'timestamp': datetime.datetime.now(
+            datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'parameters': {
+            'accounts': args.accounts,
+            'users': args.users,
+            'key_states': args.key_states,
+            'tag_density': args.tag_density,
+            'tags_per_user': args.tags_per_user,
+            'workers': args.workers,
+            'rate_limits': args.rate_limits,
+            'account_snapshot': args.account_snapshot,
+            'dryrun': args.dryrun,
+            'trace_memory': args.trace_memory,
+            'seed': args.seed,
+        },
+        'results': measurements,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--accounts', type=int, default=1)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument(
+        '--key-states', type=parse_key_states,
+        default=parse_key_states(
+            'fresh=0.6,warn=0.1,expired=0.15,unused=0.05,inactive=0.05,'
+            'rotated=0.05'),
+        help=f'state=weight pairs of {", ".join(KEY_STATES)}')
+    parser.add_argument('--tag-density', type=float, default=0.5,
+                        help='fraction of users with an owner tag')
+    parser.add_argument('--tags-per-user', type=int, default=2,
+                        help='number of other tags per user')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rate-limits', default='{}',
+                        help='RateLimits of the functions, {} disables the'
+                             ' rate limiter')
+    parser.add_argument('--account-snapshot', action='store_true')
+    parser.add_argument('--dryrun', action='store_true',
+                        help='skip execute_actions')
+    parser.add_argument('--no-trace-memory', dest='trace_memory',
+                        action='store_false')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON file, default stdout')
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,15 @@
+
+
+import pytest
+
+from lambda_functions import use_function
+
+use_function('access_key_auto_rotation')
+
+
+@pytest.fixture
+def aws():
+    """Mocks AWS with moto for the duration of a test."""
+    from moto import mock_aws
+    with mock_aws():
+        yield
@@ -0,0 +1,65 @@
+import pytest
+
+import aws_partitions
+import client_factory
+
+from aws_partitions import PartitionIndex, get_iam_region, \
+    get_partition_for_region, get_partition_name
+
+PARTITIONS = [
+    {'partition': 'aws', 'partitionName': 'AWS Standard',
+     'regionRegex': r'^(us|eu)\-.+\-\d+$',
+     'regions': {'us-east-1': {}, 'eu-west-1': {}}},
+    {'partition': 'aws-us-gov', 'partitionName': 'AWS GovCloud (US)',
+     'regionRegex': r'^us\-gov\-\w+\-\d+$',
+     'regions': {'us-gov-west-1': {}}},
+]
+
+
+@pytest.fixture(autouse=True)
+def default_session(monkeypatch):
+    # the session created outside moto is not kept for the later tests
+    monkeypatch.setattr(client_factory, '_default_session', None)
+    monkeypatch.setattr(aws_partitions, '_partition_index', None)
+
+
+@pytest.mark.parametrize('region_name, partition_id', [
+    ('us-east-1', 'aws'),
+    ('cn-north-1', 'aws-cn'),
+    ('us-gov-west-1', 'aws-us-gov'),
+])
+def test_listed_regions_are_looked_up(region_name, partition_id):
+    assert get_partition_for_region(region_name) == partition_id
+
+
+@pytest.mark.parametrize('region_name, partition_id', [
+    ('us-east-9', 'aws'),
+    ('cn-northwest-9', 'aws-cn'),
+])
+def test_unlisted_regions_are_matched_by_regex(region_name, partition_id):
+    assert get_partition_for_region(region_name) == partition_id
+
+
+@pytest.mark.parametrize('region_name', ['mars-1', 'local', None])
+def test_unknown_regions_are_rejected(region_name):
+    with pytest.raises(ValueError, match='Invalid region name'):
+        get_partition_for_region(region_name)
+
+
+def test_partition_details_are_looked_up():
+    assert get_partition_name('aws') == 'AWS Standard'
+    assert get_iam_region('aws') == 'us-east-1'
+    assert get_iam_region('aws-cn') == 'cn-north-1'
+    with pytest.raises(ValueError, match='Invalid partition'):
+        get_partition_name('aws-mars')
+
+
+def test_listed_regions_take_precedence_over_regexes():
+    index = PartitionIndex(PARTITIONS)
+
+    # us-gov-west-1 also matches the regex of the first partition
+    assert index.get_partition_for_region('us-gov-west-1') == 'aws-us-gov'
+    assert index.get_partition_for_region('us-gov-east-9') == 'aws'
+    assert index.get_partition_for_region('mars-1') is None
+    assert index._matched_regions == {'us-gov-east-9': 'aws',
+                                      'mars-1': None}
@@ -0,0 +1,27 @@
+
+
+import time
+
+import boto3
+
+import client_factory
+import rate_limiter
+from call_metrics import call_metrics
+
+RATE_LIMITER_WAIT = 0.5
+
+
+def test_latency_excludes_the_rate_limiter_wait(aws, monkeypatch):
+    monkeypatch.setattr(rate_limiter, 'RATE_LIMITS', {'sts': 1})
+    monkeypatch.setattr(rate_limiter.AdaptiveTokenBucket, 'acquire',
+                        lambda bucket: time.sleep(RATE_LIMITER_WAIT))
+    client = client_factory.get_client('sts', boto3.Session())
+    # the first call also loads the moto backend
+    client.get_caller_identity()
+    call_metrics.take()
+
+    client.get_caller_identity()
+
+    operation = call_metrics.take()[('sts', 'GetCallerIdentity')]
+    assert operation.calls == 1
+    assert operation.latency_max < RATE_LIMITER_WAIT * 1000
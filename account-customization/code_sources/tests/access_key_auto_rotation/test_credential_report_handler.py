@@ -0,0 +1,106 @@
+import datetime
+
+import boto3
+import pytest
+
+from account_scan import get_actions_for_user
+from credential_report_handler import parse_credential_report, \
+    report_matches_keys, resolve_access_key_ids
+from decision_engine import Action, ActionReasons, ActionType, KeyRecord
+
+REPORT = '''user,access_key_1_active,access_key_1_last_rotated,\
+access_key_1_last_used_date,access_key_2_active,access_key_2_last_rotated,\
+access_key_2_last_used_date
+<root_account>,false,N/A,N/A,false,N/A,N/A
+alice,true,2020-01-01T00:00:00+00:00,2024-06-01T10:00:00+00:00,\
+false,2023-01-01T00:00:00+00:00,N/A
+bob,false,N/A,N/A,false,N/A,N/A
+'''
+
+
+def report_key(user_name, create_date, status='Active', slot='access_key_1'):
+    return {'UserName': user_name, 'AccessKeyId': slot, 'KeySlot': slot,
+            'Status': status, 'CreateDate': create_date,
+            'LastUsedDate': None}
+
+
+@pytest.fixture
+def iam(aws):
+    iam = boto3.client('iam')
+    iam.create_user(UserName='user')
+    return iam
+
+
+def test_report_rows_become_key_records():
+    users = list(parse_credential_report(REPORT.encode('utf-8')))
+
+    assert [user_name for user_name, _ in users] == ['alice', 'bob']
+    alice_keys = users[0][1]
+    assert [(key['AccessKeyId'], key['Status']) for key in alice_keys] == \
+        [('access_key_1', 'Active'), ('access_key_2', 'Inactive')]
+    assert alice_keys[0]['CreateDate'] == \
+        datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    assert alice_keys[0]['LastUsedDate'] == \
+        datetime.datetime(2024, 6, 1, 10, tzinfo=datetime.timezone.utc)
+    assert alice_keys[1]['LastUsedDate'] is None
+    assert users[1][1] == []
+
+
+def test_report_keys_are_compared_with_status():
+    create_date = datetime.datetime(2020, 1, 1, 0, 0, 0, 500,
+                                    tzinfo=datetime.timezone.utc)
+    live_key = {'UserName': 'user', 'AccessKeyId': 'AKIA1',
+                'Status': 'Active', 'CreateDate': create_date}
+
+    assert report_matches_keys(
+        [report_key('user', create_date.replace(microsecond=0))],
+        [live_key])
+    assert not report_matches_keys(
+        [report_key('user', create_date, 'Inactive')], [live_key])
+    assert not report_matches_keys([report_key('user', create_date)], [])
+
+
+def test_key_ids_are_resolved_by_creation_date(iam):
+    key = iam.create_access_key(UserName='user')['AccessKey']
+    actions = [
+        Action(ActionType.DEACTIVATE,
+               KeyRecord('user', slot, create_date, slot),
+               ActionReasons.EXPIRED_ACTIVE_KEY, None, None)
+        for slot, create_date in [
+            ('access_key_1', key['CreateDate']),
+            ('access_key_2', datetime.datetime(
+                2020, 1, 1, tzinfo=datetime.timezone.utc))]]
+
+    resolved = resolve_access_key_ids(iam, 'user', actions)
+
+    # the key of the second slot no longer exists
+    assert [(action.key.access_key_id, action.key.key_slot)
+            for action in resolved] == [(key['AccessKeyId'], None)]
+
+
+def test_changed_keys_are_evaluated_again(iam):
+    # the report still lists the expired key the user replaced since
+    iam.create_access_key(UserName='user')
+    expired_key = report_key('user', datetime.datetime(
+        2020, 1, 1, tzinfo=datetime.timezone.utc))
+    user_key_states = []
+
+    actions = get_actions_for_user('user', [expired_key], None, iam, [], [],
+                                   user_key_states=user_key_states)
+
+    assert actions == []
+    assert [key['AccessKeyId'] for key in user_key_states[0].keys] == \
+        [key['AccessKeyId'] for key in iam.list_access_keys(
+            UserName='user')['AccessKeyMetadata']]
+
+
+def test_unchanged_keys_are_resolved(iam):
+    key = iam.create_access_key(UserName='user')['AccessKey']
+
+    actions = get_actions_for_user(
+        'user', [report_key('user', key['CreateDate'])], None, iam,
+        ['user'], [])
+
+    assert [(action.action, action.key.access_key_id)
+            for action in actions] == \
+        [(ActionType.ROTATE, key['AccessKeyId'])]
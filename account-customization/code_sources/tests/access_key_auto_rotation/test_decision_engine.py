@@ -0,0 +1,95 @@
+
+
+"""Decision engine parity with the rules it replaced.
+
+data/legacy_decisions.json holds key sets and the actions the rules in
+account_scan returned for them before the decision engine was extracted,
+at least one case for every combination of key count, active keys, force
+rotation and resulting actions. Dates are hours relative to the
+evaluation time. The legacy rules gave the ROTATE action of an [Active,
+Inactive] conflict the reason of the DELETE action that frees its slot,
+the recorded ROTATE actions carry the rotate reason since.
+"""
+
+import datetime
+import json
+import os
+
+import pytest
+
+from decision_engine import Action, ActionReasons, ActionType, KeyRecord, \
+    Thresholds, deserialize_action, evaluate_keys, serialize_action
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+with open(os.path.join(DATA_DIR, 'legacy_decisions.json'),
+          encoding='utf-8') as data_file:
+    LEGACY_DECISIONS = json.load(data_file)
+
+# the defaults of the function's config
+THRESHOLDS = Thresholds(
+    rotation_period=datetime.timedelta(days=90),
+    warn_period=datetime.timedelta(days=7),
+    installation_grace_period=datetime.timedelta(days=7),
+    recovery_grace_period=datetime.timedelta(days=7))
+
+NOW = datetime.datetime(2024, 6, 1, 12, tzinfo=datetime.timezone.utc)
+
+HOUR = datetime.timedelta(hours=1)
+
+def get_key_metadata(keys):
+    return [{
+        'UserName': 'user',
+        'AccessKeyId': f'KEY{slot}',
+        'Status': status,
+        'CreateDate': NOW + create_hours * HOUR,
+        'LastUsedDate': None if last_used_hours is None
+        else NOW + last_used_hours * HOUR,
+    } for slot, (status, create_hours, last_used_hours) in enumerate(keys)]
+
+
+def get_expected_actions(case):
+    expected = []
+    for action, slot, reason, date_hours in case['actions']:
+        expected.append((action, f'KEY{slot}', reason,
+                         None if date_hours is None
+                         else NOW + date_hours * HOUR))
+    return expected
+
+
+@pytest.mark.parametrize('case', LEGACY_DECISIONS)
+def test_evaluate_keys_matches_legacy_rules(case):
+    actions = evaluate_keys(get_key_metadata(case['keys']), NOW, THRESHOLDS,
+                            case['force_rotate'])
+
+    assert [(action.action.value, action.key.access_key_id,
+             action.reason.name, action.action_date)
+            for action in actions] == get_expected_actions(case)
+
+
+def test_legacy_decisions_cover_every_action():
+    expected = [action for case in LEGACY_DECISIONS
+                for action in get_expected_actions(case)]
+
+    assert {action for action, _, _, _ in expected} == \
+        {action_type.value for action_type in ActionType}
+    assert {reason for _, _, reason, _ in expected} == \
+        {reason.name for reason in ActionReasons}
+
+
+def test_evaluate_keys_does_not_modify_key_records():
+    keys = get_key_metadata([['Active', -91 * 24, -24]])
+    before = [dict(key) for key in keys]
+
+    evaluate_keys(keys, NOW, THRESHOLDS)
+
+    assert keys == before
+
+
+def test_serialized_action_round_trip():
+    action = Action(ActionType.WARN, KeyRecord('user', 'KEY0', None),
+                    ActionReasons.KEY_PENDING_ROTATION, NOW + HOUR,
+                    'owner@example.com')
+
+    assert deserialize_action(
+        json.loads(json.dumps(serialize_action(action)))) == action
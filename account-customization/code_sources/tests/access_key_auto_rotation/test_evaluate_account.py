@@ -0,0 +1,99 @@
+
+
+import datetime
+import json
+
+import pytest
+
+import main
+from decision_engine import Action, ActionReasons, ActionType, KeyRecord
+import key_actions
+from key_actions import ActionResult
+
+EVENT = {'account': '123456789012', 'name': 'account',
+         'email': 'admin@example.com'}
+
+ACTIONS = [
+    Action(ActionType.ROTATE, KeyRecord('first', 'KEY1', None),
+           ActionReasons.EXPIRED_ACTIVE_KEY, None, 'owner@example.com'),
+    Action(ActionType.DELETE, KeyRecord('second', 'KEY2', None),
+           ActionReasons.EXPIRED_ACTIVE_KEY,
+           datetime.datetime(2024, 6, 1, tzinfo=datetime.timezone.utc),
+           'owner@example.com'),
+    Action(ActionType.DEACTIVATE, KeyRecord('second', 'KEY3', None),
+           ActionReasons.EXPIRED_ACTIVE_KEY, None, 'owner@example.com'),
+]
+
+
+class Context:
+    aws_request_id = 'request'
+    invoked_function_arn = \
+        'arn:aws:lambda:us-east-1:123456789012:function:rotation'
+
+
+@pytest.fixture
+def notifications(monkeypatch):
+    """Evaluates ACTIONS, the DELETE action fails."""
+    sent = []
+    monkeypatch.setattr(main, 'get_key_state_store', lambda: None)
+    monkeypatch.setattr(main, 'get_account_session', lambda *args: None)
+    monkeypatch.setattr(main, 'get_central_account_session', lambda: None)
+    monkeypatch.setattr(main.Config, 'accountSnapshot', False)
+    monkeypatch.setattr(main, 'get_actions_for_account',
+                        lambda *args: list(ACTIONS))
+    monkeypatch.setattr(main, 'execute_actions', lambda *args: [
+        ActionResult(ACTIONS[0], 'SUCCEEDED', None, 0),
+        ActionResult(ACTIONS[1], 'FAILED', RuntimeError('denied'), 0),
+        ActionResult(ACTIONS[2], 'SKIPPED', None, 0)])
+    monkeypatch.setattr(
+        main, 'send_to_notifier',
+        lambda context, account_id, account_name, recipient, actions, *args:
+        sent.append((recipient, actions)))
+    return sent
+
+
+def test_only_succeeded_actions_are_notified(notifications):
+    main.evaluate_account(EVENT, Context())
+
+    assert notifications == [('admin@example.com', ACTIONS[:1]),
+                             ('owner@example.com', ACTIONS[:1])]
+
+
+def test_failed_actions_are_reported_without_failing(notifications,
+                                                      capsys):
+    summary = main.lambda_handler(EVENT, Context())
+
+    assert (summary['succeeded'], summary['failed'], summary['skipped']) == \
+        (1, 1, 1)
+    assert [(action['action'], action['status'], action['error'])
+            for action in summary['not_succeeded']] == \
+        [('DELETE', 'FAILED', 'denied'), ('DEACTIVATE', 'SKIPPED', None)]
+    metrics = [json.loads(line) for line in capsys.readouterr().out.splitlines()
+               if '"ActionsFailed"' in line]
+    assert metrics[0]['ActionsFailed'] == 1
+
+
+def test_failed_account_does_not_stop_the_batch(notifications):
+    summary = main.lambda_handler({'accounts': [EVENT, EVENT]}, Context())
+
+    assert len(notifications) == 4
+    assert len(summary['accounts']) == 2
+
+
+def test_warnings_after_a_failed_action_are_kept(monkeypatch):
+    warning = Action(ActionType.WARN, KeyRecord('second', 'KEY3', None),
+                     ActionReasons.KEY_PENDING_ROTATION, None,
+                     'owner@example.com')
+
+    def execute_action(action_spec, *args):
+        if action_spec.action == ActionType.DELETE:
+            raise RuntimeError('denied')
+        return 0
+
+    monkeypatch.setattr(key_actions, 'execute_action', execute_action)
+
+    results = key_actions.execute_chain([ACTIONS[1], warning, ACTIONS[2]],
+                                        None, None)
+
+    assert [result.status for result in results] == \
+        ['FAILED', 'SUCCEEDED', 'SKIPPED']
@@ -0,0 +1,69 @@
+import logging
+
+import boto3
+import pytest
+
+from botocore.exceptions import ClientError
+
+from exemption_handler import get_exemption_group, \
+    parse_exemption_groups, validate_exemption_group
+
+log = logging.getLogger()
+
+
+class FakePaginator:
+    """Returns the get_group pages of a group, or raises on a page."""
+
+    def __init__(self, pages):
+        self.pages = pages
+
+    def paginate(self, GroupName):
+        for page in self.pages:
+            if isinstance(page, Exception):
+                raise page
+            yield {'Users': [{'UserName': user_name} for user_name in page]}
+
+
+@pytest.fixture
+def iam(aws):
+    iam = boto3.client('iam')
+    for group_name, user_names in [('first', ['alice', 'bob']),
+                                   ('second', ['carol'])]:
+        iam.create_group(GroupName=group_name)
+        for user_name in user_names:
+            iam.create_user(UserName=user_name)
+            iam.add_user_to_group(GroupName=group_name, UserName=user_name)
+    return iam
+
+
+def throttled():
+    return ClientError({'Error': {'Code': 'Throttling',
+                                  'Message': 'Rate exceeded'}}, 'GetGroup')
+
+
+def test_group_lists_are_split_on_commas():
+    assert parse_exemption_groups(' first, second ,,') == ['first', 'second']
+    assert parse_exemption_groups('') == []
+    assert parse_exemption_groups(None) == []
+
+
+def test_members_of_all_groups_are_exempt(iam):
+    assert validate_exemption_group('first, second, missing', iam, log) == \
+        (True, frozenset({'alice', 'bob', 'carol'}))
+
+
+def test_all_pages_of_a_group_are_read(iam, monkeypatch):
+    monkeypatch.setattr(iam, 'get_paginator', lambda operation_name:
+                        FakePaginator([['alice', 'bob'], ['carol']]))
+
+    assert get_exemption_group('first', iam) == \
+        frozenset({'alice', 'bob', 'carol'})
+
+
+def test_failed_page_fails_the_account(iam, monkeypatch):
+    monkeypatch.setattr(iam, 'get_paginator', lambda operation_name:
+                        FakePaginator([['alice'], throttled()]))
+
+    # a partial membership would enforce on exempt users
+    with pytest.raises(ClientError):
+        validate_exemption_group('first', iam, log)
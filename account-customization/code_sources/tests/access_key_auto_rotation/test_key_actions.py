@@ -0,0 +1,126 @@
+
+
+import json
+import threading
+import time
+
+import boto3
+import pytest
+
+import key_actions
+from account_snapshot import load_account_snapshot
+from decision_engine import KeyRecord
+
+ACCOUNT_ID = '123456789012'
+
+OTHER_SECRET_POLICY = json.dumps({
+    'Version': '2012-10-17',
+    'Statement': [{
+        'Effect': 'Allow',
+        'Action': 'secretsmanager:GetSecretValue',
+        'Resource': f'arn:aws:secretsmanager:us-east-1:{ACCOUNT_ID}'
+                    ':secret:other'}]})
+
+
+@pytest.fixture
+def user(aws):
+    boto3.client('iam').create_user(UserName='user')
+    # rotate_key only creates the new key
+    return KeyRecord('user', 'AKIAEXPIRED', None)
+
+
+def get_stored_policy():
+    return boto3.client('iam').get_user_policy(
+        UserName='user', PolicyName='SecretsAccessPolicy')['PolicyDocument']
+
+
+def rotate_with_snapshot(key):
+    session = boto3.Session(region_name='us-east-1')
+    snapshot = load_account_snapshot(boto3.client('iam'))
+    return key_actions.rotate_key(key, session, None, snapshot)
+
+
+def test_existing_policy_is_not_overwritten(user):
+    boto3.client('iam').put_user_policy(UserName='user',
+                                        PolicyName='SecretsAccessPolicy',
+                                        PolicyDocument=OTHER_SECRET_POLICY)
+
+    rotate_with_snapshot(user)
+
+    assert 'secret:other' in json.dumps(get_stored_policy())
+
+
+def test_missing_policy_is_written(user):
+    rotate_with_snapshot(user)
+
+    assert 'secret:other' not in json.dumps(get_stored_policy())
+
+
+def test_snapshot_saves_the_user_reads(user, monkeypatch):
+    rotate_with_snapshot(user)
+    calls = []
+    get_client = key_actions.get_client
+    monkeypatch.setattr(
+        key_actions, 'get_client',
+        lambda *args: RecordingClient(get_client(*args), calls))
+
+    calls_saved = rotate_with_snapshot(user)
+
+    assert 'get_user' not in calls
+    assert 'get_user_policy' not in calls
+    assert 'put_user_policy' not in calls
+    # the resource policy is written on every rotation, without a read
+    assert 'get_resource_policy' not in calls
+    assert 'put_resource_policy' in calls
+    assert calls_saved == 3
+
+
+def test_failed_replicas_are_not_missing():
+    secret = {'ReplicationStatus': [
+        {'Region': 'us-west-1', 'Status': 'InSync'},
+        {'Region': 'us-west-2', 'Status': 'Failed'}]}
+    regions = ['us-west-1', 'us-west-2', 'eu-west-1']
+
+    assert key_actions.get_missing_replica_regions(secret, regions) == \
+        ['eu-west-1']
+    assert key_actions.get_failed_replica_regions(secret, regions) == \
+        ['us-west-2']
+
+
+class RecordingClient:
+    """Records the called methods of a client."""
+
+    def __init__(self, client, calls):
+        self._client = client
+        self._calls = calls
+
+    def __getattr__(self, name):
+        self._calls.append(name)
+        return getattr(self._client, name)
+
+
+def test_session_account_id_is_fetched_once(monkeypatch):
+    calls = []
+
+    class StsClient:
+        def get_caller_identity(self):
+            calls.append(1)
+            time.sleep(0.01)
+            return {'Account': ACCOUNT_ID}
+
+    class Session:
+        pass
+
+    monkeypatch.setattr(key_actions, 'get_client',
+                        lambda service, session: StsClient())
+    session = Session()
+    threads = [threading.Thread(
+        target=key_actions.get_session_account_id, args=(session,))
+        for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert key_actions.get_session_account_id(session) == ACCOUNT_ID
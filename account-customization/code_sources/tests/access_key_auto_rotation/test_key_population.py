@@ -0,0 +1,76 @@
+"""Key population parity with evaluate_keys.
+
+tools/key_population.py applies the decision table to many users at once,
+a seeded random population of users with up to two keys is classified by
+it and by evaluate_keys user by user. Dates are whole hours relative to
+the evaluation time, so keys also expire and leave their grace periods
+exactly at the evaluation time.
+"""
+
+import os
+import random
+import sys
+
+from collections import Counter
+
+import pytest
+
+pytest.importorskip('numpy')
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', 'tools'))
+
+from decision_engine import ActionReasons, evaluate_keys
+from key_population import KeyPopulation, classify_keys
+from test_decision_engine import NOW, THRESHOLDS, get_key_metadata
+
+NUM_USERS = 5000
+
+# beyond the rotation period of 90 days
+MAX_AGE_HOURS = 120 * 24
+
+
+def get_random_keys(rng):
+    keys = []
+    for _ in range(rng.randint(0, 2)):
+        create_hours = -rng.randint(0, MAX_AGE_HOURS)
+        last_used_hours = None if rng.random() < 0.25 \
+            else rng.randint(create_hours, 0)
+        keys.append([rng.choice(['Active', 'Inactive']), create_hours,
+                     last_used_hours])
+    return keys
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_classify_keys_matches_evaluate_keys(seed):
+    rng = random.Random(seed)
+    users = [(f'user-{n}', get_key_metadata(get_random_keys(rng)))
+             for n in range(NUM_USERS)]
+    force_rotate = [rng.random() < 0.2 for _ in range(NUM_USERS)]
+
+    expected = {}
+    for (user_name, keys), force in zip(users, force_rotate):
+        for action in evaluate_keys(keys, NOW, THRESHOLDS, force):
+            expected.setdefault(user_name, []).append(
+                (action.action, action.key.access_key_id, action.reason,
+                 action.action_date))
+    population_actions = classify_keys(
+        KeyPopulation.from_key_metadata(users), NOW, THRESHOLDS,
+        np.array(force_rotate))
+    actual = {}
+    for user, slot, action, reason, date in \
+            population_actions.iter_actions():
+        actual.setdefault(users[user][0], []).append(
+            (action, f'KEY{slot}', reason, date))
+
+    assert {user_name: sorted(actions, key=repr)
+            for user_name, actions in actual.items()} == \
+        {user_name: sorted(actions, key=repr)
+         for user_name, actions in expected.items()}
+    assert population_actions.reason_counts() == Counter(
+        reason for actions in expected.values()
+        for _, _, reason, _ in actions)
+    # every rule is reached
+    assert set(population_actions.reason_counts()) == set(ActionReasons)
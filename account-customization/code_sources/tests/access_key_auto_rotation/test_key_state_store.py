@@ -0,0 +1,85 @@
+import datetime
+
+import boto3
+import pytest
+
+from key_state_store import DynamoDBKeyStateStore, SQLiteKeyStateStore, \
+    UserKeyState
+
+TABLE = 'key-state'
+ACCOUNT_ID = '123456789012'
+NOW = datetime.datetime(2024, 6, 1, 12, tzinfo=datetime.timezone.utc)
+
+
+def user_state(user_name, days):
+    next_evaluation = NOW + datetime.timedelta(days=days)
+    return UserKeyState(user_name, next_evaluation, [
+        {'AccessKeyId': f'AKIA{user_name.upper()}',
+         'RotateDate': next_evaluation}])
+
+
+@pytest.fixture(params=['sqlite', 'dynamodb'])
+def store(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteKeyStateStore(str(tmp_path / 'key_state.sqlite'))
+    request.getfixturevalue('aws')
+    boto3.client('dynamodb').create_table(
+        TableName=TABLE,
+        KeySchema=[{'AttributeName': 'AccountId', 'KeyType': 'HASH'},
+                   {'AttributeName': 'UserName', 'KeyType': 'RANGE'}],
+        AttributeDefinitions=[
+            {'AttributeName': 'AccountId', 'AttributeType': 'S'},
+            {'AttributeName': 'UserName', 'AttributeType': 'S'},
+            {'AttributeName': 'NextEvaluation', 'AttributeType': 'S'}],
+        LocalSecondaryIndexes=[{
+            'IndexName': DynamoDBKeyStateStore.NEXT_EVALUATION_INDEX,
+            'KeySchema': [
+                {'AttributeName': 'AccountId', 'KeyType': 'HASH'},
+                {'AttributeName': 'NextEvaluation', 'KeyType': 'RANGE'}],
+            'Projection': {'ProjectionType': 'KEYS_ONLY'}}],
+        BillingMode='PAY_PER_REQUEST')
+    return DynamoDBKeyStateStore(TABLE, boto3.client('dynamodb'))
+
+
+def test_only_users_not_due_are_returned(store):
+    store.put_user_states(ACCOUNT_ID, [user_state('due', -1),
+                                       user_state('later', 3),
+                                       user_state('now', 0)])
+    store.put_user_states('210987654321', [user_state('other', 3)])
+    store.put_account_next_evaluation(
+        ACCOUNT_ID, NOW + datetime.timedelta(days=5))
+
+    # the account item is not a user
+    assert store.get_users_not_due(ACCOUNT_ID, NOW) == {
+        'later': NOW + datetime.timedelta(days=3)}
+    assert store.get_user_names(ACCOUNT_ID) == {'due', 'later', 'now'}
+
+
+def test_stored_user_states_are_replaced(store):
+    store.put_user_states(ACCOUNT_ID, [user_state('user', 3)])
+    store.put_user_states(ACCOUNT_ID, [user_state('user', -1)])
+
+    assert store.get_users_not_due(ACCOUNT_ID, NOW) == {}
+
+
+def test_deleted_users_are_removed(store):
+    store.put_user_states(ACCOUNT_ID, [user_state(f'user-{n}', 3)
+                                       for n in range(30)])
+
+    store.delete_users(ACCOUNT_ID, {f'user-{n}' for n in range(1, 30)})
+
+    assert store.get_user_names(ACCOUNT_ID) == {'user-0'}
+
+
+def test_account_next_evaluation_round_trips(store):
+    assert store.get_account_next_evaluation(ACCOUNT_ID) is None
+
+    # stored in UTC, read back as the same instant
+    next_evaluation = datetime.datetime(
+        2024, 6, 3, 8, 30, tzinfo=datetime.timezone(
+            datetime.timedelta(hours=-4)))
+    store.put_account_next_evaluation(ACCOUNT_ID, next_evaluation)
+    store.put_account_next_evaluation(ACCOUNT_ID, next_evaluation)
+
+    assert store.get_account_next_evaluation(ACCOUNT_ID) == next_evaluation
+    assert store.get_user_names(ACCOUNT_ID) == set()
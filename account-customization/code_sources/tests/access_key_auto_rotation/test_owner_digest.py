@@ -0,0 +1,128 @@
+
+
+import json
+
+import boto3
+import pytest
+
+import main
+import owner_digest
+from owner_digest import DynamoDBDigestStore, OwnerDigest, \
+    SQLiteDigestStore
+
+TABLE = 'owner-digest'
+
+
+class Context:
+    aws_request_id = 'request'
+    invoked_function_arn = \
+        'arn:aws:lambda:us-east-1:123456789012:function:rotation'
+
+
+@pytest.fixture
+def dynamodb_store(aws):
+    boto3.client('dynamodb').create_table(
+        TableName=TABLE,
+        KeySchema=[{'AttributeName': 'RunId', 'KeyType': 'HASH'},
+                   {'AttributeName': 'EntryKey', 'KeyType': 'RANGE'}],
+        AttributeDefinitions=[
+            {'AttributeName': 'RunId', 'AttributeType': 'S'},
+            {'AttributeName': 'EntryKey', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST')
+    return DynamoDBDigestStore(TABLE, boto3.client('dynamodb'))
+
+
+@pytest.fixture(params=['sqlite', 'dynamodb'])
+def store(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteDigestStore(str(tmp_path / 'digest.sqlite'))
+    return request.getfixturevalue('dynamodb_store')
+
+
+@pytest.fixture
+def sent_payloads(monkeypatch):
+    payloads = []
+    monkeypatch.setattr(owner_digest, 'invoke_notifier',
+                        lambda payload: payloads.append(json.loads(payload)))
+    return payloads
+
+
+def test_entries_are_kept_per_recipient(store):
+    store.add('run', 'owner@example.com', 'enforce',
+              [('111111111111', 'first', 'rotated'),
+               ('111111111111', 'first', 'deleted')])
+    store.add('run', 'other@example.com', 'enforce',
+              [('222222222222', 'second', 'warned')])
+    store.add('other-run', 'owner@example.com', 'enforce',
+              [('333333333333', 'third', 'warned')])
+
+    assert sorted(store.recipients('run')) == [
+        ('other@example.com', 'enforce'), ('owner@example.com', 'enforce')]
+    assert store.entries('run', 'owner@example.com', 'enforce') == [
+        ('111111111111', 'first', 'rotated'),
+        ('111111111111', 'first', 'deleted')]
+
+    store.delete('run', 'owner@example.com', 'enforce')
+
+    assert store.recipients('run') == [('other@example.com', 'enforce')]
+
+
+def test_finishing_a_batch_again_has_no_effect(store):
+    assert store.finish_batches('run', ['0']) == 1
+    assert store.finish_batches('run', ['0', '1']) == 2
+    assert store.finish_batches('run', ['1']) == 2
+    assert store.finish_batches('run', []) == 2
+
+
+def test_retried_account_overwrites_its_entries(dynamodb_store):
+    for _ in range(2):
+        dynamodb_store.add('run', 'owner@example.com', 'enforce',
+                           [('111111111111', 'first', 'rotated')])
+
+    assert dynamodb_store.entries('run', 'owner@example.com', 'enforce') == \
+        [('111111111111', 'first', 'rotated')]
+
+
+def test_digest_is_sent_by_the_last_batch_of_the_run(dynamodb_store,
+                                                     sent_payloads):
+    digest = OwnerDigest('run', dynamodb_store)
+    events = [{'run_id': 'run', 'defer_digest': True, 'batch_ids': [n],
+               'run_batches': 3} for n in range(3)]
+
+    for n, event in enumerate(events):
+        dynamodb_store.add('run', 'owner@example.com', 'enforce',
+                           [(f'{n:012d}', f'account-{n}', 'rotated')])
+        main.send_digest(digest, event, Context())
+        if n < 2:
+            assert sent_payloads == []
+
+    assert len(sent_payloads) == 1
+    assert sent_payloads[0]['email'] == 'owner@example.com'
+    assert sent_payloads[0]['template_values']['account_name'] == '3 accounts'
+    assert dynamodb_store.recipients('run') == []
+
+
+def test_digest_is_sent_at_once_without_defer(dynamodb_store,
+                                              sent_payloads):
+    dynamodb_store.add('run', 'owner@example.com', 'enforce',
+                       [('111111111111', 'first', 'rotated')])
+
+    main.send_digest(OwnerDigest('run', dynamodb_store), {'run_id': 'run'},
+                     Context())
+
+    assert len(sent_payloads) == 1
+
+
+def test_local_store_sends_the_digest_of_each_invocation(tmp_path,
+                                                         sent_payloads):
+    store = SQLiteDigestStore(str(tmp_path / 'digest.sqlite'))
+    store.add('run', 'owner@example.com', 'enforce',
+              [('111111111111', 'first', 'rotated')])
+
+    # the other batches of the run finish in other containers
+    main.send_digest(OwnerDigest('run', store),
+                     {'run_id': 'run', 'defer_digest': True,
+                      'batch_ids': [0], 'run_batches': 3}, Context())
+
+    assert len(sent_payloads) == 1
+    assert store.recipients('run') == []
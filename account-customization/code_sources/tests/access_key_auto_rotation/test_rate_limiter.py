@@ -0,0 +1,43 @@
+import boto3
+import pytest
+
+from botocore.awsrequest import AWSResponse
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+import rate_limiter
+
+THROTTLING_RESPONSE = b'''<ErrorResponse>
+  <Error><Type>Sender</Type><Code>Throttling</Code>
+    <Message>Rate exceeded</Message></Error>
+  <RequestId>request</RequestId>
+</ErrorResponse>'''
+
+
+class RawResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+def test_every_attempt_takes_a_token(monkeypatch):
+    acquired = []
+    monkeypatch.setattr(rate_limiter, 'RATE_LIMITS', {'sts': 1000})
+    monkeypatch.setattr(rate_limiter.AdaptiveTokenBucket, 'acquire',
+                        lambda bucket: acquired.append(bucket.name))
+    session = boto3.Session()
+    client = session.client('sts', config=Config(
+        retries={'mode': 'standard', 'total_max_attempts': 3}))
+    rate_limiter.limit_client_rate(client, session)
+    # every attempt is throttled, no request reaches AWS
+    client.meta.events.register(
+        'before-send.sts.GetCallerIdentity',
+        lambda request, **kwargs: AWSResponse(
+            request.url, 400, {}, RawResponse(THROTTLING_RESPONSE)))
+
+    with pytest.raises(ClientError):
+        client.get_caller_identity()
+
+    assert acquired == ['sts us-east-1'] * 3
@@ -0,0 +1,281 @@
+
+
+import json
+
+import boto3
+import pytest
+
+import key_actions
+import main
+import scan_checkpoint
+import sts_connection_handler
+from decision_engine import Action, ActionReasons, ActionType, KeyRecord
+from key_actions import ActionResult
+from owner_digest import OwnerDigest, SQLiteDigestStore
+from scan_checkpoint import FileCheckpointStore, ScanProgress, \
+    ScanSuspended
+
+BUCKET = 'scan-checkpoints'
+ACCOUNT_ID = '123456789012'
+EVENT = {'account': ACCOUNT_ID, 'name': 'account',
+         'email': 'admin@example.com'}
+
+ACTIONS = [
+    Action(ActionType.DEACTIVATE, KeyRecord(f'user-{n}', f'KEY{n}', None),
+           ActionReasons.EXPIRED_ACTIVE_KEY, None, None)
+    for n in range(3)]
+
+
+class Context:
+    """A context whose remaining time is taken from a list."""
+
+    aws_request_id = 'request'
+    invoked_function_arn = \
+        'arn:aws:lambda:us-east-1:123456789012:function:rotation'
+
+    def __init__(self, remaining_seconds=()):
+        self.remaining_seconds = list(remaining_seconds)
+
+    def get_remaining_time_in_millis(self):
+        if self.remaining_seconds:
+            return self.remaining_seconds.pop(0) * 1000
+        return 300000
+
+
+class FakeLambdaClient:
+    def __init__(self, error=None):
+        self.error = error
+        self.events = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        if self.error:
+            raise self.error
+        self.events.append(json.loads(Payload))
+
+
+@pytest.fixture
+def store(aws, monkeypatch):
+    boto3.client('s3').create_bucket(Bucket=BUCKET)
+    monkeypatch.setattr(scan_checkpoint.config, 'scanCheckpointStore', 's3')
+    monkeypatch.setattr(scan_checkpoint.config, 'scanCheckpointBucket',
+                        BUCKET)
+    scan_checkpoint.checkpoint_stores.clear()
+    yield scan_checkpoint.get_checkpoint_store()
+    scan_checkpoint.checkpoint_stores.clear()
+
+
+@pytest.fixture
+def lambda_client(monkeypatch):
+    client = FakeLambdaClient()
+    get_client = scan_checkpoint.get_client
+    monkeypatch.setattr(
+        scan_checkpoint, 'get_client',
+        lambda service, *args: client if service == 'lambda'
+        else get_client(service, *args))
+    return client
+
+
+def get_tokens():
+    objects = boto3.client('s3').list_objects_v2(Bucket=BUCKET)
+    return sorted(item['Key'].rsplit('/', 1)[1][:-len('.json')]
+                  for item in objects.get('Contents', []))
+
+
+def store_load(token):
+    return scan_checkpoint.get_checkpoint_store().load(token)
+
+
+def suspend(progress, processed_users):
+    with pytest.raises(ScanSuspended) as suspended:
+        progress.suspend(processed_users, [], None)
+    return suspended.value
+
+
+def test_scan_resumes_after_the_processed_users(store):
+    first = suspend(ScanProgress(ACCOUNT_ID, Context(), store),
+                    ['alice', 'bob'])
+    resumed = ScanProgress(ACCOUNT_ID, Context(), store,
+                           first.continuation_token)
+    second = suspend(resumed, ['carol'])
+
+    assert first.continuation_token == f'{ACCOUNT_ID}-request.1'
+    assert second.continuation_token == f'{ACCOUNT_ID}-request.2'
+    assert second.resumed_token == first.continuation_token
+    assert resumed.processed_users == ['alice', 'bob']
+    assert [user for user, _ in resumed.skip_processed(
+        [('alice', None), ('carol', None), ('dave', None)])] == \
+        ['carol', 'dave']
+
+
+def test_resumed_checkpoint_is_kept_until_the_scan_continues(
+        store, lambda_client):
+    first = suspend(ScanProgress(ACCOUNT_ID, Context(), store), ['alice'])
+    second = suspend(ScanProgress(ACCOUNT_ID, Context(), store,
+                                  first.continuation_token), ['bob'])
+
+    assert get_tokens() == [first.continuation_token,
+                            second.continuation_token]
+
+    scan_checkpoint.continue_scan(Context(), {'account': ACCOUNT_ID},
+                                  second.resumed_token)
+
+    assert get_tokens() == [second.continuation_token]
+    assert lambda_client.events == [{'account': ACCOUNT_ID}]
+
+
+def test_failed_continuation_keeps_the_resumed_checkpoint(
+        store, lambda_client):
+    first = suspend(ScanProgress(ACCOUNT_ID, Context(), store), ['alice'])
+    second = suspend(ScanProgress(ACCOUNT_ID, Context(), store,
+                                  first.continuation_token), ['bob'])
+    lambda_client.error = RuntimeError('Rate exceeded')
+
+    with pytest.raises(RuntimeError):
+        scan_checkpoint.continue_scan(Context(), {}, second.resumed_token)
+
+    # the retry of the invocation resumes from the same checkpoint and
+    # stores its own under the same token
+    retry = ScanProgress(ACCOUNT_ID, Context(), store,
+                         first.continuation_token)
+    assert retry.processed_users == ['alice']
+    assert suspend(retry, ['bob']).continuation_token == \
+        second.continuation_token
+
+
+def test_missing_checkpoint_scans_from_the_start(store):
+    progress = ScanProgress(ACCOUNT_ID, Context(), store,
+                            f'{ACCOUNT_ID}-request.1')
+
+    assert progress.processed_users == []
+    assert suspend(progress, ['alice']).continuation_token == \
+        f'{ACCOUNT_ID}-request.2'
+
+
+def test_file_store_refuses_container_local_directories(tmp_path):
+    with pytest.raises(ValueError):
+        FileCheckpointStore(str(tmp_path))
+    with pytest.raises(ValueError):
+        FileCheckpointStore(None)
+
+
+def test_account_scan_is_continued_by_the_next_invocation(
+        store, lambda_client, monkeypatch):
+    monkeypatch.setattr(main.Config, 'dryrun', True)
+    iam = boto3.client('iam')
+    for n in range(6):
+        iam.create_user(UserName=f'user-{n}')
+    sts_connection_handler.clear_session_cache()
+    event = {'account': ACCOUNT_ID, 'name': 'account',
+             'email': 'admin@example.com'}
+
+    # the time is up after the third user
+    main.lambda_handler(event, Context([300, 300, 10]))
+
+    assert len(lambda_client.events) == 1
+    continuation = lambda_client.events[0]
+    assert continuation['continuation_token'] == f'{ACCOUNT_ID}-request.1'
+    assert json.loads(store.load(continuation['continuation_token']))[
+        'processed_users'] == ['user-0', 'user-1', 'user-2']
+
+    main.lambda_handler(continuation, Context())
+
+    assert len(lambda_client.events) == 1
+    assert get_tokens() == []
+
+
+def test_suspended_invocation_sends_its_digest_first(
+        lambda_client, tmp_path, monkeypatch):
+    sent = []
+    monkeypatch.setattr(main.Config, 'ownerDigest', True)
+    digest_store = SQLiteDigestStore(str(tmp_path / 'digest.sqlite'))
+    monkeypatch.setattr(main, 'get_digest_store', lambda: digest_store)
+    monkeypatch.setattr(OwnerDigest, 'flush',
+                        lambda digest, context: sent.append(digest.run_id))
+    monkeypatch.setattr(
+        main, 'continue_scan',
+        lambda context, event, resumed_token: sent.append(event))
+
+    def evaluate_account(event, context, digest):
+        suspended = ScanSuspended(f'{ACCOUNT_ID}-request.1')
+        suspended.event = {**event, 'continuation_token':
+                           suspended.continuation_token}
+        raise suspended
+
+    monkeypatch.setattr(main, 'evaluate_account', evaluate_account)
+
+    main.lambda_handler({'account': ACCOUNT_ID}, Context())
+
+    assert sent == ['request', {'account': ACCOUNT_ID, 'continuation_token':
+                                f'{ACCOUNT_ID}-request.1',
+                                'run_id': 'request'}]
+
+
+@pytest.fixture
+def execution(store, lambda_client, monkeypatch):
+    """Executes ACTIONS one user at a time, returns the notified actions."""
+    notified = []
+    executed = []
+    monkeypatch.setattr(main.Config, 'dryrun', False)
+    monkeypatch.setattr(key_actions.config, 'actionWorkers', 1)
+    monkeypatch.setattr(main, 'get_account_session', lambda *args: None)
+    monkeypatch.setattr(main, 'get_central_account_session', lambda: None)
+    monkeypatch.setattr(main.Config, 'accountSnapshot', False)
+    monkeypatch.setattr(main, 'get_actions_for_account',
+                        lambda *args: list(ACTIONS))
+
+    def execute_chain(chain, *args):
+        executed.extend(chain)
+        return [ActionResult(action, 'SUCCEEDED', None, 0)
+                for action in chain]
+
+    monkeypatch.setattr(key_actions, 'execute_chain', execute_chain)
+    monkeypatch.setattr(
+        main, 'send_to_notifier',
+        lambda context, account_id, account_name, recipient, actions, *args:
+        notified.append(actions))
+    return executed, notified
+
+
+def test_execution_is_continued_by_the_next_invocation(
+        execution, lambda_client):
+    executed, notified = execution
+
+    # the time is up after the first user
+    main.lambda_handler(EVENT, Context([300, 10]))
+
+    continuation = lambda_client.events[0]
+    token = continuation['continuation_token']
+    assert executed == ACTIONS[:1]
+    assert notified == [ACTIONS[:1]]
+    assert json.loads(store_load(token)) == {
+        'account_id': ACCOUNT_ID, 'phase': 'execute',
+        'actions': [scan_checkpoint.serialize_action(action)
+                    for action in ACTIONS[1:]]}
+
+    main.lambda_handler(continuation, Context())
+
+    # the scan is not repeated
+    assert executed == ACTIONS
+    assert notified == [ACTIONS[:1], ACTIONS[1:]]
+    assert len(lambda_client.events) == 1
+    assert get_tokens() == []
+
+
+def test_checkpoint_is_kept_until_the_actions_are_notified(
+        execution, lambda_client, monkeypatch):
+    executed, _ = execution
+    main.lambda_handler(EVENT, Context([300, 10]))
+    continuation = lambda_client.events[0]
+
+    def send_to_notifier(*args):
+        raise RuntimeError('Rate exceeded')
+
+    monkeypatch.setattr(main, 'send_to_notifier', send_to_notifier)
+    with pytest.raises(RuntimeError):
+        main.lambda_handler(continuation, Context())
+
+    # the retry of the invocation does not execute the actions again
+    assert get_tokens() == [continuation['continuation_token']]
+    main.lambda_handler(continuation, Context())
+    assert executed == ACTIONS
+    assert get_tokens() == []
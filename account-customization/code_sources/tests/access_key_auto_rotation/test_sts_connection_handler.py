@@ -0,0 +1,65 @@
+
+
+import gc
+
+import pytest
+
+import client_factory
+import main
+import rate_limiter
+import sts_connection_handler
+
+ACCOUNT_IDS = [f'{100000000000 + n:012d}' for n in range(10)]
+
+
+class Context:
+    aws_request_id = 'request'
+    invoked_function_arn = \
+        'arn:aws:lambda:us-east-1:123456789012:function:rotation'
+
+    def get_remaining_time_in_millis(self):
+        return 300000
+
+
+@pytest.fixture(autouse=True)
+def clear_session_cache():
+    sts_connection_handler.clear_session_cache()
+    yield
+    sts_connection_handler.clear_session_cache()
+
+
+def get_live_sessions():
+    gc.collect()
+    return len(client_factory._clients), len(rate_limiter._rate_limiters)
+
+
+def test_account_sessions_are_released_after_evaluation(aws, monkeypatch):
+    monkeypatch.setattr(rate_limiter, 'RATE_LIMITS', {'iam': 1000})
+    main.evaluate_account({'account': ACCOUNT_IDS[0], 'name': 'first',
+                           'email': 'admin@example.com', 'dryrun': 'true'},
+                          Context())
+    baseline = get_live_sessions()
+
+    for account_id in ACCOUNT_IDS[1:]:
+        main.evaluate_account({'account': account_id, 'name': account_id,
+                               'email': 'admin@example.com',
+                               'dryrun': 'true'}, Context())
+
+    assert get_live_sessions() == baseline
+
+
+def test_central_session_is_reused(aws):
+    first = sts_connection_handler.get_central_account_session()
+    second = sts_connection_handler.get_central_account_session()
+
+    assert first is second
+    assert sts_connection_handler.get_session_cache_stats()['hits'] >= 1
+
+
+def test_account_sessions_are_not_cached(aws):
+    first = sts_connection_handler.get_account_session(ACCOUNT_IDS[0],
+                                                       'rotation-role')
+    second = sts_connection_handler.get_account_session(ACCOUNT_IDS[0],
+                                                        'rotation-role')
+
+    assert first is not second
@@ -0,0 +1,116 @@
+import threading
+import time
+
+import boto3
+import pytest
+
+from user_pipeline import iter_users, map_in_order, prefetch_pages
+
+
+class PageSource:
+    """Pages of numbered users, recording how many have been fetched."""
+
+    def __init__(self, num_pages, page_size, fail_on_page=None):
+        self.num_pages = num_pages
+        self.page_size = page_size
+        self.fail_on_page = fail_on_page
+        self.fetched = 0
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        for page_number in range(self.num_pages):
+            if page_number == self.fail_on_page:
+                raise RuntimeError(f'page {page_number} failed')
+            with self.lock:
+                self.fetched += 1
+            yield {'Users': [
+                {'UserName': f'user-{page_number * self.page_size + n}'}
+                for n in range(self.page_size)]}
+
+
+class FakeIAMClient:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def get_paginator(self, operation_name):
+        assert operation_name == 'list_users'
+        return self
+
+    def paginate(self):
+        return self.pages
+
+
+def test_users_of_all_pages_are_streamed_in_order():
+    users = iter_users(FakeIAMClient(PageSource(num_pages=3, page_size=4)))
+
+    assert [user['UserName'] for user in users] == \
+        [f'user-{n}' for n in range(12)]
+
+
+def test_users_are_listed(aws):
+    iam = boto3.client('iam')
+    for n in range(5):
+        iam.create_user(UserName=f'user-{n}')
+
+    assert sorted(user['UserName'] for user in iter_users(iam)) == \
+        [f'user-{n}' for n in range(5)]
+
+
+def test_one_page_is_fetched_ahead():
+    source = PageSource(num_pages=5, page_size=1)
+    pages = prefetch_pages(source)
+
+    for page_number, page in enumerate(pages):
+        assert page['Users'] == [{'UserName': f'user-{page_number}'}]
+        # the page being fetched may not be done yet
+        assert source.fetched in (page_number + 1, page_number + 2)
+    assert source.fetched == 5
+
+
+def test_failed_page_is_raised_to_the_reader():
+    pages = prefetch_pages(PageSource(num_pages=3, page_size=1,
+                                      fail_on_page=1))
+
+    assert next(pages)['Users'] == [{'UserName': 'user-0'}]
+    with pytest.raises(RuntimeError, match='page 1 failed'):
+        next(pages)
+
+
+def slow_square(n):
+    # later items finish first
+    time.sleep((10 - n % 10) / 1000)
+    return n * n
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_results_are_in_the_order_of_the_items(max_workers):
+    assert list(map_in_order(slow_square, range(30), max_workers)) == \
+        [n * n for n in range(30)]
+
+
+def test_items_in_flight_are_bounded():
+    max_workers = 3
+    drawn = []
+
+    def items():
+        for n in range(50):
+            drawn.append(n)
+            yield n
+
+    for n, result in enumerate(map_in_order(slow_square, items(),
+                                            max_workers)):
+        assert result == n * n
+        assert len(drawn) <= n + 2 * max_workers
+
+
+def test_failed_item_is_raised_in_order():
+    def square(n):
+        if n == 3:
+            raise ValueError('item 3 failed')
+        return n * n
+
+    results = map_in_order(square, range(10), max_workers=4)
+
+    assert [next(results) for _ in range(3)] == [0, 1, 4]
+    with pytest.raises(ValueError, match='item 3 failed'):
+        next(results)
@@ -0,0 +1,5 @@
+
+
+from lambda_functions import use_function
+
+use_function('account_inventory')
@@ -0,0 +1,79 @@
+
+
+import json
+
+import pytest
+
+import main
+
+ACCOUNTS = [{'Id': f'{100000000000 + n:012d}', 'Name': f'account-{n}',
+             'Email': 'admin@example.com', 'Status': 'ACTIVE'}
+            for n in range(5)]
+
+
+class FakeLambdaClient:
+    """Records the invocations, failing those of the given accounts."""
+
+    class exceptions:
+        ClientError = Exception
+
+    def __init__(self, failing_accounts=()):
+        self.failing_accounts = set(failing_accounts)
+        self.events = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        event = json.loads(Payload)
+        accounts = event.get('accounts', [event])
+        if any(account.get('account') in self.failing_accounts
+               for account in accounts):
+            raise self.exceptions.ClientError('Rate exceeded')
+        self.events.append(event)
+
+
+@pytest.fixture
+def lambda_client(monkeypatch):
+    def use_client(failing_accounts=()):
+        client = FakeLambdaClient(failing_accounts)
+        monkeypatch.setattr(main, 'get_client', lambda service: client)
+        return client
+    return use_client
+
+
+@pytest.fixture
+def defer_owner_digest(monkeypatch):
+    monkeypatch.setattr(main.config, 'deferOwnerDigest', True)
+    monkeypatch.setattr(main.config, 'accountsPerInvocation', 2)
+
+
+def test_payloads_without_digest(lambda_client, monkeypatch):
+    monkeypatch.setattr(main.config, 'accountsPerInvocation', 1)
+    client = lambda_client()
+
+    main.run_lambda_function(ACCOUNTS, 'rotation', 'run')
+
+    assert sorted(event['account'] for event in client.events) == \
+        [account['Id'] for account in ACCOUNTS]
+    assert all('defer_digest' not in event for event in client.events)
+
+
+def test_batches_defer_the_digest(lambda_client, defer_owner_digest):
+    client = lambda_client()
+
+    summary = main.run_lambda_function(ACCOUNTS, 'rotation', 'run')
+
+    assert summary['batches_succeeded'] == 3
+    assert sorted(event['batch_ids'] for event in client.events) == \
+        [[0], [1], [2]]
+    assert all(event['defer_digest'] and event['run_batches'] == 3 and
+               event['run_id'] == 'run' for event in client.events)
+
+
+def test_failed_batches_are_finished(lambda_client, defer_owner_digest):
+    client = lambda_client(failing_accounts=[ACCOUNTS[2]['Id']])
+
+    summary = main.run_lambda_function(ACCOUNTS, 'rotation', 'run')
+
+    assert summary['batches_failed'] == 1
+    assert client.events[-1] == {'accounts': [], 'run_id': 'run',
+                                 'defer_digest': True, 'batch_ids': [1],
+                                 'run_batches': 3}
@@ -0,0 +1,122 @@
+import threading
+
+import pytest
+
+import org_tree
+from org_tree import clear_ou_cache, get_accounts_for_ous, get_ou_tree
+
+# ou id -> (account ids, child ou ids)
+ORGANIZATION = {
+    'ou-root': (['111111111111'], ['ou-a', 'ou-b']),
+    'ou-a': (['222222222222'], ['ou-a1']),
+    'ou-b': ([], ['ou-b1', 'ou-b2']),
+    'ou-a1': (['333333333333', '111111111111'], []),
+    'ou-b1': (['444444444444'], []),
+    'ou-b2': ([], []),
+}
+
+
+class ClientError(Exception):
+    pass
+
+
+class FakeOrgClient:
+    """Pages an organization, one account or child per page."""
+
+    class exceptions:
+        ClientError = ClientError
+
+    def __init__(self, organization, failing_ous=()):
+        self.organization = organization
+        self.failing_ous = set(failing_ous)
+        self.fetched = []
+        self.lock = threading.Lock()
+
+    def get_paginator(self, operation_name):
+        return FakePaginator(self, operation_name)
+
+
+class FakePaginator:
+    def __init__(self, client, operation_name):
+        self.client = client
+        self.operation_name = operation_name
+
+    def paginate(self, ParentId, **kwargs):
+        if ParentId in self.client.failing_ous:
+            raise ClientError(f'{ParentId} failed')
+        account_ids, child_ou_ids = self.client.organization[ParentId]
+        if self.operation_name == 'list_accounts_for_parent':
+            with self.client.lock:
+                self.client.fetched.append(ParentId)
+            for account_id in account_ids:
+                yield {'Accounts': [{'Id': account_id}]}
+        else:
+            for child_ou_id in child_ou_ids:
+                yield {'Children': [{'Id': child_ou_id}]}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(org_tree, 'time', clock)
+    clear_ou_cache()
+    yield clock
+    clear_ou_cache()
+
+
+def test_nested_ous_are_walked_level_by_level(clock):
+    client = FakeOrgClient(ORGANIZATION)
+
+    tree = get_ou_tree(client, ['ou-root'])
+
+    assert tree == {ou_id: ([{'Id': account_id} for account_id
+                             in account_ids], child_ou_ids)
+                    for ou_id, (account_ids, child_ou_ids)
+                    in ORGANIZATION.items()}
+    # the OUs of a level are fetched in any order
+    levels = [{'ou-root'}, {'ou-a', 'ou-b'}, {'ou-a1', 'ou-b1', 'ou-b2'}]
+    assert [set(client.fetched[:1]), set(client.fetched[1:3]),
+            set(client.fetched[3:])] == levels
+
+
+def test_accounts_of_nested_root_ous_are_listed_once(clock):
+    accounts = get_accounts_for_ous(FakeOrgClient(ORGANIZATION),
+                                    ['ou-a', 'ou-root'])
+
+    assert sorted(account['Id'] for account in accounts) == \
+        ['111111111111', '222222222222', '333333333333', '444444444444']
+
+
+def test_cached_ous_are_fetched_again_after_the_ttl(clock):
+    client = FakeOrgClient(ORGANIZATION)
+    ttl = org_tree.Config.orgTreeCacheTtl
+    get_ou_tree(client, ['ou-root'])
+
+    clock.now = ttl
+    get_ou_tree(client, ['ou-root'])
+    assert len(client.fetched) == len(ORGANIZATION)
+
+    clock.now = ttl + 1
+    get_ou_tree(client, ['ou-root'])
+    assert len(client.fetched) == 2 * len(ORGANIZATION)
+
+
+def test_failed_ous_are_not_cached(clock):
+    client = FakeOrgClient(ORGANIZATION, failing_ous=['ou-b'])
+
+    tree = get_ou_tree(client, ['ou-root'])
+
+    # the children of the failed OU are not known
+    assert tree['ou-b'] == ([], [])
+    assert 'ou-b1' not in tree
+    client.failing_ous.clear()
+    assert get_ou_tree(client, ['ou-root']) == get_ou_tree(
+        FakeOrgClient(ORGANIZATION), ['ou-root'])
@@ -0,0 +1,25 @@
+
+
+"""Test setup shared by all functions.
+
+The configs of the functions read the environment when they are imported,
+the variables they require are set before any test module is collected.
+No test reaches AWS: clients are created with dummy credentials and the
+tests that make calls run under moto.
+"""
+
+import os
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+os.environ['AWS_SESSION_TOKEN'] = 'testing'
+os.environ.setdefault('CredentialReplicationRegions', '')
+os.environ.setdefault('IAMExemptionGroup', 'KeyRotationExemption')
+os.environ.setdefault('ResourceOwnerTag', 'owner')
+os.environ.setdefault('IAMAssumedRoleName', 'rotation-role')
+os.environ.setdefault('RoleSessionName', 'rotation-tests')
+os.environ.setdefault('OrgListAccount', '999999999999')
+os.environ.setdefault('OrgListRole', 'org-list-role')
+# calls are not paced in the tests
+os.environ.setdefault('RateLimits', '{}')
@@ -0,0 +1,35 @@
+
+
+"""Lambda Functions.
+
+The functions import their modules by flat name, and several of them have
+a config, main or client_factory module of their own. use_function puts
+the directory of one function on sys.path and unloads the modules of the
+others, each test directory calls it from its conftest before the test
+modules are collected.
+"""
+
+import os
+import sys
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                          'Lambda')
+
+FUNCTIONS = ('access_key_auto_rotation', 'account_inventory', 'notifier')
+
+
+def get_function_dir(function_name):
+    return os.path.abspath(os.path.join(LAMBDA_DIR, function_name))
+
+
+def use_function(function_name):
+    """Makes the modules of a function importable by their flat names."""
+    function_dirs = {get_function_dir(name) for name in FUNCTIONS}
+    for module_name, module in list(sys.modules.items()):
+        module_file = getattr(module, '__file__', None)
+        if module_file and os.path.dirname(
+                os.path.abspath(module_file)) in function_dirs:
+            del sys.modules[module_name]
+    sys.path[:] = [path for path in sys.path
+                   if os.path.abspath(path) not in function_dirs]
+    sys.path.insert(0, get_function_dir(function_name))
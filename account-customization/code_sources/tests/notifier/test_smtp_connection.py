@@ -0,0 +1,178 @@
+
+
+import smtplib
+
+import pytest
+
+import smtp_connection
+from smtp_connection import SmtpConnection
+
+MESSAGE = ('admin@example.com', 'owner@example.com', 'Subject: test\n\nbody')
+
+
+class FakeCredentials:
+    def __init__(self):
+        self.fetches = 0
+        self.credentials = None
+
+    def get(self):
+        if self.credentials is None:
+            self.fetches += 1
+            self.credentials = ('user', f'password-{self.fetches}')
+        return self.credentials
+
+    def invalidate(self):
+        self.credentials = None
+
+
+class FakeServer:
+    """
+    An SMTP_SSL session. Errors queued on the class are raised by the next
+    session that is opened.
+    """
+
+    instances = []
+    next_login_errors = []
+    next_send_errors = []
+
+    def __init__(self, host, port):
+        self.sent = []
+        self.login_errors = FakeServer.next_login_errors
+        self.send_errors = FakeServer.next_send_errors
+        FakeServer.next_login_errors = []
+        FakeServer.next_send_errors = []
+        self.noop_code = 250
+        self.closed = False
+        FakeServer.instances.append(self)
+
+    def login(self, user, password):
+        if self.login_errors:
+            raise self.login_errors.pop(0)
+
+    def sendmail(self, sender, recipients, message):
+        if self.send_errors:
+            raise self.send_errors.pop(0)
+        self.sent.append((sender, recipients, message))
+
+    def noop(self):
+        return self.noop_code, b'OK'
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def fake_server(monkeypatch):
+    FakeServer.instances = []
+    FakeServer.next_login_errors = []
+    FakeServer.next_send_errors = []
+    monkeypatch.setattr(smtp_connection.smtplib, 'SMTP_SSL', FakeServer)
+
+
+def get_connection(health_check_after=10):
+    return SmtpConnection('email-smtp.us-east-1.amazonaws.com', 465,
+                          FakeCredentials(), health_check_after)
+
+
+def test_session_is_reused():
+    connection = get_connection()
+
+    connection.send_messages([MESSAGE])
+    connection.send_messages([MESSAGE, MESSAGE])
+
+    assert len(FakeServer.instances) == 1
+    assert len(FakeServer.instances[0].sent) == 3
+    assert connection.stats == {'connects': 1, 'reconnects': 0, 'sent': 3}
+
+
+def test_first_send_failing_does_not_break_later_sends():
+    connection = get_connection()
+    FakeServer.next_send_errors = [smtplib.SMTPRecipientsRefused(
+        {'owner@example.com': (550, b'refused')})]
+
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        connection.send_messages([MESSAGE])
+
+    assert FakeServer.instances[0].closed
+    assert connection.send_messages([MESSAGE]) == 1
+    assert len(FakeServer.instances) == 2
+    assert FakeServer.instances[1].sent == [MESSAGE]
+    assert connection.stats['reconnects'] == 0
+
+
+def test_dropped_session_is_reconnected_once():
+    connection = get_connection()
+    connection.send_messages([MESSAGE])
+    FakeServer.instances[0].send_errors.append(
+        smtplib.SMTPServerDisconnected('Connection unexpectedly closed'))
+
+    connection.send_messages([MESSAGE])
+
+    assert len(FakeServer.instances) == 2
+    assert FakeServer.instances[1].sent == [MESSAGE]
+    assert connection.stats == {'connects': 2, 'reconnects': 1, 'sent': 2}
+
+
+def test_socket_error_is_reconnected():
+    connection = get_connection()
+    connection.send_messages([MESSAGE])
+    FakeServer.instances[0].send_errors.append(
+        ConnectionResetError('Connection reset by peer'))
+
+    connection.send_messages([MESSAGE])
+
+    assert connection.stats['reconnects'] == 1
+    assert FakeServer.instances[1].sent == [MESSAGE]
+
+
+def test_failed_reconnect_closes_the_session():
+    connection = get_connection()
+    connection.send_messages([MESSAGE])
+    FakeServer.instances[0].send_errors.append(
+        smtplib.SMTPServerDisconnected('Connection unexpectedly closed'))
+    FakeServer.next_send_errors = [
+        smtplib.SMTPServerDisconnected('Connection unexpectedly closed')]
+
+    with pytest.raises(smtplib.SMTPServerDisconnected):
+        connection.send_messages([MESSAGE])
+
+    assert FakeServer.instances[1].closed
+    assert connection.send_messages([MESSAGE]) == 1
+
+
+def test_idle_session_is_checked_with_noop():
+    connection = get_connection(health_check_after=0)
+    connection.send_messages([MESSAGE])
+    FakeServer.instances[0].noop_code = 421
+
+    connection.send_messages([MESSAGE])
+
+    assert len(FakeServer.instances) == 2
+    assert FakeServer.instances[0].closed
+    assert connection.stats['reconnects'] == 0
+
+
+def test_login_is_retried_with_fresh_credentials():
+    connection = get_connection()
+    FakeServer.next_login_errors = [
+        smtplib.SMTPAuthenticationError(535, b'bad credentials')]
+
+    connection.send_messages([MESSAGE])
+
+    assert connection.credentials.fetches == 2
+    assert FakeServer.instances[0].sent == [MESSAGE]
+
+
+def test_failed_login_closes_the_server():
+    connection = get_connection()
+    FakeServer.next_login_errors = [
+        smtplib.SMTPAuthenticationError(535, b'bad credentials')] * 2
+
+    with pytest.raises(smtplib.SMTPAuthenticationError):
+        connection.send_messages([MESSAGE])
+
+    assert FakeServer.instances[0].closed
+    assert connection.send_messages([MESSAGE]) == 1
@@ -0,0 +1,49 @@
+
+
+import boto3
+import pytest
+
+from botocore.exceptions import ClientError
+
+from template_cache import TemplateCache
+
+BUCKET = 'templates'
+KEY = 'prefix/Template/enforce.html'
+
+
+@pytest.fixture
+def s3_client(aws):
+    s3_client = boto3.client('s3', region_name='us-east-1')
+    s3_client.create_bucket(Bucket=BUCKET)
+    s3_client.put_object(Bucket=BUCKET, Key=KEY, Body=b'<p>{{actions}}</p>')
+    return s3_client
+
+
+def test_template_is_revalidated_after_ttl(s3_client):
+    template_cache = TemplateCache(max_size=4, ttl=0)
+    first = template_cache.get(s3_client, BUCKET, KEY, 'enforce.html')
+
+    second = template_cache.get(s3_client, BUCKET, KEY, 'enforce.html')
+
+    assert second is first
+    assert template_cache.stats['revalidated'] == 1
+
+
+def test_cached_template_is_served_when_revalidation_fails(s3_client):
+    template_cache = TemplateCache(max_size=4, ttl=0)
+    first = template_cache.get(s3_client, BUCKET, KEY, 'enforce.html')
+    s3_client.delete_object(Bucket=BUCKET, Key=KEY)
+
+    second = template_cache.get(s3_client, BUCKET, KEY, 'enforce.html')
+
+    assert second is first
+    assert second.body == '<p>{{actions}}</p>'
+    assert template_cache.stats['stale'] == 1
+
+
+def test_error_is_raised_when_nothing_is_cached(s3_client):
+    template_cache = TemplateCache(max_size=4, ttl=0)
+
+    with pytest.raises(ClientError):
+        template_cache.get(s3_client, BUCKET, 'prefix/Template/missing.html',
+                           'missing.html')
@@ -0,0 +1,40 @@
+from template_renderer import compile_template, render_template
+
+TEMPLATE = '<p>Hello {{name}},</p><ul>{{actions}}</ul><p>{{name}}</p>'
+
+
+def test_values_are_html_escaped():
+    rendered = render_template(compile_template(TEMPLATE), {
+        'name': '<script>alert("x")</script> & co',
+        'actions': []})
+
+    escaped = '&lt;script&gt;alert(&quot;x&quot;)&lt;/script&gt; &amp; co'
+    assert rendered == f'<p>Hello {escaped},</p><ul></ul><p>{escaped}</p>'
+
+
+def test_list_values_are_escaped_per_line():
+    rendered = render_template(compile_template(TEMPLATE), {
+        'name': 'alice',
+        'actions': ['Rotate <AKIA1>', "Delete 'AKIA2'"]})
+
+    assert '<ul>&bull; Rotate &lt;AKIA1&gt;<br>' \
+        '&bull; Delete &#x27;AKIA2&#x27;<br></ul>' in rendered
+
+
+def test_values_are_not_rendered_as_placeholders():
+    rendered = render_template(compile_template(TEMPLATE), {
+        'name': '{{actions}}', 'actions': ['key']})
+
+    # the rendered value is not searched for placeholders again
+    assert rendered == '<p>Hello {{actions}},</p><ul>&bull; key<br></ul>' \
+        '<p>{{actions}}</p>'
+
+
+def test_placeholders_without_a_value_are_kept():
+    assert render_template(compile_template(TEMPLATE), {'name': 'alice'}) \
+        == '<p>Hello alice,</p><ul>{{actions}}</ul><p>alice</p>'
+
+
+def test_template_without_placeholders_is_unchanged():
+    assert render_template(compile_template('<p>&amp;</p>'),
+                           {'name': '<b>'}) == '<p>&amp;</p>'
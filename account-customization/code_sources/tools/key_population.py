@@ -0,0 +1,513 @@
+
+
+"""Key Population.
+
+Classifies the access keys of many users at once, e.g. all keys of an
+organization read from credential reports, for audit reports and for
+comparing candidate rotation and grace periods. The keys are held in
+NumPy arrays with two key slots per user, and the rules of the
+decision_engine DECISION_TABLE are applied to all users in vectorized
+form. The action and reason of every key, and the counts per reason,
+equal those of evaluate_keys.
+
+Requires NumPy, see requirements.txt, which is not part of the Lambda
+runtime, so this module is kept out of the function packages. It imports
+decision_engine and credential_report_handler of the rotation function,
+whose directory has to be on sys.path, and its config reads the
+environment on import.
+"""
+
+import datetime
+
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+import decision_engine
+from decision_engine import ActionReasons, ActionType, DECISION_TABLE
+from credential_report_handler import parse_credential_report
+
+# Code 0 is no action, code n is ACTION_TYPES[n - 1]
+ACTION_TYPES = tuple(ActionType)
+ACTION_CODES = {action: code for code, action in enumerate(ACTION_TYPES, 1)}
+
+# Code 0 is no reason, code n is ACTION_REASONS[n - 1]
+ACTION_REASONS = tuple(ActionReasons)
+REASON_CODES = {reason: code for code, reason in
+                enumerate(ACTION_REASONS, 1)}
+
+NAT = np.datetime64('NaT', 'us')
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+# int64 value of NaT in a datetime64 array
+NAT_MICROSECONDS = NAT.astype(np.int64)
+
+
+def to_microseconds(date: Optional[datetime.datetime]) -> int:
+    """
+    :return The microseconds of a timezone aware date since the epoch, the
+        value of NaT for None.
+    """
+    if date is None:
+        return NAT_MICROSECONDS
+    return (date - EPOCH) // MICROSECOND
+
+
+def to_datetime64(date: Optional[datetime.datetime]):
+    """Converts a timezone aware date to a UTC datetime64, None to NaT."""
+    return np.int64(to_microseconds(date)).astype('datetime64[us]')
+
+
+def to_datetime(value) -> Optional[datetime.datetime]:
+    """Converts a UTC datetime64 to a timezone aware date, NaT to None."""
+    if np.isnat(value):
+        return None
+    return value.astype('datetime64[us]').item().replace(
+        tzinfo=datetime.timezone.utc)
+
+
+class KeyPopulation:
+    """
+    The access keys of many users. Every column has one row per user and
+    one column per key slot; a slot holds the keys in the order of the
+    user's key records, an empty slot has a NaT create date.
+    """
+
+    def __init__(self, user_names, active, create_date,
+                 last_used_date) -> None:
+        self.user_names = np.asarray(user_names, dtype=object)
+        self.active = np.asarray(active, dtype=bool)
+        self.create_date = np.asarray(create_date, dtype='datetime64[us]')
+        self.last_used_date = np.asarray(last_used_date,
+                                         dtype='datetime64[us]')
+        self.present = ~np.isnat(self.create_date)
+
+    def __len__(self):
+        return len(self.user_names)
+
+    @classmethod
+    def from_key_metadata(cls, users):
+        """
+        Loads key records as taken by evaluate_keys.
+
+        :param users: Iterable of (user name, list of key records)
+        :return The KeyPopulation.
+        """
+        user_names = []
+        active = []
+        create_date = []
+        last_used_date = []
+        for user_name, access_key_metadata in users:
+            if len(access_key_metadata) > 2:
+                raise ValueError(
+                    f'User {user_name} has {len(access_key_metadata)} keys,'
+                    f' at most 2 are supported')
+            keys = list(access_key_metadata) + \
+                [None] * (2 - len(access_key_metadata))
+            user_names.append(user_name)
+            active.append([key is not None and key['Status'] == 'Active'
+                           for key in keys])
+            create_date.append([to_microseconds(key and key['CreateDate'])
+                                for key in keys])
+            last_used_date.append([
+                to_microseconds(key and key['LastUsedDate'])
+                for key in keys])
+        return cls(user_names,
+                   np.array(active, dtype=bool).reshape(-1, 2),
+                   np.array(create_date, dtype=np.int64).reshape(-1, 2).view(
+                       'datetime64[us]'),
+                   np.array(last_used_date, dtype=np.int64).reshape(
+                       -1, 2).view('datetime64[us]'))
+
+    @classmethod
+    def from_credential_reports(cls, credential_reports):
+        """
+        Loads the keys of the credential reports of many accounts. The user
+        names are prefixed with the account id, e.g. 111122223333/alice.
+
+        :param credential_reports: Dict of account id -> credential report
+            content
+        :return The KeyPopulation.
+        """
+        return cls.from_key_metadata(
+            (f'{account_id}/{user_name}', access_key_metadata)
+            for account_id, report_content in credential_reports.items()
+            for user_name, access_key_metadata
+            in parse_credential_report(report_content))
+
+
+@dataclass
+class PopulationActions:
+    """
+    The actions of a KeyPopulation, one code per user and key slot. The
+    unused columns hold the actions on never used keys that evaluate_keys
+    takes before it applies the decision table, the rule columns the
+    actions of the decision table.
+    """
+
+    unused_action: np.ndarray
+    unused_reason: np.ndarray
+    unused_date: np.ndarray
+    rule_action: np.ndarray
+    rule_reason: np.ndarray
+    rule_date: np.ndarray
+
+    def reason_counts(self):
+        """
+        :return Counter of ActionReasons -> number of actions.
+        """
+        counts = np.bincount(self.unused_reason.ravel(),
+                             minlength=len(ACTION_REASONS) + 1) + \
+            np.bincount(self.rule_reason.ravel(),
+                        minlength=len(ACTION_REASONS) + 1)
+        return Counter({reason: int(count) for reason, count
+                        in zip(ACTION_REASONS, counts[1:]) if count})
+
+    def action_counts(self):
+        """
+        :return Counter of ActionType -> number of actions.
+        """
+        counts = np.bincount(self.unused_action.ravel(),
+                             minlength=len(ACTION_TYPES) + 1) + \
+            np.bincount(self.rule_action.ravel(),
+                        minlength=len(ACTION_TYPES) + 1)
+        return Counter({action: int(count) for action, count
+                        in zip(ACTION_TYPES, counts[1:]) if count})
+
+    def iter_actions(self):
+        """
+        Lists the actions, e.g. to write an audit report.
+
+        :return A generator of (user index, key slot, ActionType,
+            ActionReasons, action date or None) tuples.
+        """
+        for action, reason, date in (
+                (self.unused_action, self.unused_reason, self.unused_date),
+                (self.rule_action, self.rule_reason, self.rule_date)):
+            for user, slot in zip(*np.nonzero(action)):
+                yield (int(user), int(slot),
+                       ACTION_TYPES[action[user, slot] - 1],
+                       ACTION_REASONS[reason[user, slot] - 1],
+                       to_datetime(date[user, slot]))
+
+
+class _RuleArrays:
+    """The output columns of the decision table rules."""
+
+    def __init__(self, num_users) -> None:
+        self.action = np.zeros((num_users, 2), dtype=np.int8)
+        self.reason = np.zeros((num_users, 2), dtype=np.int8)
+        self.date = np.full((num_users, 2), NAT)
+
+    def set(self, mask, slot, action, reason, date=None):
+        """
+        Sets the action of the key in slot of the users in mask.
+
+        :param slot: The key slot, an int or one slot per user
+        :param date: The action date, None or one date per user
+        """
+        users = np.nonzero(mask)[0]
+        slots = slot[users] if isinstance(slot, np.ndarray) else slot
+        self.action[users, slots] = ACTION_CODES[action]
+        self.reason[users, slots] = REASON_CODES[reason]
+        if date is not None:
+            self.date[users, slots] = date[users]
+
+
+class _RuleContext:
+    """Values shared by the vectorized rules during one evaluation."""
+
+    def __init__(self, population, now, thresholds, force_rotate,
+                 first_slot) -> None:
+        self.now = now
+        self.warn_by = now + np.timedelta64(thresholds.warn_period, 'us')
+        self.installation_grace_period = np.timedelta64(
+            thresholds.installation_grace_period, 'us')
+        self.recovery_grace_period = np.timedelta64(
+            thresholds.recovery_grace_period, 'us')
+        self.force_rotate = force_rotate
+        self.create_date = population.create_date
+        self.last_used_date = population.last_used_date
+        self.active = population.active
+        self.expire_date = population.create_date + np.timedelta64(
+            thresholds.rotation_period, 'us')
+        # slot of the first key left for the decision table
+        self.first_slot = first_slot
+        self.users = np.arange(len(population))
+
+    def get(self, column, slot):
+        """
+        :return The values of a column in slot, an int or one per user.
+        """
+        return column[self.users, slot]
+
+
+def _other_slot(slot):
+    return 1 - slot
+
+
+def _grace_period_rule(ctx, out, mask, key, other_key, end_date, end_action,
+                       end_reason, pending_reason):
+    """
+    The rules of key pairs where one key waits for the end of a grace
+    period and the other key for its rotation.
+
+    :param key: Slot of the key waiting for the grace period end
+    :param other_key: Slot of the key waiting for its rotation
+    """
+    rotation_date = ctx.get(ctx.expire_date, other_key)
+    rotation_due = rotation_date <= ctx.warn_by
+    ended = mask & (end_date <= ctx.now)
+    # take the end action, warn if the other key is about to be rotated
+    out.set(ended, key, end_action, end_reason)
+    out.set(ended & rotation_due, other_key, ActionType.WARN,
+            ActionReasons.KEY_PENDING_ROTATION, rotation_date)
+    # warn if the other key is about to be rotated, the key will be
+    # deleted due to conflict
+    conflict = mask & ~ended & rotation_due
+    out.set(conflict, key, ActionType.WARN,
+            ActionReasons.KEY_PENDING_DELETION_CONFLICT, rotation_date)
+    out.set(conflict, other_key, ActionType.WARN,
+            ActionReasons.KEY_PENDING_ROTATION, rotation_date)
+    # warn if the grace period is about to end
+    out.set(mask & ~ended & ~rotation_due & (end_date <= ctx.warn_by), key,
+            ActionType.WARN, pending_reason, end_date)
+
+
+def _single_active_expired(ctx, out, mask):
+    out.set(mask, ctx.first_slot, ActionType.ROTATE,
+            ActionReasons.EXPIRED_ACTIVE_KEY)
+
+
+def _single_active_valid(ctx, out, mask):
+    key = ctx.first_slot
+    forced = mask & ctx.force_rotate
+    out.set(forced, key, ActionType.ROTATE, ActionReasons.FORCED_ROTATION)
+    expire_date = ctx.get(ctx.expire_date, key)
+    out.set(mask & ~forced & (expire_date <= ctx.warn_by), key,
+            ActionType.WARN, ActionReasons.KEY_PENDING_ROTATION, expire_date)
+
+
+def _single_inactive(ctx, out, mask):
+    key = ctx.first_slot
+    delete_date = ctx.get(ctx.create_date, key) + \
+        ctx.installation_grace_period + ctx.recovery_grace_period
+    ended = mask & (delete_date <= ctx.now)
+    out.set(ended, key, ActionType.DELETE,
+            ActionReasons.RECOVER_GRACE_PERIOD_END)
+    out.set(mask & ~ended & (delete_date <= ctx.warn_by), key,
+            ActionType.WARN, ActionReasons.KEY_PENDING_DELETION, delete_date)
+
+
+def _inactive_pair_expired(ctx, out, mask):
+    for key in (0, 1):
+        out.set(mask, key, ActionType.DELETE,
+                ActionReasons.RECOVER_GRACE_PERIOD_END)
+
+
+def _inactive_pair_one_expired(ctx, out, mask):
+    # the older key is taken as the expired one
+    expired_key = np.where(
+        ctx.create_date[:, 1] < ctx.create_date[:, 0], 1, 0)
+    unexpired_key = _other_slot(expired_key)
+    delete_date = ctx.get(ctx.create_date, unexpired_key) + \
+        ctx.installation_grace_period + ctx.recovery_grace_period
+    _grace_period_rule(ctx, out, mask, expired_key, unexpired_key,
+                       delete_date, ActionType.DELETE,
+                       ActionReasons.RECOVER_GRACE_PERIOD_END,
+                       ActionReasons.KEY_PENDING_DELETION)
+
+
+def _active_expired_with_inactive(ctx, out, mask):
+    active_key = np.where(ctx.active[:, 0], 0, 1)
+    out.set(mask, _other_slot(active_key), ActionType.DELETE,
+            ActionReasons.EXPIRED_INACTIVE_KEY_CONFLICT)
+    out.set(mask, active_key, ActionType.ROTATE,
+            ActionReasons.EXPIRED_ACTIVE_KEY)
+
+
+def _active_valid_with_inactive(ctx, out, mask):
+    active_key = np.where(ctx.active[:, 0], 0, 1)
+    inactive_key = _other_slot(active_key)
+    forced = mask & ctx.force_rotate
+    out.set(forced, inactive_key, ActionType.DELETE,
+            ActionReasons.FORCED_INACTIVE_KEY_CONFLICT)
+    out.set(forced, active_key, ActionType.ROTATE,
+            ActionReasons.FORCED_ROTATION)
+
+    # the inactive key was deactivated when the active key was created,
+    # or when it was last used if that is later
+    rotation_date = ctx.get(ctx.create_date, active_key)
+    last_used_date = ctx.get(ctx.last_used_date, inactive_key)
+    rotation_date = np.where(
+        ~np.isnat(last_used_date) & (last_used_date > rotation_date),
+        last_used_date, rotation_date)
+    delete_date = rotation_date + ctx.installation_grace_period + \
+        ctx.recovery_grace_period
+    _grace_period_rule(ctx, out, mask & ~forced, inactive_key, active_key,
+                       delete_date, ActionType.DELETE,
+                       ActionReasons.RECOVER_GRACE_PERIOD_END,
+                       ActionReasons.KEY_PENDING_DELETION)
+
+
+def _active_pair_rotate_lru(ctx, out, mask, delete_reason, rotate_reason):
+    # delete the least recently used key, or the one never used, or the
+    # oldest one if neither was used
+    used = ~np.isnat(ctx.last_used_date)
+    last_used_date = ctx.last_used_date
+    key_to_delete = np.where(
+        used[:, 0] & used[:, 1],
+        np.where(last_used_date[:, 1] < last_used_date[:, 0], 1, 0),
+        np.where(used[:, 0], 1, np.where(
+            used[:, 1], 0,
+            np.where(ctx.create_date[:, 0] <= ctx.create_date[:, 1], 0, 1))))
+    out.set(mask, key_to_delete, ActionType.DELETE, delete_reason)
+    out.set(mask, _other_slot(key_to_delete), ActionType.ROTATE,
+            rotate_reason)
+
+
+def _active_pair_forced(ctx, out, mask):
+    _active_pair_rotate_lru(ctx, out, mask & ctx.force_rotate,
+                            ActionReasons.FORCED_ROTATION_CONFLICT_LRU,
+                            ActionReasons.FORCED_ROTATION)
+    return mask & ~ctx.force_rotate
+
+
+def _active_pair_expired(ctx, out, mask):
+    _active_pair_rotate_lru(ctx, out, mask,
+                            ActionReasons.EXPIRED_ACTIVE_KEY_CONFLICT_LRU,
+                            ActionReasons.EXPIRED_ACTIVE_KEY)
+
+
+def _active_pair_one_expired(ctx, out, mask):
+    mask = _active_pair_forced(ctx, out, mask)
+    expired_key = np.where(ctx.expire_date[:, 0] <= ctx.now, 0, 1)
+    unexpired_key = _other_slot(expired_key)
+    deactivation_date = ctx.get(ctx.create_date, unexpired_key) + \
+        ctx.installation_grace_period
+    _grace_period_rule(ctx, out, mask, expired_key, unexpired_key,
+                       deactivation_date, ActionType.DEACTIVATE,
+                       ActionReasons.INSTALL_GRACE_PERIOD_END,
+                       ActionReasons.KEY_PENDING_DEACTIVATION)
+
+
+def _active_pair_valid(ctx, out, mask):
+    mask = _active_pair_forced(ctx, out, mask)
+    older_key = np.where(ctx.expire_date[:, 1] < ctx.expire_date[:, 0], 1, 0)
+    newer_key = _other_slot(older_key)
+    rotation_date = ctx.get(ctx.expire_date, newer_key)
+    rotation_due = mask & (rotation_date <= ctx.warn_by)
+    out.set(rotation_due, older_key, ActionType.WARN,
+            ActionReasons.KEY_PENDING_DELETION_CONFLICT, rotation_date)
+    out.set(rotation_due, newer_key, ActionType.WARN,
+            ActionReasons.KEY_PENDING_ROTATION, rotation_date)
+    expire_date = ctx.get(ctx.expire_date, older_key)
+    out.set(mask & ~rotation_due & (expire_date <= ctx.warn_by), older_key,
+            ActionType.WARN, ActionReasons.KEY_PENDING_EXPIRATION_CONFLICT,
+            expire_date)
+
+
+# decision_engine rule -> vectorized rule
+VECTORIZED_RULES = {
+    decision_engine._single_active_expired: _single_active_expired,
+    decision_engine._single_active_valid: _single_active_valid,
+    decision_engine._single_inactive: _single_inactive,
+    decision_engine._inactive_pair_expired: _inactive_pair_expired,
+    decision_engine._inactive_pair_one_expired: _inactive_pair_one_expired,
+    decision_engine._active_expired_with_inactive:
+        _active_expired_with_inactive,
+    decision_engine._active_valid_with_inactive: _active_valid_with_inactive,
+    decision_engine._active_pair_expired: _active_pair_expired,
+    decision_engine._active_pair_one_expired: _active_pair_one_expired,
+    decision_engine._active_pair_valid: _active_pair_valid,
+}
+
+
+def _table_index(num_keys, num_active, num_expired_active,
+                 num_expired_inactive):
+    # each count is 0, 1 or 2
+    return num_keys * 27 + num_active * 9 + num_expired_active * 3 + \
+        num_expired_inactive
+
+
+# table index -> rule number, 0 for no action
+_RULE_FUNCTIONS = [None] + list(VECTORIZED_RULES.values())
+_RULE_INDEX = np.zeros(81, dtype=np.int8)
+for _counts, _rule in DECISION_TABLE.items():
+    if _rule is not decision_engine._no_action:
+        _RULE_INDEX[_table_index(*_counts)] = \
+            _RULE_FUNCTIONS.index(VECTORIZED_RULES[_rule])
+
+
+def classify_keys(population, now, thresholds, force_rotate=None):
+    """
+    Evaluates the keys of all users of a population, as evaluate_keys does
+    for each user.
+
+    :param population: The KeyPopulation
+    :param now: Timezone aware evaluation time
+    :param thresholds: Thresholds to evaluate the keys against
+    :param force_rotate: Whether the active key of each user must be
+        rotated, an array of one bool per user, or None
+    :return The PopulationActions.
+    """
+    num_users = len(population)
+    now = to_datetime64(now)
+    if force_rotate is None:
+        force_rotate = np.zeros(num_users, dtype=bool)
+    present = population.present
+    expire_date = population.create_date + np.timedelta64(
+        thresholds.rotation_period, 'us')
+    expired = present & (expire_date <= now)
+
+    # never used keys are deleted once they expire, and warned about
+    # before, the deleted keys are left out of the decision table
+    unused = present & np.isnat(population.last_used_date)
+    unused_expired = unused & expired
+    unused_warn = unused & ~expired & (
+        expire_date <= now + np.timedelta64(thresholds.warn_period, 'us'))
+    unused_out = _RuleArrays(num_users)
+    unused_out.action[unused_expired] = \
+        ACTION_CODES[ActionType.ROTATE_AND_DELETE]
+    unused_out.reason[unused_expired] = \
+        REASON_CODES[ActionReasons.UNUSED_EXPIRED_KEY]
+    unused_out.action[unused_warn] = ACTION_CODES[ActionType.WARN]
+    unused_out.reason[unused_warn] = \
+        REASON_CODES[ActionReasons.UNUSED_KEY_PENDING_DELETION]
+    unused_out.date[unused_warn] = expire_date[unused_warn]
+
+    evaluated = present & ~unused_expired
+    active = evaluated & population.active
+    rule_numbers = _RULE_INDEX[_table_index(
+        evaluated.sum(axis=1), active.sum(axis=1),
+        (active & expired).sum(axis=1),
+        (evaluated & ~population.active & expired).sum(axis=1))]
+
+    # a single evaluated key can be in either slot
+    first_slot = np.where(evaluated[:, 0], 0, 1)
+    ctx = _RuleContext(population, now, thresholds, force_rotate, first_slot)
+    rule_out = _RuleArrays(num_users)
+    for rule_number in np.unique(rule_numbers):
+        if rule_number:
+            _RULE_FUNCTIONS[rule_number](ctx, rule_out,
+                                         rule_numbers == rule_number)
+
+    return PopulationActions(unused_out.action, unused_out.reason,
+                             unused_out.date, rule_out.action,
+                             rule_out.reason, rule_out.date)
+
+
+def compare_thresholds(population, now, candidate_thresholds):
+    """
+    Classifies a population against candidate thresholds, e.g. other
+    rotation periods.
+
+    :param candidate_thresholds: Dict of name -> Thresholds
+    :return Dict of name -> Counter of ActionReasons -> number of actions.
+    """
+    return {name: classify_keys(population, now, thresholds).reason_counts()
+            for name, thresholds in candidate_thresholds.items()}
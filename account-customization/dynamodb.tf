@@ -0,0 +1,48 @@
+resource "aws_dynamodb_table" "owner_digest" {
+  count        = var.owner_digest ? 1 : 0
+  name         = var.digest_table
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "RunId"
+  range_key    = "EntryKey"
+
+  attribute {
+    name = "RunId"
+    type = "S"
+  }
+  attribute {
+    name = "EntryKey"
+    type = "S"
+  }
+  # entries of runs whose digest was never sent expire
+  ttl {
+    attribute_name = "ExpiresAt"
+    enabled        = true
+  }
+}
+
+resource "aws_dynamodb_table" "key_state" {
+  count        = var.key_state_store == "dynamodb" ? 1 : 0
+  name         = var.key_state_table
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "AccountId"
+  range_key    = "UserName"
+
+  attribute {
+    name = "AccountId"
+    type = "S"
+  }
+  attribute {
+    name = "UserName"
+    type = "S"
+  }
+  attribute {
+    name = "NextEvaluation"
+    type = "S"
+  }
+  # users of an account that are not due yet
+  local_secondary_index {
+    name            = "NextEvaluationIndex"
+    range_key       = "NextEvaluation"
+    projection_type = "KEYS_ONLY"
+  }
+}
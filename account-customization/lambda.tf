@@ -33,7 +33,7 @@ resource "aws_lambda_function" "access_key_rotation_lambda" {
       InactivePeriod               = var.inactive_period
       InactiveBuffer               = var.inactive_buffer
       RecoveryGracePeriod          = var.recovery_grace_period
-      IAMExemptionGroup            = var.iam_exception_group
+      IAMExemptionGroup            = join(",", concat([var.iam_exception_group], var.additional_iam_exception_groups))
       IAMAssumedRoleName           = var.iam_role_name
       RoleSessionName              = "ASA-IAM-Access-Key-Rotation-Function"
       Partition                    = data.aws_partition.current.partition
@@ -41,6 +41,18 @@ resource "aws_lambda_function" "access_key_rotation_lambda" {
       EmailTemplateEnforce         = var.email_template_enforcment
       EmailTemplateAudit           = var.email_template_audit
       ResourceOwnerTag             = var.resource_owner_tag
+      ScanMode                     = var.scan_mode
+      UserScanWorkers              = var.user_scan_workers
+      ActionWorkers                = var.action_workers
+      RateLimits                   = jsonencode(var.rate_limits)
+      AccountSnapshot              = var.use_account_snapshot
+      OwnerDigest                  = var.owner_digest
+      DigestStore                  = "dynamodb"
+      DigestTable                  = var.digest_table
+      KeyStateStore                = var.key_state_store
+      KeyStateTable                = var.key_state_table
+      ScanCheckpointStore          = var.scan_checkpoint_store
+      ScanCheckpointBucket         = var.scan_checkpoint_bucket
       StoreSecretsInCentralAccount = var.store_secrets_in_central_account
       CredentialReplicationRegions = var.credential_replication_region
       RunLambdaInVPC               = var.run_lambda_in_vpc
@@ -81,6 +93,9 @@ resource "aws_lambda_function" "account_inventory_lambda" {
       OrgListRole            = var.org_list_role
       RoleSessionName        = "ASA-IAM-Access-Account-Inventory-Function"
       RunLambdaInVPC         = var.run_lambda_in_vpc
+      InvocationConcurrency  = var.inventory_invocation_concurrency
+      AccountsPerInvocation  = var.accounts_per_rotation_invocation
+      DeferOwnerDigest       = var.owner_digest
     }
   }
   dynamic "vpc_config" {
@@ -29,6 +29,12 @@ variable "iam_exception_group" {
   description = "IAM group to exclude from evaluation"
 }
 
+variable "additional_iam_exception_groups" {
+  type        = list(string)
+  default     = []
+  description = "Additional existing IAM groups whose users are excluded from evaluation"
+}
+
 variable "iam_role_name" {
   type = string
   description = "IAM role name"
@@ -106,6 +112,92 @@ variable "dry_run_flag" {
   description = "Environment variable that defines whether to perform dry run or implement actual execution"
 }
 
+variable "scan_mode" {
+  type    = string
+  default = "api"
+  description = "How the key inventory of an account is built, either api (list users and keys) or credential_report (IAM credential report)"
+}
+
+variable "user_scan_workers" {
+  type    = number
+  default = 4
+  description = "Number of IAM users evaluated concurrently within one account, 1 evaluates users serially"
+}
+
+variable "action_workers" {
+  type    = number
+  default = 4
+  description = "Number of users whose key actions are executed concurrently by the rotation Lambda"
+}
+
+variable "use_account_snapshot" {
+  type    = bool
+  default = false
+  description = "Whether to load users, group memberships and tags of an account with GetAccountAuthorizationDetails instead of per user calls"
+}
+
+variable "inventory_invocation_concurrency" {
+  type    = number
+  default = 10
+  description = "Number of rotation Lambda invocations the account inventory Lambda makes concurrently"
+}
+
+variable "accounts_per_rotation_invocation" {
+  type    = number
+  default = 1
+  description = "Number of accounts evaluated by one rotation Lambda invocation, keep low enough for the rotation Lambda timeout"
+}
+
+variable "owner_digest" {
+  type    = bool
+  default = false
+  description = "Send resource owners one digest of the actions of all accounts of an account inventory run instead of one email per account. The entries are kept in the digest_table DynamoDB table, which spans the rotation Lambda invocations of a run"
+}
+
+variable "digest_table" {
+  type    = string
+  default = "iam-access-key-rotation-owner-digest"
+  description = "DynamoDB table of the owner digest, created when owner_digest is set. Set the same name as digest_table of global-account-customization, which grants the rotation role access to it"
+}
+
+variable "key_state_store" {
+  type    = string
+  default = "none"
+  description = "Store keeping the key dates of each user so users and accounts that are not due are skipped: none or dynamodb. The dynamodb store keeps them in the key_state_table DynamoDB table"
+  validation {
+    condition     = contains(["none", "dynamodb"], var.key_state_store)
+    error_message = "The key state store must be none or dynamodb, the sqlite store is local to one container of the rotation Lambda."
+  }
+}
+
+variable "key_state_table" {
+  type    = string
+  default = "iam-access-key-rotation-key-state"
+  description = "DynamoDB table of the dynamodb key state store, created when key_state_store is dynamodb. Set the same name as key_state_table of global-account-customization, which grants the rotation role access to it"
+}
+
+variable "scan_checkpoint_store" {
+  type    = string
+  default = "none"
+  description = "Store of the checkpoints of account scans that are suspended before the rotation Lambda times out and continued by a new invocation: none or s3. The file store needs a directory shared by all containers, e.g. an EFS mount, which this module does not configure. The rotation role gets lambda:InvokeFunction on the rotation Lambda from global-account-customization"
+}
+
+variable "scan_checkpoint_bucket" {
+  type    = string
+  default = ""
+  description = "S3 bucket of the s3 scan checkpoint store, set the same bucket as scan_checkpoint_bucket of global-account-customization, which grants the rotation role read, write and delete access to its scan-checkpoints/ prefix"
+}
+
+variable "rate_limits" {
+  type = map(number)
+  default = {
+    iam            = 20
+    secretsmanager = 40
+    sts            = 40
+  }
+  description = "Calls per second per account of the rotation Lambda, by service or service.Operation, e.g. iam.GetAccessKeyLastUsed. Rates shrink when calls are throttled and recover slowly; an empty map disables the limiter"
+}
+
 variable "store_secrets_in_central_account" {
   type    = bool
   default = false
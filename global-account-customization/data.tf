@@ -50,10 +50,47 @@ data "aws_iam_policy_document" "rotation_iam_role_policy" {
       "lambda:InvokeFunction"
     ]
     resources = [
-      "arn:${data.aws_partition.current.partition}:lambda:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:function:${var.notification_lambda_name}"
-      # aws_lambda_function.access_key_rotation_lambda.arn
+      "arn:${data.aws_partition.current.partition}:lambda:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:function:${var.notification_lambda_name}",
+      # suspended account scans are continued by invoking the rotation Lambda again
+      "arn:${data.aws_partition.current.partition}:lambda:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:function:${var.iam_access_rotation_lambda_name}"
     ]
   }
+  statement {
+    actions = [
+      "dynamodb:Query",
+      "dynamodb:GetItem",
+      "dynamodb:UpdateItem",
+      "dynamodb:BatchWriteItem"
+    ]
+    resources = [
+      "arn:${data.aws_partition.current.partition}:dynamodb:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:table/${var.digest_table}"
+    ]
+  }
+  statement {
+    actions = [
+      "dynamodb:Query",
+      "dynamodb:GetItem",
+      "dynamodb:PutItem",
+      "dynamodb:BatchWriteItem"
+    ]
+    resources = [
+      "arn:${data.aws_partition.current.partition}:dynamodb:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:table/${var.key_state_table}",
+      "arn:${data.aws_partition.current.partition}:dynamodb:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:table/${var.key_state_table}/index/NextEvaluationIndex"
+    ]
+  }
+  dynamic "statement" {
+    for_each = var.scan_checkpoint_bucket == "" ? [] : [var.scan_checkpoint_bucket]
+    content {
+      actions = [
+        "s3:GetObject",
+        "s3:PutObject",
+        "s3:DeleteObject"
+      ]
+      resources = [
+        "arn:${data.aws_partition.current.partition}:s3:::${statement.value}/${var.scan_checkpoint_prefix}*"
+      ]
+    }
+  }
   statement {
     actions = [
       "secretsmanager:PutResourcePolicy",
@@ -80,7 +117,10 @@ data "aws_iam_policy_document" "this" {
       "iam:PutUserPolicy",
       "iam:GetUserPolicy",
       "iam:GetAccessKeyLastUsed",
-      "iam:GetUser"
+      "iam:GetUser",
+      "iam:GenerateCredentialReport",
+      "iam:GetCredentialReport",
+      "iam:GetAccountAuthorizationDetails"
     ]
     resources = [
       "*",
@@ -115,7 +155,8 @@ data "aws_iam_policy_document" "this" {
       "iam:GetGroup",
     ]
     resources = [
-      "arn:${data.aws_partition.current.partition}:iam::${data.aws_caller_identity.current.account_id}:group/${var.iam_exception_group}",
+      for group in concat([var.iam_exception_group], var.additional_iam_exception_groups) :
+      "arn:${data.aws_partition.current.partition}:iam::${data.aws_caller_identity.current.account_id}:group/${group}"
     ]
   }
 }
@@ -13,15 +13,22 @@ variable "iam_exception_group" {
   description = "Name of the IAM Group for which the users in the group should be excluded from IAM access key rotation"
 }
 
+variable "additional_iam_exception_groups" {
+  type        = list(string)
+  default     = []
+  description = "Additional existing IAM groups whose users should be excluded from IAM access key rotation"
+}
+
 variable "primary_account_id" {
   type        = string
   description = "Primary account from which entire execution will be done"
 }
 
-# variable "iam_access_rotation_lambda_name" {
-#   type        = string
-#   description = "Name of IAM access keys rotation lambda"
-# }
+variable "iam_access_rotation_lambda_name" {
+  type        = string
+  description = "Name of IAM access keys rotation lambda, it invokes itself to continue suspended account scans"
+  default     = "iam-access-rotation-lambda"
+}
 
 variable "org_list_role" {
   type        = string
@@ -33,3 +40,27 @@ variable "notification_lambda_name" {
   description = "Name of the Lambda function that is used to send notifications"
   default     = "iam-access-notifier-lambda"
 }
+
+variable "scan_checkpoint_bucket" {
+  type        = string
+  default     = ""
+  description = "S3 bucket of the s3 scan checkpoint store of the rotation Lambda, empty when scans are not checkpointed to S3"
+}
+
+variable "scan_checkpoint_prefix" {
+  type        = string
+  default     = "scan-checkpoints/"
+  description = "Key prefix of the checkpoints in the scan checkpoint bucket"
+}
+
+variable "digest_table" {
+  type        = string
+  default     = "iam-access-key-rotation-owner-digest"
+  description = "DynamoDB table of the owner digest of the rotation Lambda, created by account-customization when owner_digest is set"
+}
+
+variable "key_state_table" {
+  type        = string
+  default     = "iam-access-key-rotation-key-state"
+  description = "DynamoDB table of the key state store of the rotation Lambda, created by account-customization when key_state_store is dynamodb"
+}